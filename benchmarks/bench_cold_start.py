@@ -0,0 +1,75 @@
+"""
+Measure a new worker's cold start: create_app, then its first request's time to first byte.
+
+Each scenario runs in a fresh interpreter, as a newly started worker:
+    no bytecode cache - templates compiled on first request.
+    bytecode cache - templates compiled by a previous worker.
+    warm up - WARM_UP_ON_STARTUP, with bytecode cache.
+
+Run from the repository root:
+    python -m benchmarks.bench_cold_start [--runs N] [--path /home/]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from pathlib import Path
+
+WORKER = """
+import json, sys, time
+start = time.perf_counter()
+from toonarmycaptain_website import create_app
+app = create_app(test_config=json.loads(sys.argv[1]))
+started = time.perf_counter()
+response = app.test_client().get(sys.argv[2])
+next(iter(response.response))  # First byte.
+first_byte = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps([started - start, first_byte - started]))
+"""
+
+SCENARIOS = {
+    'no bytecode cache': {'TEMPLATE_BYTECODE_CACHE_ENABLED': False},
+    'bytecode cache': {},
+    'warm up': {'WARM_UP_ON_STARTUP': True},
+}
+
+
+def cold_start(config: dict, path: str) -> tuple[float, float]:
+    """
+    :param config: dict app config
+    :param path: str to request
+    :return: tuple of (create_app seconds, first request seconds to first byte)
+    """
+    output = subprocess.run([sys.executable, '-c', WORKER, json.dumps(config), path],
+                            capture_output=True, text=True, check=True).stdout
+    startup, first_byte = json.loads(output)
+    return startup, first_byte
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/home/')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_config = {'SECRET_KEY': 'benchmark',
+                       'CONTACT_DATABASE_PATH': str(Path(temp_dir, 'bench.db')),
+                       'NOTIFICATION_WORKER': 'process',
+                       'TEMPLATE_BYTECODE_CACHE_DIR': str(Path(temp_dir, 'jinja')),
+                       }
+        cold_start(base_config, args.path)  # Create database, fill bytecode cache.
+        print(f'{"scenario":20} {"create_app ms":>14} {"first byte ms":>14} {"total ms":>9}')
+        for name, scenario_config in SCENARIOS.items():
+            timings = [cold_start({**base_config, **scenario_config}, args.path) for _ in range(args.runs)]
+            startup = statistics.median(startup for startup, _ in timings) * 1000
+            first_byte = statistics.median(first_byte for _, first_byte in timings) * 1000
+            print(f'{name:20} {startup:14.1f} {first_byte:14.1f} {startup + first_byte:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
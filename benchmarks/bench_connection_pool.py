@@ -0,0 +1,60 @@
+"""
+Benchmark contact submissions/sec with and without connection pooling.
+
+Run from the repository root:
+    python -m benchmarks.bench_connection_pool [--submissions N] [--threads N]
+"""
+import argparse
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from toonarmycaptain_website.database import ContactDatabase
+
+
+def submissions_per_second(pool_size: int, submissions: int, threads: int) -> float:
+    """
+    Time store_contact + email_sent, as for a contact form POST.
+
+    :param pool_size: int - 0 connects per call, as before pooling.
+    :param submissions: int
+    :param threads: int
+    :return: float
+    """
+    with tempfile.TemporaryDirectory() as db_dir:
+        database = ContactDatabase(database_path=Path(db_dir, 'bench.db'),
+                                   message_max_length=10000,
+                                   pool_size=pool_size)
+
+        def submit(submission: int) -> None:
+            message_id = database.store_contact(name=f'name {submission}',
+                                                email=f'{submission}@email.com',
+                                                message=f'message {submission}')
+            assert message_id is not None
+            database.email_sent(message_id)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(submit, range(submissions)))
+        elapsed = time.perf_counter() - start
+        database.close()
+    return submissions / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--submissions', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    unpooled = submissions_per_second(0, args.submissions, args.threads)
+    pooled = submissions_per_second(args.threads, args.submissions, args.threads)
+    print(f'unpooled (connect per call): {unpooled:8.1f} submissions/sec')
+    print(f'pooled ({args.threads} connections):    {pooled:8.1f} submissions/sec')
+    print(f'speedup: {pooled / unpooled:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
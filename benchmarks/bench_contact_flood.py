@@ -0,0 +1,141 @@
+"""
+Load test: page latency while a bot floods the contact form, with and without rate limiting.
+
+Serves the app with a threaded werkzeug server. Flooding threads POST valid
+contact submissions from one IP, each with a new email, as fast as they are
+answered, while a probe GETs the home and contact pages and records latency.
+Without a limit each POST is validated and written to the database, with one
+most are answered 429 before either.
+
+Run from the repository root:
+    python -m benchmarks.bench_contact_flood [--seconds N] [--flooders N] [--backend memory|sqlite]
+"""
+import argparse
+import http.client
+import itertools
+import logging
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from collections import Counter
+from pathlib import Path
+
+from werkzeug.serving import make_server
+
+from toonarmycaptain_website import create_app
+
+PROBE_PATHS = ('/home/', '/contact/')
+PROBE_INTERVAL = 0.01  # seconds
+
+
+def request(port: int, method: str, path: str, body: str | None = None) -> int:
+    """
+    :param port: int
+    :param method: str
+    :param path: str
+    :param body: str form encoded, or None.
+    :return: int status
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request(method, path, body,
+                           {'Content-Type': 'application/x-www-form-urlencoded'} if body else {})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def flood(port: int, stop: threading.Event, statuses: Counter, emails: itertools.count) -> None:
+    """
+    POST contact submissions until stop is set, counting response statuses.
+
+    :param port: int
+    :param stop: threading.Event
+    :param statuses: Counter
+    :param emails: itertools.count, shared so each submission has its own email.
+    :return: None
+    """
+    while not stop.is_set():
+        body = urllib.parse.urlencode({'name': 'Bot', 'email': f'bot{next(emails)}@example.com',
+                                       'message': 'Buy now! ' * 50})
+        statuses[request(port, 'POST', '/contact/', body)] += 1
+
+
+def probe(port: int, stop: threading.Event, latencies: list[float]) -> None:
+    """
+    GET PROBE_PATHS in turn until stop is set, recording latency.
+
+    :param port: int
+    :param stop: threading.Event
+    :param latencies: list of float seconds.
+    :return: None
+    """
+    for path in itertools.cycle(PROBE_PATHS):
+        if stop.wait(PROBE_INTERVAL):
+            return
+        start = time.perf_counter()
+        request(port, 'GET', path)
+        latencies.append(time.perf_counter() - start)
+
+
+def run(rate_limit: bool, backend: str, seconds: float, flooders: int) -> tuple[list[float], Counter]:
+    """
+    :param rate_limit: bool CONTACT_RATE_LIMIT_ENABLED
+    :param backend: str CONTACT_RATE_LIMIT_BACKEND
+    :param seconds: float flood duration.
+    :param flooders: int flooding threads.
+    :return: tuple of (probe latencies, Counter of flood response statuses)
+    """
+    with tempfile.TemporaryDirectory() as db_dir:
+        app = create_app(test_config={'SECRET_KEY': 'benchmark',
+                                      'CONTACT_DATABASE_PATH': Path(db_dir, 'bench.db'),
+                                      'NOTIFICATION_WORKER': 'process',
+                                      'WTF_CSRF_ENABLED': False,
+                                      'CONTACT_RATE_LIMIT_ENABLED': rate_limit,
+                                      'CONTACT_RATE_LIMIT_BACKEND': backend})
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        stop = threading.Event()
+        latencies: list[float] = []
+        statuses: Counter = Counter()
+        emails = itertools.count()
+        threads = [threading.Thread(target=probe, args=(port, stop, latencies))]
+        threads += [threading.Thread(target=flood, args=(port, stop, statuses, emails)) for _ in range(flooders)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        server.shutdown()
+        app.config['DATABASE'].close()
+    return latencies, statuses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--flooders', type=int, default=8)
+    parser.add_argument('--backend', choices=['memory', 'sqlite'], default='memory')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Not a line per request.
+
+    print(f'{"rate limit":10} {"probe p50 ms":>12} {"p95 ms":>8} {"max ms":>8} '
+          f'{"POST/s":>7} {"stored":>7} {"429":>7}')
+    for rate_limit in (False, True):
+        latencies, statuses = run(rate_limit, args.backend, args.seconds, args.flooders)
+        quantiles = statistics.quantiles(latencies, n=20)
+        print(f'{"on" if rate_limit else "off":10} {statistics.median(latencies) * 1000:12.2f} '
+              f'{quantiles[-1] * 1000:8.2f} {max(latencies) * 1000:8.2f} '
+              f'{sum(statuses.values()) / args.seconds:7.0f} {statuses[302]:7} {statuses[429]:7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure each page's HTML bytes and requests, with and without critical CSS inlining.
+
+Render-blocking requests must complete before first paint, ie stylesheets
+not deferred. Preloads are image requests started from <head>.
+
+Run from the repository root:
+    python -m benchmarks.bench_critical_css
+"""
+import gzip
+import tempfile
+
+from pathlib import Path
+
+from flask import Flask
+
+from toonarmycaptain_website import create_app
+from toonarmycaptain_website.critical_css import PageScanner
+
+PAGES = ['/home/', '/projects/', '/about/', '/contact/']
+
+
+class RequestCounter(PageScanner):
+    """Count a page's render-blocking stylesheets and preload hints."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.render_blocking: int = 0
+        self.preloads: int = 0
+        self._in_noscript: bool = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        super().handle_starttag(tag, attrs)
+        attributes = dict(attrs)
+        rel = (attributes.get('rel') or '').split()
+        if tag == 'noscript':
+            self._in_noscript = True
+        elif self._in_noscript:  # Only loaded with JavaScript disabled.
+            return
+        if tag == 'link' and 'stylesheet' in rel and attributes.get('media') in (None, 'all', 'screen'):
+            self.render_blocking += 1
+        elif tag == 'link' and 'preload' in rel:
+            self.preloads += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        super().handle_endtag(tag)
+        if tag == 'noscript':
+            self._in_noscript = False
+
+
+def measure(app: Flask, path: str) -> tuple[int, int, int, int]:
+    """
+    :param app: Flask
+    :param path: str
+    :return: tuple of (HTML bytes, gzipped bytes, render-blocking requests, preload requests)
+    """
+    html = app.test_client().get(path, headers={'Accept-Encoding': 'identity'}).data
+    counter = RequestCounter()
+    counter.feed(html.decode())
+    return len(html), len(gzip.compress(html)), counter.render_blocking, counter.preloads
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as db_dir:
+        apps = {enabled: create_app(test_config={'SECRET_KEY': 'benchmark',
+                                                 'CONTACT_DATABASE_PATH': Path(db_dir, f'{enabled}.db'),
+                                                 'NOTIFICATION_WORKER': 'process',
+                                                 'CRITICAL_CSS_ENABLED': enabled})
+                for enabled in (False, True)}
+        print(f'{"page":12} {"critical CSS":12} {"HTML bytes":>10} {"gzipped":>8} '
+              f'{"render-blocking":>15} {"preloads":>8}')
+        for path in PAGES:
+            for enabled, app in apps.items():
+                html_bytes, gzipped_bytes, render_blocking, preloads = measure(app, path)
+                print(f'{path:12} {"on" if enabled else "off":12} {html_bytes:10} {gzipped_bytes:8} '
+                      f'{render_blocking:15} {preloads:8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure the overhead of request instrumentation: requests/sec with METRICS_ENABLED on and off.
+
+Run from the repository root:
+    python -m benchmarks.bench_metrics [--requests N]
+"""
+import argparse
+import tempfile
+import time
+
+from pathlib import Path
+
+from toonarmycaptain_website import create_app
+
+PATHS = {'cached page': '/home/', 'contact form': '/contact/', 'inbox page': '/inbox/api/messages'}
+
+
+def requests_per_second(enabled: bool, path: str, requests: int) -> float:
+    """
+    :param enabled: bool METRICS_ENABLED
+    :param path: str
+    :param requests: int
+    :return: float
+    """
+    with tempfile.TemporaryDirectory() as db_dir:
+        app = create_app(test_config={'SECRET_KEY': 'benchmark',
+                                      'CONTACT_DATABASE_PATH': Path(db_dir, 'bench.db'),
+                                      'NOTIFICATION_WORKER': 'process',
+                                      'INBOX_API_TOKEN': 'benchmark',
+                                      'METRICS_ENABLED': enabled})
+        for n in range(100):
+            app.config['DATABASE'].store_contact(f'name {n}', f'{n}@email.com', f'message {n}')
+        client = app.test_client()
+        headers = {'Authorization': 'Bearer benchmark'}
+        client.get(path, headers=headers)  # Warm caches.
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path, headers=headers)
+        elapsed = time.perf_counter() - start
+        app.config['DATABASE'].close()
+    return requests / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{"page":14} {"off req/s":>10} {"on req/s":>10} {"overhead":>9}')
+    for name, path in PATHS.items():
+        off = requests_per_second(False, path, args.requests)
+        on = requests_per_second(True, path, args.requests)
+        print(f'{name:14} {off:10.0f} {on:10.0f} {(off / on - 1) * 100:8.1f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Measure person lookups, contact inserts and database size as the contact database grows.
+
+Grows one database through each size in --sizes, seeding people and
+MESSAGES_PER_PERSON times as many messages with benchmarks.synthetic_data,
+and at each size times:
+    email lookup - the email UNIQUE index alone.
+    get_person_from_email - person and their aliases.
+    store_contact new - a new person's message.
+    store_contact alias - an existing person's message under a new name,
+                          adding an alias.
+Lookups and inserts of B-tree indexes should grow with log(rows), so stay
+near flat. Reaching 10^7 people takes the best part of an hour; pass
+--database to keep the database between runs, and --csv to chart results.
+
+Run from the repository root:
+    python -m benchmarks.bench_scaling [--sizes N [N ...]] [--samples N] [--database PATH] [--csv PATH]
+"""
+import argparse
+import csv
+import random
+import statistics
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Callable
+
+from toonarmycaptain_website.database import ContactDatabase
+from benchmarks.synthetic_data import generate
+
+MESSAGES_PER_PERSON = 1.5
+COLUMNS = ('people', 'messages', 'size_mb', 'email lookup', 'get_person_from_email', 'store_contact new',
+           'store_contact alias')
+
+
+def median_ms(call: Callable[[int], object], samples: int) -> float:
+    """
+    :param call: Callable taking int sample.
+    :param samples: int
+    :return: float median milliseconds.
+    """
+    timings = []
+    for sample in range(samples):
+        start = time.perf_counter()
+        call(sample)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def measure(database: ContactDatabase, samples: int, seed: int) -> dict[str, float]:
+    """
+    :param database: ContactDatabase
+    :param samples: int
+    :param seed: int
+    :return: dict of COLUMNS.
+    """
+    rng = random.Random(seed)
+    with database._pooled_connection() as conn:
+        people, = conn.execute("""SELECT count(*) FROM person;""").fetchone()
+        messages, = conn.execute("""SELECT count(*) FROM message;""").fetchone()
+        emails = [conn.execute("""SELECT email FROM person WHERE id=?;""", (person_id,)).fetchone()[0]
+                  for person_id in rng.sample(range(1, people + 1), samples)]
+
+    def email_lookup(sample: int) -> None:
+        with database._pooled_connection() as conn:
+            conn.execute("""SELECT id FROM person WHERE email=?;""", (emails[sample],)).fetchone()
+
+    def get_person_from_email(sample: int) -> None:
+        with database._pooled_connection() as conn:
+            database.get_person_from_email(conn, emails[sample])
+
+    results = {'email lookup': median_ms(email_lookup, samples),
+               'get_person_from_email': median_ms(get_person_from_email, samples),
+               'store_contact new': median_ms(
+                   lambda sample: database.store_contact('New Person', f'new{people}.{sample}@example.com',
+                                                         f'Message {sample}.'), samples),
+               'store_contact alias': median_ms(
+                   lambda sample: database.store_contact(f'Alias {people}.{sample}', emails[sample],
+                                                         f'Message {sample}.'), samples),
+               }
+    with database._pooled_connection() as conn:
+        # Fold the WAL into the database file, so its size is comparable.
+        conn.execute("""PRAGMA wal_checkpoint(TRUNCATE);""")
+    return {'people': people, 'messages': messages,
+            'size_mb': database.database_path.stat().st_size / 2 ** 20, **results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+                        help='People, ascending.')
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--database', type=Path, help='Grown from its current size, if it exists.')
+    parser.add_argument('--csv', type=Path, help='Also save results as CSV here.')
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as db_dir:
+        database = ContactDatabase(database_path=args.database or Path(db_dir, 'bench.db'),
+                                   message_max_length=10000)
+        print(f'{"people":>10} {"messages":>10} {"MB":>8} ' + ' '.join(f'{column:>22}' for column in COLUMNS[3:]))
+        print(f'{"":>31} ' + ' '.join(f'{"median ms":>22}' for _ in COLUMNS[3:]))
+        for size in args.sizes:
+            with database._pooled_connection() as conn:
+                people, = conn.execute("""SELECT count(*) FROM person;""").fetchone()
+            if size > people:
+                generate(database, size - people, int((size - people) * MESSAGES_PER_PERSON), seed=size)
+            row = measure(database, args.samples, seed=size)
+            rows.append(row)
+            print(f'{row["people"]:10} {row["messages"]:10} {row["size_mb"]:8.1f} '
+                  + ' '.join(f'{row[column]:22.3f}' for column in COLUMNS[3:]))
+        database.close()
+
+    if args.csv:
+        with args.csv.open('w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark ContactDatabase.search_messages with the FTS5 index against LIKE scans.
+
+Generates a database of random messages, words drawn from a Zipf-like
+vocabulary, with a rare word in a few messages. Generating a million
+messages takes several minutes; pass --database to keep it for later runs.
+
+Run from the repository root:
+    python -m benchmarks.bench_search [--messages N] [--runs N] [--database PATH]
+"""
+import argparse
+import random
+import statistics
+import string
+import tempfile
+import time
+
+from pathlib import Path
+
+from toonarmycaptain_website.database import ContactDatabase
+
+RARE_WORD = 'xylophone'
+RARE_WORD_MESSAGES = 5
+PEOPLE_PER_MESSAGE = 0.1
+BATCH_SIZE = 10000
+
+QUERIES = {
+    'rare word': RARE_WORD,
+    'common word': 'w0',
+    'two words': 'w1 w20',
+    'prefix': 'w12*',
+    'sender email': 'person7@example.com',
+    'no match': 'nonexistent',
+}
+
+
+def generate_messages(database: ContactDatabase, messages: int, seed: int = 0) -> None:
+    """
+    Store messages of 5-100 random words from PEOPLE_PER_MESSAGE * messages people.
+
+    :param database: ContactDatabase
+    :param messages: int
+    :param seed: int
+    :return: None
+    """
+    rng = random.Random(seed)
+    vocabulary = [f'w{rank}' for rank in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    people = max(1, int(messages * PEOPLE_PER_MESSAGE))
+    rare_word_ids = set(rng.sample(range(1, messages + 1), min(RARE_WORD_MESSAGES, messages)))
+    with database._pooled_connection() as conn:
+        conn.executemany("""INSERT INTO person(id, name, email) VALUES(?,?,?);""",
+                         [(person, ''.join(rng.choices(string.ascii_lowercase, k=8)),
+                           f'person{person}@example.com') for person in range(1, people + 1)])
+    for start in range(1, messages + 1, BATCH_SIZE):
+        rows = []
+        for message_id in range(start, min(start + BATCH_SIZE, messages + 1)):
+            words = rng.choices(vocabulary, weights, k=rng.randint(5, 100))
+            if message_id in rare_word_ids:
+                words.insert(rng.randrange(len(words)), RARE_WORD)
+            rows.append((message_id, rng.randint(1, people), ' '.join(words)))
+        with database._pooled_connection() as conn:
+            conn.executemany("""INSERT INTO message(id, person_id, contents) VALUES(?,?,?);""", rows)
+
+
+def search_time(database: ContactDatabase, query: str, runs: int) -> tuple[float, int]:
+    """
+    :param database: ContactDatabase
+    :param query: str
+    :param runs: int
+    :return: tuple of (median seconds, messages found)
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        found = database.search_messages(query, limit=20)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(found)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--database', type=Path, help='Reused if it exists, else generated.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        database_path = args.database or Path(db_dir, 'bench.db')
+        generate = not database_path.exists()
+        database = ContactDatabase(database_path=database_path, message_max_length=10000)
+        if not database.full_text_search:
+            raise SystemExit('SQLite lacks FTS5.')
+        if generate:
+            start = time.perf_counter()
+            generate_messages(database, args.messages)
+            print(f'Generated {args.messages} messages in {time.perf_counter() - start:.1f} s')
+
+        print(f'{"query":14} {"FTS5 ms":>9} {"LIKE ms":>9} {"found":>6}')
+        for name, query in QUERIES.items():
+            database.full_text_search = True
+            fts_seconds, found = search_time(database, query, args.runs)
+            database.full_text_search = False
+            like_seconds, _ = search_time(database, query, args.runs)
+            print(f'{name:14} {fts_seconds * 1000:9.2f} {like_seconds * 1000:9.2f} {found:6}')
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Profile app startup: import times, and create_app to first request.
+
+Reports `python -X importtime` for importing the package, biggest imports
+first, then, in fresh interpreters, create_app against a new and an
+existing database, and the first /contact/ request with and without
+WARM_UP_ON_STARTUP, which imports the contact form up front.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [--runs N] [--top N]
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from benchmarks.bench_cold_start import cold_start
+
+IMPORT_TIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times(module: str) -> list[tuple[str, int, int, int]]:
+    """
+    Import module in a fresh interpreter, with -X importtime.
+
+    Imports made by the interpreter at startup, eg by site, are excluded.
+
+    :param module: str
+    :return: list of (module, self microseconds, cumulative microseconds, depth),
+             module last.
+    """
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True).stderr
+    times = [(name, int(self_us), int(cumulative_us), len(indent) // 2)
+             for self_us, cumulative_us, indent, name in IMPORT_TIME.findall(stderr)]
+    # Children are reported before their parent, so module's imports follow the previous top level import.
+    end = max(index for index, (name, *_, depth) in enumerate(times) if name == module and depth == 0)
+    start = max((index + 1 for index, (*_, depth) in enumerate(times[:end]) if depth == 0), default=0)
+    return times[start:end + 1]
+
+
+def create_app_time(database_path: Path, runs: int) -> float:
+    """
+    Median create_app seconds in this process, imports done.
+
+    :param database_path: Path - new database per run if it doesn't exist.
+    :param runs: int
+    :return: float
+    """
+    from toonarmycaptain_website import create_app
+
+    timings = []
+    for run in range(runs):
+        path = database_path if database_path.exists() else database_path.with_name(f'{run}{database_path.name}')
+        start = time.perf_counter()
+        app = create_app(test_config={'SECRET_KEY': 'benchmark',
+                                      'CONTACT_DATABASE_PATH': path,
+                                      'NOTIFICATION_WORKER': 'process'})
+        timings.append(time.perf_counter() - start)
+        app.config['DATABASE'].close()
+    return statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times('toonarmycaptain_website')
+    total = next(cumulative for name, _, cumulative, _ in times if name == 'toonarmycaptain_website')
+    print(f'import toonarmycaptain_website: {total / 1000:.1f} ms')
+    print(f'{"module":50} {"self ms":>8} {"cumulative ms":>14}')
+    # Direct imports of the package and its modules, ie what it chose to import.
+    direct = [(name, self_us, cumulative_us) for name, self_us, cumulative_us, depth in times
+              if depth == 1 or (name.startswith('toonarmycaptain_website') and name != 'toonarmycaptain_website')]
+    for name, self_us, cumulative_us in sorted(direct, key=lambda row: -row[2])[:args.top]:
+        print(f'{name:50} {self_us / 1000:8.1f} {cumulative_us / 1000:14.1f}')
+    print()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        existing_database = Path(temp_dir, 'existing.db')
+        create_app_time(existing_database, runs=1)
+        print(f'create_app, new database:      {create_app_time(Path(temp_dir, "new.db"), args.runs) * 1000:6.1f} ms')
+        print(f'create_app, existing database: {create_app_time(existing_database, args.runs) * 1000:6.1f} ms')
+        print()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_config = {'SECRET_KEY': 'benchmark',
+                       'NOTIFICATION_WORKER': 'process',
+                       'TEMPLATE_BYTECODE_CACHE_DIR': str(Path(temp_dir, 'jinja')),
+                       }
+        existing_config = {**base_config, 'CONTACT_DATABASE_PATH': str(Path(temp_dir, 'existing.db'))}
+        cold_start(existing_config, '/contact/')  # Create database, fill bytecode cache.
+
+        scenarios = {
+            'new database': lambda run: cold_start(
+                {**base_config, 'CONTACT_DATABASE_PATH': str(Path(temp_dir, f'new{run}.db'))}, '/contact/'),
+            'existing database': lambda run: cold_start(existing_config, '/contact/'),
+            'existing, warm up': lambda run: cold_start({**existing_config, 'WARM_UP_ON_STARTUP': True},
+                                                        '/contact/'),
+        }
+        print('Fresh interpreter, create_app including imports:')
+        print(f'{"scenario":20} {"create_app ms":>14} {"first /contact/ ms":>19}')
+        for name, scenario in scenarios.items():
+            timings = [scenario(run) for run in range(args.runs)]
+            startup = statistics.median(startup for startup, _ in timings) * 1000
+            first_byte = statistics.median(first_byte for _, first_byte in timings) * 1000
+            print(f'{name:20} {startup:14.1f} {first_byte:19.1f}')
+
+
+if __name__ == '__main__':
+    main()
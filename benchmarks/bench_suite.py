@@ -0,0 +1,309 @@
+"""
+Benchmark suite: hot functions and an HTTP load scenario, compared against a saved baseline.
+
+Micro-benchmarks time ContactDatabase.store_contact and get_person_from_email
+against a seeded database, compose_notification_email, and rendering each
+page's template. The load scenario serves the app with a threaded werkzeug
+server, with the notification dispatcher thread sending email through a fake
+backend, while clients GET pages and POST the contact form.
+
+Each benchmark records throughput and p50/p95/p99 latency. Results are
+compared with the baseline, if there is one, and the run fails if any
+benchmark's throughput falls, or p95 latency rises, by more than --threshold.
+Baselines are machine specific: save one before making changes, eg
+
+    python -m benchmarks.bench_suite --save-baseline
+    <make changes>
+    python -m benchmarks.bench_suite
+
+Run from the repository root:
+    python -m benchmarks.bench_suite [--iterations N] [--seconds N] [--clients N] [--skip-load]
+                                     [--baseline PATH] [--save-baseline] [--threshold FRACTION]
+                                     [--output PATH]
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from pathlib import Path
+from typing import Callable, Iterator
+
+from flask import Flask, render_template
+from werkzeug.serving import make_server
+
+from toonarmycaptain_website import create_app
+from toonarmycaptain_website.contact import email_notification
+from toonarmycaptain_website.contact.dedupe import message_fingerprint
+from benchmarks.bench_contact_flood import request
+
+DEFAULT_BASELINE = Path(__file__).parent / 'baseline.json'
+SEED_PEOPLE = 2000
+MESSAGE = 'Hello, I enjoyed your latest project and would like to ask about it. ' * 5
+# Template, and view's path, of each page rendered.
+PAGES = {'home.html': '/home/', 'projects.html': '/projects/', 'about.html': '/about/',
+         'contact.html': '/contact/'}
+LOAD_GET_PATHS = ('/home/', '/projects/', '/about/', '/contact/')
+LOAD_POST_FRACTION = 0.1
+FAKE_EMAIL_LATENCY = 0.05  # seconds per email sent.
+
+# Benchmark name: {'ops_per_second', 'p50_ms', 'p95_ms', 'p99_ms'}
+Results = dict[str, dict[str, float]]
+
+
+def summarise(latencies: list[float], elapsed: float) -> dict[str, float]:
+    """
+    :param latencies: list of float seconds, of each operation.
+    :param elapsed: float seconds, of all operations.
+    :return: dict of throughput and latency percentiles.
+    """
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {'ops_per_second': len(latencies) / elapsed,
+            'p50_ms': percentiles[49] * 1000,
+            'p95_ms': percentiles[94] * 1000,
+            'p99_ms': percentiles[98] * 1000,
+            }
+
+
+def time_calls(call: Callable[[int], object], iterations: int) -> dict[str, float]:
+    """
+    Time call(0)...call(iterations - 1), after a tenth as many warm-up calls.
+
+    :param call: Callable taking int iteration.
+    :param iterations: int
+    :return: dict, see summarise.
+    """
+    for iteration in range(iterations // 10):
+        call(iterations + iteration)
+    latencies = []
+    start = time.perf_counter()
+    for iteration in range(iterations):
+        call_start = time.perf_counter()
+        call(iteration)
+        latencies.append(time.perf_counter() - call_start)
+    return summarise(latencies, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def fake_email_backend(latency: float) -> Iterator[list[str]]:
+    """
+    Send notification emails to a list, taking latency seconds each, rather than Gmail.
+
+    :param latency: float seconds
+    :return: Iterator of list of str subjects sent.
+    """
+    sent: list[str] = []
+
+    def send(app: Flask, email_subject: str, email_body: str) -> None:
+        time.sleep(latency)
+        sent.append(email_subject)
+
+    original = email_notification._send_notification_email
+    email_notification._send_notification_email = send
+    try:
+        yield sent
+    finally:
+        email_notification._send_notification_email = original
+
+
+def bench_app(database_dir: str, **config: object) -> Flask:
+    """
+    :param database_dir: str directory for the contact database.
+    :param config: app config overrides.
+    :return: Flask
+    """
+    return create_app(test_config={'SECRET_KEY': 'benchmark',
+                                   'CONTACT_DATABASE_PATH': Path(database_dir, 'bench.db'),
+                                   'NOTIFICATION_WORKER': 'process',
+                                   'WTF_CSRF_ENABLED': False,
+                                   **config})
+
+
+def micro_benchmarks(iterations: int) -> Results:
+    """
+    :param iterations: int calls timed per benchmark.
+    :return: Results
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as database_dir:
+        app = bench_app(database_dir)
+        database = app.config['DATABASE']
+        window = app.config['CONTACT_DEDUPE_WINDOW']
+        for person in range(SEED_PEOPLE):
+            database.store_contact(f'name {person}', f'person{person}@example.com', MESSAGE)
+
+        def store_contact(email: str, iteration: int) -> None:
+            message = f'{MESSAGE} {iteration}'
+            database.store_contact('name', email, message, notification_channels=('email',),
+                                   fingerprint=message_fingerprint(email, message), duplicate_window=window)
+
+        def get_person_from_email(iteration: int) -> None:
+            with database._pooled_connection() as conn:
+                database.get_person_from_email(conn, f'person{iteration % SEED_PEOPLE}@example.com')
+
+        results['store_contact new person'] = time_calls(
+            lambda iteration: store_contact(f'new{iteration}@example.com', iteration), iterations)
+        results['store_contact returning person'] = time_calls(
+            lambda iteration: store_contact(f'person{iteration % SEED_PEOPLE}@example.com', iteration), iterations)
+        results['get_person_from_email'] = time_calls(get_person_from_email, iterations)
+        results['compose_notification_email'] = time_calls(
+            lambda iteration: email_notification.compose_notification_email('person@example.com', 'name',
+                                                                            MESSAGE),
+            iterations)
+
+        for template, path in PAGES.items():
+            with app.test_request_context(path):
+                # Reads config when first imported, as in the contact view.
+                from toonarmycaptain_website.contact.form import ContactForm
+                context = {'form': ContactForm()} if template == 'contact.html' else {}
+                results[f'render_template {template}'] = time_calls(
+                    lambda iteration: render_template(template, **context), iterations)
+        database.close()
+    return results
+
+
+def load_scenario(seconds: float, clients: int) -> Results:
+    """
+    Clients GET pages, and a LOAD_POST_FRACTION of the time POST the contact
+    form, as fast as they are answered, for seconds.
+
+    Rate limiting is disabled, so every POST is stored and its notification
+    sent, by the fake email backend.
+
+    :param seconds: float
+    :param clients: int concurrent client threads.
+    :return: Results, for GET, POST and all requests.
+    """
+    with tempfile.TemporaryDirectory() as database_dir, fake_email_backend(FAKE_EMAIL_LATENCY) as sent:
+        app = bench_app(database_dir, NOTIFICATION_WORKER='thread', CONTACT_RATE_LIMIT_ENABLED=False,
+                        SERVER_EMAIL_ADDRESS='server@example.com', CONTACT_EMAIL_ADDRESS='me@example.com')
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        stop = threading.Event()
+        latencies: dict[str, list[float]] = {'GET': [], 'POST': []}
+        submissions = itertools.count()
+
+        def client(seed: int) -> None:
+            rng = random.Random(seed)
+            while not stop.is_set():
+                start = time.perf_counter()
+                if rng.random() < LOAD_POST_FRACTION:
+                    submission = next(submissions)
+                    status = request(port, 'POST', '/contact/', urllib.parse.urlencode(
+                        {'name': 'name', 'email': f'person{submission % 100}@example.com',
+                         'message': f'{MESSAGE} {submission}'}))
+                    method = 'POST'
+                else:
+                    status = request(port, 'GET', rng.choice(LOAD_GET_PATHS))
+                    method = 'GET'
+                if status >= 400:
+                    raise RuntimeError(f'{method} failed with {status}.')
+                latencies[method].append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(seed,)) for seed in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        app.config['NOTIFICATION_DISPATCHER'].stop(timeout=5)
+        app.config['DATABASE'].close()
+        logging.getLogger(__name__).info('Fake email backend sent %s emails.', len(sent))
+
+    return {'http GET': summarise(latencies['GET'], elapsed),
+            'http POST /contact/': summarise(latencies['POST'], elapsed),
+            'http all': summarise(latencies['GET'] + latencies['POST'], elapsed),
+            }
+
+
+def regressions(results: Results, baseline: Results, threshold: float) -> list[str]:
+    """
+    Benchmarks slower than their baseline by more than threshold.
+
+    :param results: Results
+    :param baseline: Results
+    :param threshold: float fraction, eg 0.2 for 20%.
+    :return: list of str descriptions of regressions.
+    """
+    found = []
+    for name, result in results.items():
+        if (base := baseline.get(name)) is None:
+            continue
+        if result['ops_per_second'] < base['ops_per_second'] * (1 - threshold):
+            found.append(f'{name}: {result["ops_per_second"]:.0f} ops/s, '
+                         f'baseline {base["ops_per_second"]:.0f} ops/s')
+        if result['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            found.append(f'{name}: p95 {result["p95_ms"]:.3f} ms, baseline {base["p95_ms"]:.3f} ms')
+    return found
+
+
+def environment() -> dict[str, str]:
+    """
+    Versions results depend on, saved with them.
+
+    :return: dict
+    """
+    return {'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=2000, help='Calls timed per micro-benchmark.')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of the load scenario.')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients in the load scenario.')
+    parser.add_argument('--skip-load', action='store_true', help='Run only the micro-benchmarks.')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Save results as the baseline.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Fraction slower than baseline that fails, eg 0.2 for 20%%.')
+    parser.add_argument('--output', type=Path, help='Also save results as JSON here.')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Not a line per request.
+
+    results = micro_benchmarks(args.iterations)
+    if not args.skip_load:
+        results.update(load_scenario(args.seconds, args.clients))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else None
+    print(f'{"benchmark":34} {"ops/s":>10} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"baseline p95":>12}')
+    for name, result in results.items():
+        base = (baseline or {}).get('results', {}).get(name)
+        base_p95 = f'{base["p95_ms"]:.3f}' if base else '-'
+        print(f'{name:34} {result["ops_per_second"]:10.0f} {result["p50_ms"]:9.3f} {result["p95_ms"]:9.3f} '
+              f'{result["p99_ms"]:9.3f} {base_p95:>12}')
+
+    report = json.dumps({'environment': environment(), 'results': results}, indent=2)
+    if args.output:
+        args.output.write_text(report)
+    if args.save_baseline:
+        args.baseline.write_text(report)
+        print(f'Saved baseline {args.baseline}')
+    elif baseline is not None:
+        if baseline['environment'] != environment():
+            print(f'Baseline recorded with {baseline["environment"]}, comparison may be misleading.')
+        if found := regressions(results, baseline['results'], args.threshold):
+            raise SystemExit('Regressions over {:.0%}:\n  {}'.format(args.threshold, '\n  '.join(found)))
+        print(f'No regressions over {args.threshold:.0%}.')
+
+
+if __name__ == '__main__':
+    main()
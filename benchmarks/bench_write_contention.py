@@ -0,0 +1,137 @@
+"""
+Benchmark concurrent contact writes from several processes, as from gunicorn workers.
+
+Compares SQLite's default rollback journal with the WAL durability profile
+from default_config.py, with reader processes polling the database throughout.
+
+Run from the repository root:
+    python -m benchmarks.bench_write_contention [--writers N] [--readers N] [--submissions N]
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+
+from multiprocessing.synchronize import Event
+from pathlib import Path
+
+from toonarmycaptain_website import default_config
+from toonarmycaptain_website.database import ContactDatabase
+
+PROFILES = {
+    'rollback journal (SQLite default)': {'journal_mode': 'DELETE',
+                                          'synchronous': 'FULL',
+                                          'busy_timeout': 30000,
+                                          },
+    'WAL (default_config.py)': {'journal_mode': default_config.CONTACT_DATABASE_JOURNAL_MODE,
+                                'synchronous': default_config.CONTACT_DATABASE_SYNCHRONOUS,
+                                'busy_timeout': 30000,
+                                'cache_size': default_config.CONTACT_DATABASE_CACHE_SIZE,
+                                'mmap_size': default_config.CONTACT_DATABASE_MMAP_SIZE,
+                                },
+}
+
+
+def open_database(database_path: Path, profile: dict) -> ContactDatabase:
+    """
+    :param database_path: Path
+    :param profile: dict durability profile
+    :return: ContactDatabase
+    """
+    return ContactDatabase(database_path=database_path,
+                           message_max_length=10000,
+                           durability_profile=profile)
+
+
+def writer(database_path: Path, profile: dict, worker: int, submissions: int) -> None:
+    """
+    Store contacts, as the contact form POST does.
+
+    :param database_path: Path
+    :param profile: dict
+    :param worker: int
+    :param submissions: int
+    :return: None
+    """
+    database = open_database(database_path, profile)
+    for submission in range(submissions):
+        message_id = database.store_contact(name=f'name {worker}',
+                                            email=f'{worker}-{submission % 50}@email.com',
+                                            message=f'message {submission} from worker {worker}')
+        assert message_id is not None
+        database.email_sent(message_id)
+    database.close()
+
+
+def reader(database_path: Path, profile: dict, stop: Event, reads) -> None:
+    """
+    Look up people until stopped, counting reads completed.
+
+    :param database_path: Path
+    :param profile: dict
+    :param stop: Event
+    :param reads: multiprocessing.Value
+    :return: None
+    """
+    database = open_database(database_path, profile)
+    count = 0
+    while not stop.is_set():
+        with database._pooled_connection() as conn:
+            database.get_person_from_email(conn, f'0-{count % 50}@email.com')
+        count += 1
+    with reads.get_lock():
+        reads.value += count
+    database.close()
+
+
+def run(profile: dict, writers: int, readers: int, submissions: int) -> tuple[float, float]:
+    """
+    :param profile: dict
+    :param writers: int - number of writer processes
+    :param readers: int - number of reader processes
+    :param submissions: int - submissions per writer
+    :return: tuple of (submissions/sec, reads/sec)
+    """
+    with tempfile.TemporaryDirectory() as db_dir:
+        database_path = Path(db_dir, 'bench.db')
+        open_database(database_path, profile).close()  # Create schema, set journal mode.
+
+        stop = multiprocessing.Event()
+        reads = multiprocessing.Value('l', 0)
+        reader_processes = [multiprocessing.Process(target=reader,
+                                                    args=(database_path, profile, stop, reads))
+                            for _ in range(readers)]
+        writer_processes = [multiprocessing.Process(target=writer,
+                                                    args=(database_path, profile, worker, submissions))
+                            for worker in range(writers)]
+        for process in reader_processes:
+            process.start()
+
+        start = time.perf_counter()
+        for process in writer_processes:
+            process.start()
+        for process in writer_processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        for process in reader_processes:
+            process.join()
+    return writers * submissions / elapsed, reads.value / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--submissions', type=int, default=250, help='per writer')
+    args = parser.parse_args()
+
+    for name, profile in PROFILES.items():
+        submissions_per_second, reads_per_second = run(profile, args.writers, args.readers, args.submissions)
+        print(f'{name:36} {submissions_per_second:8.1f} submissions/sec '
+              f'{reads_per_second:10.1f} reads/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Seed a ContactDatabase with synthetic people and messages, for scaling benchmarks and tests.
+
+Rows are written with executemany, batch_size rows per transaction, straight
+to the tables rather than through store_contact, so millions of rows take
+minutes rather than hours. Distributions are loosely modelled on a personal
+site's contact form:
+    - most people write once, a few write often (a power-law tail),
+    - about ALIAS_FRACTION of people have submitted under other names,
+    - message lengths are log-normal, a few hundred characters typically,
+    - most messages have had their notifications sent.
+"""
+import random
+import time
+
+from toonarmycaptain_website.contact.dedupe import message_fingerprint
+from toonarmycaptain_website.database import ContactDatabase
+
+FIRST_NAMES = ('Alice', 'Bob', 'Carol', 'Dave', 'Eve', 'Frank', 'Grace', 'Heidi', 'Ivan', 'Judy',
+               'Mallory', 'Niaj', 'Olivia', 'Peggy', 'Rupert', 'Sybil', 'Trent', 'Victor', 'Walter')
+LAST_NAMES = ('Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Johnson', 'Davies',
+              'Robinson', 'Wright', 'Thompson', 'Evans', 'Walker', 'White', 'Roberts', 'Green')
+# Email domain: share of people.
+DOMAINS = {'gmail.com': 0.45, 'outlook.com': 0.15, 'yahoo.com': 0.1, 'icloud.com': 0.1,
+           'example.com': 0.2}
+WORDS = ('hello', 'website', 'project', 'question', 'python', 'flask', 'thanks', 'code', 'work',
+         'interested', 'would', 'like', 'about', 'your', 'the', 'and', 'to', 'a', 'in', 'is', 'it',
+         'you', 'that', 'for', 'on', 'with', 'as', 'have', 'be', 'at', 'this', 'from', 'or', 'an')
+ALIAS_FRACTION = 0.1
+REPEAT_SENDER_FRACTION = 0.3  # Messages from a power-law tail of repeat senders.
+MEDIAN_MESSAGE_LENGTH = 300  # characters
+UNSENT_FRACTION = 0.02
+HISTORY = 365 * 24 * 60 * 60  # seconds of messages, up to now.
+BATCH_SIZE = 50_000
+
+
+def _name(rng: random.Random) -> str:
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def _contents(rng: random.Random, max_length: int) -> str:
+    """
+    :param rng: random.Random
+    :param max_length: int characters
+    :return: str of words, log-normal length.
+    """
+    length = min(max_length, max(1, int(rng.lognormvariate(0, 1) * MEDIAN_MESSAGE_LENGTH)))
+    text = ''
+    while len(text) < length:  # Words average over 3 characters with a space.
+        text += ' '.join(rng.choices(WORDS, k=length // 3 + 1)) + ' '
+    return text[:length]
+
+
+def generate_people(database: ContactDatabase, people: int, seed: int = 0,
+                    batch_size: int = BATCH_SIZE) -> range:
+    """
+    Add people, with ids following the database's highest, and their aliases.
+
+    :param database: ContactDatabase
+    :param people: int
+    :param seed: int
+    :param batch_size: int rows per transaction.
+    :return: range of new person ids.
+    """
+    with database._pooled_connection() as conn:
+        first_id = conn.execute("""SELECT coalesce(max(id), 0) + 1 FROM person;""").fetchone()[0]
+    rng = random.Random(f'people {seed} {first_id}')
+    domains, domain_weights = list(DOMAINS), list(DOMAINS.values())
+    ids = range(first_id, first_id + people)
+    for start in range(ids.start, ids.stop, batch_size):
+        rows: list[tuple[int, str, str]] = []
+        aliases: list[tuple[int, str]] = []
+        for person_id in range(start, min(start + batch_size, ids.stop)):
+            name = _name(rng)
+            email = f'{name.replace(" ", ".").lower()}{person_id}@{rng.choices(domains, domain_weights)[0]}'
+            rows.append((person_id, name, email))
+            if rng.random() < ALIAS_FRACTION:
+                # One alias usually, occasionally several.
+                alias_count = min(10, int(rng.expovariate(1)) + 1)
+                aliases += {(person_id, alias) for alias in (_name(rng) for _ in range(alias_count))
+                            if alias != name}
+        with database._pooled_connection() as conn:
+            conn.executemany("""INSERT INTO person(id, name, email) VALUES(?,?,?);""", rows)
+            conn.executemany("""INSERT INTO person_alias(person_id, name) VALUES(?,?);""", aliases)
+    return ids
+
+
+def generate_messages(database: ContactDatabase, messages: int, senders: range, seed: int = 0,
+                      batch_size: int = BATCH_SIZE) -> None:
+    """
+    Add messages from senders, received over the last HISTORY seconds in id order.
+
+    The full-text index, if any, is rebuilt once afterwards rather than
+    updated by its insert trigger for each message, several times faster.
+
+    :param database: ContactDatabase
+    :param messages: int
+    :param senders: range of person ids.
+    :param seed: int
+    :param batch_size: int rows per transaction.
+    :return: None
+    """
+    with database._pooled_connection() as conn:
+        first_id = conn.execute("""SELECT coalesce(max(id), 0) + 1 FROM message;""").fetchone()[0]
+        index_trigger = conn.execute(
+            """SELECT sql FROM sqlite_master WHERE type='trigger' AND name='message_search_insert';""").fetchone()
+        if index_trigger:
+            conn.execute("""DROP TRIGGER message_search_insert;""")
+    try:
+        _insert_messages(database, first_id, messages, senders, seed, batch_size)
+    finally:
+        if index_trigger:
+            with database._pooled_connection() as conn:
+                conn.execute(index_trigger[0])
+                conn.execute("""INSERT INTO message_search(message_search) VALUES('rebuild');""")
+
+
+def _insert_messages(database: ContactDatabase, first_id: int, messages: int, senders: range, seed: int,
+                     batch_size: int) -> None:
+    """
+    :param database: ContactDatabase
+    :param first_id: int message.id of first message.
+    :param messages: int
+    :param senders: range of person ids.
+    :param seed: int
+    :param batch_size: int rows per transaction.
+    :return: None
+    """
+    rng = random.Random(f'messages {seed} {first_id}')
+    now = time.time()
+    for start in range(first_id, first_id + messages, batch_size):
+        rows = []
+        for message_id in range(start, min(start + batch_size, first_id + messages)):
+            if rng.random() < REPEAT_SENDER_FRACTION:
+                # Power law, skewed to the lowest ids.
+                person_id = senders[int(len(senders) * rng.random() ** 3)]
+            else:
+                person_id = rng.choice(senders)
+            contents = _contents(rng, database._message_max_length)
+            sent = rng.random() >= UNSENT_FRACTION
+            rows.append((message_id, person_id, contents, sent, sent,
+                         now - HISTORY * (1 - (message_id - first_id + 1) / messages), person_id))
+        with database._pooled_connection() as conn:
+            # Fingerprinted with the sender's email, read by the insert rather than held in memory.
+            conn.create_function('message_fingerprint', 2, message_fingerprint, deterministic=True)
+            conn.executemany(
+                """INSERT INTO message(id, person_id, contents, email_sent, sms_sent, received_at, fingerprint)
+                   SELECT ?1, ?2, ?3, ?4, ?5, ?6, message_fingerprint(email, ?3)
+                   FROM person
+                   WHERE id=?7;""", rows)
+
+
+def generate(database: ContactDatabase, people: int, messages: int, seed: int = 0,
+             batch_size: int = BATCH_SIZE) -> range:
+    """
+    Add people and messages from them.
+
+    :param database: ContactDatabase
+    :param people: int
+    :param messages: int
+    :param seed: int
+    :param batch_size: int rows per transaction.
+    :return: range of new person ids.
+    """
+    senders = generate_people(database, people, seed, batch_size)
+    if messages:
+        generate_messages(database, messages, senders, seed, batch_size)
+    return senders
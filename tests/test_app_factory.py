@@ -1,7 +1,11 @@
 """ Test app factory. """
+import gc
+import weakref
+
 from pathlib import Path
 
 import flask
+import pytest
 
 from toonarmycaptain_website import ABOUT_TEXT_STRING, create_app
 
@@ -34,3 +38,20 @@ def test_create_app_name(test_app):
     """Test app has correct name."""
     assert isinstance(test_app, flask.app.Flask)
     assert test_app.name == 'toonarmycaptain_website'
+
+
+@pytest.mark.parametrize('notification_worker', ['process', 'thread'])
+def test_app_garbage_collected(tmpdir, notification_worker):
+    """Nothing registered for interpreter exit keeps apps, and their databases, alive."""
+    app = create_app({'CONTACT_DATABASE_PATH': Path(tmpdir, 'test.db'), 'TESTING': True,
+                      'NOTIFICATION_WORKER': notification_worker})
+    app_ref = weakref.ref(app)
+    database = app.config['DATABASE']
+    with database._pooled_connection():
+        pass
+    assert database._pool._idle
+
+    del app
+    gc.collect()
+    assert app_ref() is None
+    assert not database._pool._idle  # Closed.
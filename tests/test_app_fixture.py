@@ -18,24 +18,29 @@ default_test_config = {'SECRET_KEY': b'some secret key',
 
                        'CONTACT_CELL_NUMBER': 'Not yet defined.',
 
+                       # Tests dispatch notifications explicitly.
+                       'NOTIFICATION_WORKER': 'process',
+
                        'TESTING': True,
                        'WTF_CSRF_METHODS': set(),
                        'WTF_CSRF_ENABLED': False,
                        }
 
 
-def app_with_test_config(db_dir_path: Path) -> Flask:
+def app_with_test_config(db_dir_path: Path, **overrides) -> Flask:
     """
-    Instantiate app with given config.
+    Instantiate app with test config, and any overrides.
 
     :param db_dir_path: Path to dir containing test db.
+    :param overrides: config values replacing default_test_config's,
+                      eg CRITICAL_CSS_ENABLED=False.
     :return: Flask app
     """
     num = randint(1, 1000000000)
     default_test_config['CONTACT_DATABASE_PATH'] = Path(db_dir_path, f'test_db{num}.db')
 
-    app = create_app(test_config=default_test_config)
-    assert app.config['WTF_CSRF_ENABLED'] is False
+    app = create_app(test_config={**default_test_config, **overrides})
+    assert app.config['WTF_CSRF_ENABLED'] is overrides.get('WTF_CSRF_ENABLED', False)
     return app
 
 
@@ -0,0 +1,155 @@
+""" Test compression.py """
+import gzip
+import shutil
+
+from pathlib import Path
+
+import pytest
+
+from flask import Response
+
+from toonarmycaptain_website import compression
+from tests.test_app_fixture import app_with_test_config
+
+
+@pytest.fixture
+def static_copy(test_app, tmpdir) -> Path:
+    """Serve test_app's static files from a temporary copy, so they can be precompressed."""
+    static_folder = Path(tmpdir, 'static')
+    shutil.copytree(test_app.static_folder, static_folder)
+    test_app.static_folder = str(static_folder)
+    return static_folder
+
+
+def test_compress_gzip_reproducible():
+    data = b'body { color: black; }' * 100
+    assert compression.compress(data, 'gzip') == compression.compress(data, 'gzip')
+    assert gzip.decompress(compression.compress(data, 'gzip')) == data
+    assert gzip.decompress(compression.compress(data, 'gzip', fast=True)) == data
+
+
+def test_precompress_static(static_copy):
+    report = {path.name: (size, compressed_sizes)
+              for path, size, compressed_sizes in compression.precompress_static(static_copy, min_size=500)}
+
+    size, compressed_sizes = report['style.css']
+    assert 0 < compressed_sizes['gzip'] < size
+    assert gzip.decompress(Path(static_copy, 'style.css.gz').read_bytes()) == Path(static_copy,
+                                                                                    'style.css').read_bytes()
+    # Already compressed images skipped.
+    assert 'avatar_full.jpg' not in report
+    assert not Path(static_copy, 'avatar_full.jpg.gz').exists()
+
+
+def test_precompress_static_removes_stale(static_copy):
+    compression.precompress_static(static_copy)
+    assert Path(static_copy, 'style.css.gz').exists()
+
+    # style.css now below min_size:
+    compression.precompress_static(static_copy, min_size=10 ** 9)
+    assert not Path(static_copy, 'style.css.gz').exists()
+
+
+def test_serve_precompressed_static(static_copy, test_client):
+    compression.precompress_static(static_copy)
+
+    response = test_client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.data == Path(static_copy, 'style.css.gz').read_bytes()
+    response.close()
+
+    response = test_client.get('/static/style.css', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == Path(static_copy, 'style.css').read_bytes()
+    response.close()
+
+
+def test_serve_static_not_precompressed(static_copy, test_client):
+    """Files without compressed siblings are served as is."""
+    response = test_client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == Path(static_copy, 'style.css').read_bytes()
+    response.close()
+
+
+def plain_html(**kwargs) -> Response:
+    return Response('<p>page</p>', **{'mimetype': 'text/html', **kwargs})
+
+
+@pytest.mark.parametrize('response, expected', [
+    (plain_html(), True),
+    (plain_html(mimetype='text/css'), False),
+    (plain_html(status=404), False),
+    (plain_html(direct_passthrough=True), False),
+    (Response(iter(['<p>page</p>']), mimetype='text/html'), False),  # Streamed.
+    (plain_html(headers={'Content-Encoding': 'gzip'}), False),
+])
+def test_is_plain_html(response, expected):
+    assert compression.is_plain_html(response) is expected
+
+
+def test_html_compressed(test_client):
+    uncompressed = test_client.get('home/', headers={'Accept-Encoding': 'identity'})
+    response = test_client.get('home/', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in uncompressed.headers
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == uncompressed.data
+
+
+def test_html_compressed_etag(test_client):
+    """Compressed page has its own ETag, which If-None-Match is checked against."""
+    uncompressed_etag = test_client.get('home/', headers={'Accept-Encoding': 'identity'}).headers['ETag']
+    etag = test_client.get('home/', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    assert etag == uncompressed_etag[:-1] + '-gzip"'
+
+    response = test_client.get('home/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = test_client.get('home/', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('path', ['contact/', 'about_text/'])
+def test_uncached_html_not_compressed(test_client, path):
+    """Only PAGE_CACHE pages: the contact page's CSRF token and reflected input invite BREACH."""
+    response = test_client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_small_response_not_compressed(test_app, test_client):
+    test_app.config['COMPRESSION_MIN_SIZE'] = 10 ** 9
+    response = test_client.get('home/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_brotli_preferred(static_copy, test_client):
+    brotli = pytest.importorskip('brotli')
+    compression.precompress_static(static_copy)
+
+    response = test_client.get('/static/style.css', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == Path(static_copy, 'style.css').read_bytes()
+    response.close()
+
+    response = test_client.get('home/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert response.headers['ETag'].endswith('-br"')
+
+
+def test_compression_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, COMPRESSION_ENABLED=False)
+    response = app.test_client().get('home/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compress_static_command(static_copy, test_app):
+    result = test_app.test_cli_runner().invoke(args=['compress-static'])
+    assert result.exit_code == 0
+    assert 'style.css' in result.output
+    assert Path(static_copy, 'style.css.gz').exists()
@@ -0,0 +1,36 @@
+""" Test contact/dedupe.py """
+from toonarmycaptain_website.contact.dedupe import (message_fingerprint,
+                                                    RecentFingerprints,
+                                                    )
+
+
+def test_message_fingerprint():
+    fingerprint = message_fingerprint('lancelot@camelot.com', 'Some amusing message.')
+    assert len(fingerprint) == 16
+    # Resubmissions with different case/whitespace match:
+    assert message_fingerprint(' Lancelot@Camelot.com', 'some  amusing\r\nmessage. ') == fingerprint
+    assert message_fingerprint('galahad@camelot.com', 'Some amusing message.') != fingerprint
+    assert message_fingerprint('lancelot@camelot.com', 'Some other message.') != fingerprint
+    # Fields are delimited:
+    assert message_fingerprint('a', 'bc') != message_fingerprint('ab', 'c')
+
+
+def test_recent_fingerprints_window():
+    now = [1000.0]
+    recent = RecentFingerprints(window=60, max_size=10, clock=lambda: now[0])
+    assert not recent.seen(b'first')
+    recent.add(b'first')
+    assert recent.seen(b'first')
+    now[0] += 61
+    assert not recent.seen(b'first')
+    assert list(recent._received) == []  # Expired fingerprint forgotten.
+
+
+def test_recent_fingerprints_evicts_least_recently_used():
+    recent = RecentFingerprints(window=60, max_size=2)
+    recent.add(b'first')
+    recent.add(b'second')
+    assert recent.seen(b'first')
+    recent.add(b'third')
+    assert recent.seen(b'first') and recent.seen(b'third')
+    assert not recent.seen(b'second')
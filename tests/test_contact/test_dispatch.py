@@ -0,0 +1,294 @@
+""" Test dispatch.py """
+import time
+
+import pytest
+
+from toonarmycaptain_website.contact import dispatch, email_notification
+from toonarmycaptain_website.contact.dispatch import NotificationDispatcher, retry_delay
+from tests.test_app_fixture import app_with_test_config
+
+
+@pytest.fixture
+def sent_emails(monkeypatch) -> list:
+    """Record deliver_contact_email calls rather than sending."""
+    sent = []
+
+    def mock_deliver_contact_email(app, contact_email, contact_name, message_body):
+        sent.append((contact_email, contact_name, message_body))
+
+    monkeypatch.setattr(email_notification, 'deliver_contact_email', mock_deliver_contact_email)
+    return sent
+
+
+@pytest.fixture
+def sent_digests(monkeypatch) -> list:
+    """Record deliver_digest_email calls rather than sending."""
+    sent = []
+
+    def mock_deliver_digest_email(app, contacts):
+        sent.append(list(contacts))
+
+    monkeypatch.setattr(email_notification, 'deliver_digest_email', mock_deliver_digest_email)
+    return sent
+
+
+@pytest.fixture
+def failing_email(monkeypatch) -> list:
+    """Fail deliver_contact_email, recording attempts."""
+    attempts = []
+
+    def mock_deliver_contact_email(app, contact_email, contact_name, message_body):
+        attempts.append(contact_email)
+        raise ConnectionError('Gmail unavailable')
+
+    monkeypatch.setattr(email_notification, 'deliver_contact_email', mock_deliver_contact_email)
+    return attempts
+
+
+def test_dispatch_pending(test_app, sent_emails):
+    """Queued notifications are sent and removed from outbox."""
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, batch_size=2)
+    message_ids = [test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                                         notification_channels=('email',))
+                   for n in range(3)]
+    test_db.store_contact('not notified', 'not@notified.com', 'no notification')
+
+    assert dispatcher.dispatch_pending() == 3
+    assert sent_emails == [(f'{n}@email.com', f'name {n}', f'message {n}') for n in range(3)]
+    assert test_db._connection().execute("""SELECT * FROM outbox;""").fetchall() == []
+    assert test_db._connection().execute(
+        """SELECT id, email_sent FROM message;""").fetchall() == [
+               *[(message_id, 1) for message_id in message_ids],
+               (4, 0),  # Not notified.
+           ]
+    # Nothing left to send.
+    assert dispatcher.dispatch_pending() == 0
+
+
+def test_dispatcher_thread(test_app, sent_emails):
+    """Background thread sends notification when notified."""
+    test_app.config['NOTIFICATION_WORKER'] = 'thread'
+    dispatcher = NotificationDispatcher(test_app, poll_interval=60)
+    message_id = test_app.config['DATABASE'].store_contact('name', 'name@email.com', 'message',
+                                                           notification_channels=('email',))
+    dispatcher.notify()  # Starts thread.
+    try:
+        for _ in range(500):
+            if sent_emails:
+                break
+            dispatcher._wake.wait(0.01)
+    finally:
+        dispatcher.stop(timeout=5)
+
+    assert sent_emails == [('name@email.com', 'name', 'message')]
+    assert test_app.config['DATABASE']._connection().execute(
+        """SELECT email_sent FROM message WHERE id=?;""", (message_id,)).fetchone() == (1,)
+    assert not dispatcher._thread.is_alive()
+
+
+def test_dispatcher_thread_started_by_first_request(tmpdir):
+    """Not by create_app, which may run in a pre-fork server's master process."""
+    app = app_with_test_config(tmpdir, NOTIFICATION_WORKER='thread')
+    dispatcher = app.config['NOTIFICATION_DISPATCHER']
+    assert dispatcher._thread is None
+    try:
+        assert app.test_client().get('home/').status_code == 200
+        assert dispatcher._thread.is_alive()
+    finally:
+        dispatcher.stop(timeout=5)
+
+
+def test_dispatcher_thread_stopped_at_exit(test_app):
+    """By a finalizer holding the thread's events, not the dispatcher."""
+    dispatcher = NotificationDispatcher(test_app, poll_interval=60)
+    dispatcher.start()
+    thread = dispatcher._thread
+    assert dispatcher._exit_finalizer.alive
+    dispatcher._exit_finalizer()  # As at exit.
+    assert not thread.is_alive()
+
+
+def test_dispatcher_start_lock_free_when_running(test_app):
+    """Called before every request, so doesn't contend for the lock once started."""
+    class UnusableLock:
+        def __enter__(self):
+            raise AssertionError('Lock taken.')
+
+        def __exit__(self, *args):
+            pass
+
+    dispatcher = NotificationDispatcher(test_app, poll_interval=60)
+    dispatcher.start()
+    lock, dispatcher._lock = dispatcher._lock, UnusableLock()
+    try:
+        dispatcher.start()
+    finally:
+        dispatcher._lock = lock
+        dispatcher.stop(timeout=5)
+
+
+def test_dispatcher_thread_restarted_after_fork(test_app, monkeypatch):
+    """A forked process starts its own thread, with its own events."""
+    dispatcher = NotificationDispatcher(test_app, poll_interval=60)
+    dispatcher.start()
+    parent_thread, parent_stop, parent_wake = dispatcher._thread, dispatcher._stop, dispatcher._wake
+    monkeypatch.setattr(dispatch.os, 'getpid', lambda: -1)  # Now in a child process.
+    try:
+        dispatcher.start()
+        assert dispatcher._thread is not parent_thread
+        assert dispatcher._exit_finalizer.peek()[2][2] is dispatcher._thread
+        assert dispatcher._stop is not parent_stop and dispatcher._wake is not parent_wake
+        assert dispatcher._thread.is_alive()
+    finally:
+        dispatcher.stop(timeout=5)
+        parent_stop.set()
+        parent_wake.set()
+        parent_thread.join(timeout=5)
+    assert not dispatcher._thread.is_alive()
+
+
+def test_failed_email_scheduled_for_retry(test_app, failing_email):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, retry_base_delay=60)
+    message_id = test_db.store_contact('name', 'name@email.com', 'message',
+                                       notification_channels=('email',))
+
+    before = time.time()
+    assert dispatcher.dispatch_pending() == 1
+    assert failing_email == ['name@email.com']
+
+    email_sent, attempts, last_error, next_attempt_at = test_db._connection().execute(
+        """SELECT email_sent, email_attempts, email_last_error, email_next_attempt_at
+           FROM message
+           WHERE id=?;""", (message_id,)).fetchone()
+    assert (email_sent, attempts, last_error) == (0, 1, "ConnectionError('Gmail unavailable')")
+    assert before + 30 <= next_attempt_at <= time.time() + 60
+    # Notification removed from outbox, retry is not yet due.
+    assert test_db._connection().execute("""SELECT * FROM outbox;""").fetchall() == []
+    assert dispatcher.retry_due() == 0
+
+
+def test_retry_due(test_app, failing_email, monkeypatch):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, max_attempts=2)
+    message_id = test_db.store_contact('name', 'name@email.com', 'message')
+    test_db.email_failed(message_id, error='error', retry_at=time.time())
+
+    # Final attempt fails, no further retries scheduled.
+    assert dispatcher.retry_due() == 1
+    assert failing_email == ['name@email.com']
+    assert test_db._connection().execute(
+        """SELECT email_attempts, email_next_attempt_at FROM message;""").fetchone() == (2, None)
+    assert dispatcher.retry_due() == 0
+
+    # Successful retry marks message sent.
+    with test_db._pooled_connection() as conn:
+        conn.execute("""UPDATE message SET email_next_attempt_at=0;""")
+    monkeypatch.setattr(email_notification, 'deliver_contact_email', lambda *args: None)
+    assert dispatcher.retry_due() == 1
+    assert test_db._connection().execute(
+        """SELECT email_sent, email_next_attempt_at FROM message;""").fetchone() == (1, None)
+
+
+@pytest.mark.parametrize('attempts, minimum, maximum',
+                         [(1, 30, 60),
+                          (2, 60, 120),
+                          (5, 480, 960),
+                          (20, 1800, 3600),  # Capped at max_delay.
+                          ])
+def test_retry_delay(attempts, minimum, maximum):
+    for _ in range(100):
+        assert minimum <= retry_delay(attempts, base_delay=60, max_delay=3600) <= maximum
+
+
+def test_digest_not_sent_until_due(test_app, sent_emails, sent_digests):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, digest_window=60, digest_max_messages=3)
+    for n in range(2):
+        test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                              notification_channels=('email',))
+
+    assert dispatcher.dispatch_pending() == 0
+    assert sent_emails == sent_digests == []
+
+
+def test_digest_sent_when_max_messages_queued(test_app, sent_emails, sent_digests):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, digest_window=60, digest_max_messages=3)
+    message_ids = [test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                                         notification_channels=('email',))
+                   for n in range(4)]
+
+    # One full digest sent, remaining message waits for the window.
+    assert dispatcher.dispatch_pending() == 3
+    assert sent_emails == []
+    assert sent_digests == [[(f'{n}@email.com', f'name {n}', f'message {n}') for n in range(3)]]
+    assert test_db._connection().execute(
+        """SELECT id FROM message WHERE email_sent=1;""").fetchall() == [(message_id,)
+                                                                        for message_id in message_ids[:3]]
+    assert test_db.outbox_status('email', lease_seconds=60)[0] == 1
+
+
+def test_digest_sent_when_window_elapsed(test_app, sent_emails, sent_digests):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, digest_window=60, digest_max_messages=3)
+    for n in range(2):
+        test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                              notification_channels=('email',))
+    with test_db._pooled_connection() as conn:
+        conn.execute("""UPDATE outbox SET created_at=created_at - 61;""")
+
+    assert dispatcher.dispatch_pending() == 2
+    assert sent_digests == [[(f'{n}@email.com', f'name {n}', f'message {n}') for n in range(2)]]
+    assert test_db.outbox_status('email', lease_seconds=60) == (0, None)
+
+
+def test_failed_digest_scheduled_for_retry(test_app, monkeypatch):
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, digest_window=60, digest_max_messages=2)
+
+    def mock_deliver_digest_email(app, contacts):
+        raise ConnectionError('Gmail unavailable')
+
+    monkeypatch.setattr(email_notification, 'deliver_digest_email', mock_deliver_digest_email)
+    for n in range(2):
+        test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                              notification_channels=('email',))
+
+    assert dispatcher.dispatch_pending() == 2
+    assert test_db._connection().execute(
+        """SELECT email_sent, email_attempts, email_next_attempt_at IS NOT NULL
+           FROM message;""").fetchall() == [(0, 1, 1), (0, 1, 1)]
+
+
+def test_dispatch_notifications_command(test_app, monkeypatch):
+    """CLI command runs dispatcher in the foreground."""
+    called = []
+    monkeypatch.setattr(test_app.config['NOTIFICATION_DISPATCHER'], 'run', lambda: called.append(True))
+
+    result = test_app.test_cli_runner().invoke(args=['dispatch-notifications'])
+    assert result.exit_code == 0
+    assert called == [True]
+
+
+def test_dispatch_notifications_command_starts_no_thread(tmpdir, monkeypatch):
+    """With NOTIFICATION_WORKER 'thread', the command's loop is still the only one."""
+    app = app_with_test_config(tmpdir, NOTIFICATION_WORKER='thread')
+    dispatcher = app.config['NOTIFICATION_DISPATCHER']
+    monkeypatch.setattr(dispatcher, 'run', lambda: None)
+
+    assert app.test_cli_runner().invoke(args=['dispatch-notifications']).exit_code == 0
+    assert dispatcher._thread is None
+
+
+def test_retry_unsent_emails_command(test_app):
+    test_db = test_app.config['DATABASE']
+    message_ids = [test_db.store_contact('name', 'name@email.com', f'message {n}') for n in range(3)]
+
+    result = test_app.test_cli_runner().invoke(args=['retry-unsent-emails', '--spread', '0',
+                                                     '--min-message-id', str(message_ids[1])])
+    assert result.exit_code == 0
+    assert 'Scheduled 2 notification emails for retry.' in result.output
+    assert [message_id for message_id, *_ in test_db.claim_email_retries(limit=10, lease_seconds=60)] == (
+        message_ids[1:])
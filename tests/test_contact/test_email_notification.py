@@ -4,70 +4,66 @@ import pytest
 from flask import Flask
 
 from toonarmycaptain_website.contact import email_notification
-from toonarmycaptain_website.contact.email_notification import (send_contact_email, compose_notification_email,
+from toonarmycaptain_website.contact.email_notification import (compose_notification_email,
+                                                                compose_digest_email,
+                                                                deliver_contact_email,
+                                                                deliver_digest_email,
                                                                 )
 
-@pytest.mark.parametrize('exception_thrown', [False, True])
-def test_send_contact_email(monkeypatch, test_client,
-                            exception_thrown):
-    """Email is sent with correct metadata and logged in db."""
 
+@pytest.mark.parametrize('exception_thrown', [False, True])
+def test_deliver_contact_email(monkeypatch, exception_thrown):
+    """Email is sent with correct metadata, raising any error."""
     mock_from_address = 'mock@from.address'
     mock_to_address = 'mock@to.address'
 
-    test_message_id = 314
     test_contact_email = 'contact@host.tld'
     test_contact_name = 'Sir Lancelot'
     test_message_body = 'Some amusing message.'
-    mock_email_subject = 'Contact from Sir Lancelot'
-
-    mock_call = {
-        'mock_compose_notification_email': False,
-        'app.send': False,
-        'app.DATABASE.email_sent': False,
-    }
-
-    def mock_compose_notification_email(contact_email, contact_name, message_body):
-        mock_call['mock_compose_notification_email'] = True
-        assert (contact_email, contact_name, message_body) == (
-            test_contact_email, test_contact_name, test_message_body)
-        return mock_email_subject, test_message_body
+    sent = []
 
     class MockEZGmail:
-        def __init__(self):
-            self.EMAIL_ADDRESS = mock_from_address
+        EMAIL_ADDRESS = mock_from_address
 
         def send(self, recipient, subject, body):
-            mock_call['app.send'] = True
             if exception_thrown:
                 raise ValueError
-            # Don't test body, as is subject to change.
-            assert (recipient, subject) == (mock_to_address, mock_email_subject)
-
-    class MockDatabase:
-        def email_sent(self, message_id):
-            mock_call['app.DATABASE.email_sent'] = True
-            assert message_id == test_message_id
+            sent.append((recipient, subject, body))
 
     class MockApp(Flask):
         def __init__(self):
             self.config = {'SERVER_EMAIL_ADDRESS': mock_from_address,
                            'CONTACT_EMAIL_ADDRESS': mock_to_address,
-                           'DATABASE': MockDatabase(),
                            }
 
-
     monkeypatch.setattr(email_notification, 'ezgmail', MockEZGmail())
-    monkeypatch.setattr(email_notification, 'compose_notification_email', mock_compose_notification_email)
 
-    assert send_contact_email(app=MockApp(),
-                              message_id=test_message_id,
-                              contact_email=test_contact_email,
-                              contact_name=test_contact_name,
-                              message_body=test_message_body,
-                              ) is None
+    if exception_thrown:
+        with pytest.raises(ValueError):
+            deliver_contact_email(MockApp(), test_contact_email, test_contact_name, test_message_body)
+    else:
+        deliver_contact_email(MockApp(), test_contact_email, test_contact_name, test_message_body)
+        assert sent == [(mock_to_address,
+                         *compose_notification_email(test_contact_email, test_contact_name, test_message_body))]
+
+
+def test_deliver_contact_email_wrong_account(monkeypatch):
+    """Not sent from an account other than SERVER_EMAIL_ADDRESS."""
+    class MockEZGmail:
+        EMAIL_ADDRESS = 'other@from.address'
 
-    assert all([call for call in mock_call])
+        def send(self, recipient, subject, body):
+            raise AssertionError('Should not send.')
+
+    class MockApp(Flask):
+        def __init__(self):
+            self.config = {'SERVER_EMAIL_ADDRESS': 'mock@from.address',
+                           'CONTACT_EMAIL_ADDRESS': 'mock@to.address',
+                           }
+
+    monkeypatch.setattr(email_notification, 'ezgmail', MockEZGmail())
+    with pytest.raises(RuntimeError):
+        deliver_contact_email(MockApp(), 'contact@host.tld', 'Sir Lancelot', 'Some amusing message.')
 
 
 def test_compose_notification_email():
@@ -85,3 +81,49 @@ def test_compose_notification_email():
                                f'from {test_contact_name}\n'
                                f'{test_contact_email}'
                                )
+
+
+@pytest.mark.parametrize('contact_names, expected_subject',
+                         [(['Sir Lancelot', 'Sir Robin'], '2 contacts from Sir Lancelot, Sir Robin'),
+                          (['Sir Lancelot', 'Sir Lancelot', 'Sir Robin'],  # Names not repeated.
+                           '3 contacts from Sir Lancelot, Sir Robin'),
+                          (['Arthur', 'Bedevere', 'Galahad', 'Lancelot', 'Robin'],
+                           '5 contacts from Arthur, Bedevere, Galahad, 2 others'),
+                          ])
+def test_compose_digest_email(contact_names, expected_subject):
+    contacts = [(f'{n}@host.tld', name, f'Message {n}.') for n, name in enumerate(contact_names)]
+
+    email_subject, email_body = compose_digest_email(contacts)
+
+    assert email_subject == expected_subject
+    # Each contact's notification included, in order.
+    notifications = [compose_notification_email(*contact) for contact in contacts]
+    assert email_body == '\n\n----------\n\n'.join(f'{subject}\n\n{body}' for subject, body in notifications)
+
+
+def test_compose_digest_email_single_contact():
+    """Digest of one contact is a normal notification email."""
+    contact = ('contact@host.tld', 'Sir Lancelot', 'Some amusing message.')
+    assert compose_digest_email([contact]) == compose_notification_email(*contact)
+
+
+def test_deliver_digest_email(monkeypatch):
+    sent = []
+
+    class MockEZGmail:
+        EMAIL_ADDRESS = 'mock@from.address'
+
+        def send(self, recipient, subject, body):
+            sent.append((recipient, subject))
+
+    class MockApp(Flask):
+        def __init__(self):
+            self.config = {'SERVER_EMAIL_ADDRESS': 'mock@from.address',
+                           'CONTACT_EMAIL_ADDRESS': 'mock@to.address',
+                           }
+
+    monkeypatch.setattr(email_notification, 'ezgmail', MockEZGmail())
+    contacts = [('a@host.tld', 'Sir Lancelot', 'Message.'), ('b@host.tld', 'Sir Robin', 'Message.')]
+
+    deliver_digest_email(MockApp(), contacts)
+    assert sent == [('mock@to.address', compose_digest_email(contacts)[0])]
@@ -0,0 +1,135 @@
+""" Test sms_notification.py """
+import urllib.parse
+
+import pytest
+
+from toonarmycaptain_website.contact import sms_notification
+from toonarmycaptain_website.contact.dispatch import NotificationDispatcher
+from toonarmycaptain_website.contact.sms_notification import (compose_notification_sms,
+                                                              FakeSMSTransport,
+                                                              HTTPSMSTransport,
+                                                              RecipientRateLimiter,
+                                                              sms_transport_from_config,
+                                                              SMSTransport,
+                                                              )
+
+
+def test_sms_transport_requires_send():
+    class IncompleteSMSTransport(SMSTransport):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSMSTransport()
+
+
+def test_http_sms_transport(monkeypatch):
+    """Provider API called with message fields and basic auth."""
+    requests = []
+
+    class MockResponse:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    def mock_urlopen(request, timeout):
+        requests.append(request)
+        return MockResponse()
+
+    monkeypatch.setattr(sms_notification.urllib.request, 'urlopen', mock_urlopen)
+
+    HTTPSMSTransport(url='https://sms.provider/messages', from_number='+15550000',
+                     username='user', password='pass').send('+15551234', 'Some message')
+
+    request, = requests
+    assert (request.full_url, request.get_method()) == ('https://sms.provider/messages', 'POST')
+    assert request.get_header('Authorization') == 'Basic dXNlcjpwYXNz'  # user:pass
+    assert urllib.parse.parse_qs(request.data.decode()) == {'To': ['+15551234'],
+                                                            'From': ['+15550000'],
+                                                            'Body': ['Some message']}
+
+
+@pytest.mark.parametrize('backend, transport_type',
+                         [('http', HTTPSMSTransport),
+                          ('fake', FakeSMSTransport),
+                          ])
+def test_sms_transport_from_config(test_app, backend, transport_type):
+    test_app.config['SMS_BACKEND'] = backend
+    assert isinstance(sms_transport_from_config(test_app), transport_type)
+
+
+def test_sms_transport_from_config_unknown_backend(test_app):
+    test_app.config['SMS_BACKEND'] = 'carrier pigeon'
+    with pytest.raises(ValueError):
+        sms_transport_from_config(test_app)
+
+
+def test_recipient_rate_limiter(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sms_notification.time, 'monotonic', lambda: now[0])
+    rate_limiter = RecipientRateLimiter(max_messages=2, period=60)
+
+    assert rate_limiter.acquire('+15551234')
+    assert rate_limiter.acquire('+15551234')
+    assert not rate_limiter.acquire('+15551234')
+    assert rate_limiter.acquire('+15559999')  # Limit is per recipient.
+
+    now[0] += 60  # Earlier messages now outside period.
+    assert rate_limiter.acquire('+15551234')
+
+
+@pytest.mark.parametrize('message_body, expected_sms',
+                         [('Hi.', 'Contact from Sir Lancelot (contact@host.tld): Hi.'),
+                          ('x' * 200, 'Contact from Sir Lancelot (contact@host.tld): ' + 'x' * 111 + '...'),
+                          ],
+                         ids=['short', 'truncated'])
+def test_compose_notification_sms(message_body, expected_sms):
+    sms = compose_notification_sms('contact@host.tld', 'Sir Lancelot', message_body)
+    assert sms == expected_sms
+    assert len(sms) <= 160
+
+
+def test_dispatch_sms(test_app):
+    """Queued SMS sent to contact number, and recorded in db."""
+    test_db = test_app.config['DATABASE']
+    transport = FakeSMSTransport()
+    dispatcher = NotificationDispatcher(test_app, sms_transport=transport,
+                                        sms_rate_limiter=RecipientRateLimiter(max_messages=1, period=60))
+    sent_id, rate_limited_id = [test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}',
+                                                      notification_channels=('sms',))
+                                for n in range(2)]
+
+    assert dispatcher.dispatch_pending() == 2
+    assert transport.sent == [(test_app.config['CONTACT_CELL_NUMBER'],
+                               compose_notification_sms('0@email.com', 'name 0', 'message 0'))]
+    assert test_db._connection().execute(
+        """SELECT id, sms_sent, email_sent FROM message;""").fetchall() == [(sent_id, 1, 0),
+                                                                            (rate_limited_id, 0, 0)]
+    # Rate limited SMS dropped from outbox.
+    assert test_db._connection().execute("""SELECT * FROM outbox;""").fetchall() == []
+
+
+def test_dispatch_sms_failure(test_app):
+    class FailingSMSTransport(FakeSMSTransport):
+        def send(self, to_number, body):
+            raise ConnectionError
+
+    test_db = test_app.config['DATABASE']
+    dispatcher = NotificationDispatcher(test_app, sms_transport=FailingSMSTransport())
+    test_db.store_contact('name', 'name@email.com', 'message', notification_channels=('sms',))
+
+    assert dispatcher.dispatch_pending() == 1
+    assert test_db._connection().execute("""SELECT sms_sent FROM message;""").fetchall() == [(0,)]
+
+
+def test_contact_post_queues_sms_when_enabled(test_client, test_app, monkeypatch):
+    test_app.config['SMS_NOTIFICATIONS_ENABLED'] = True
+    monkeypatch.setattr(test_app.config['NOTIFICATION_DISPATCHER'], 'notify', lambda: None)
+
+    response = test_client.post('contact/', data={'name': 'Sir Lancelot',
+                                                  'email': 'lancelot@camelot.com',
+                                                  'message': 'Some amusing message.'})
+    assert response.status_code == 302
+    assert test_app.config['DATABASE']._connection().execute(
+        """SELECT channel FROM outbox ORDER BY id;""").fetchall() == [('email',), ('sms',)]
@@ -0,0 +1,149 @@
+""" Test critical_css.py """
+import gzip
+
+from pathlib import Path
+
+from toonarmycaptain_website import critical_css
+from tests.test_app_fixture import app_with_test_config
+
+STYLESHEET = """
+/* Comment { with braces } */
+body { padding: 1%; }
+.used, .unused { color: black; }
+.unused { color: red; }
+.used .nested:hover { color: white; }
+#main > p { margin: 0; }
+input[type=text], textarea { float: right; }
+@media (max-width: 600px) { .unused { display: none; } }
+"""
+
+PAGE = """<!doctype html>
+<html>
+<head>
+    <link rel="stylesheet"
+          href="/static/style.css?v=1234">
+</head>
+<body>
+<div id="main" class="used"><p class="nested">Text</p></div>
+<img src="/static/icon.svg">
+<picture>
+    <source type="image/avif" srcset="/static/a-10.avif 10w, /static/a-20.avif 20w" sizes="2em">
+    <source type="image/webp" srcset="/static/a-10.webp 10w" sizes="2em">
+    <img src="/static/a.jpg" alt="">
+</picture>
+<img src="/static/icon.svg">
+</body>
+</html>"""
+
+
+def test_parse_stylesheet():
+    rules = critical_css.parse_stylesheet(STYLESHEET)
+
+    assert [rule.selectors for rule in rules] == [['body'],
+                                                  ['.used', '.unused'],
+                                                  ['.unused'],
+                                                  ['.used .nested:hover'],
+                                                  ['#main > p'],
+                                                  ['input[type=text]', 'textarea'],
+                                                  ['@media (max-width: 600px)']]
+    assert rules[-1].text == '@media (max-width: 600px) { .unused { display: none; } }'
+
+
+def test_may_match():
+    rules = critical_css.parse_stylesheet(STYLESHEET)
+    tags, classes, ids = {'html', 'body', 'div', 'p'}, {'used', 'nested'}, {'main'}
+
+    assert [rule.may_match(tags, classes, ids) for rule in rules] == [True,  # Tag on page.
+                                                                      True,  # One selector matches.
+                                                                      False,
+                                                                      True,  # Regardless of state.
+                                                                      True,
+                                                                      False,  # No form elements.
+                                                                      True,  # At-rules kept.
+                                                                      ]
+
+
+def test_optimise_page(tmpdir):
+    Path(tmpdir, 'style.css').write_text(STYLESHEET)
+    html = critical_css.optimise_page(PAGE, '/static', str(tmpdir))
+    head = html[:html.index('</head>')]
+
+    assert '.used, .unused { color: black; }' in head
+    assert '.unused { color: red; }' not in head
+    assert 'textarea' not in head
+    # Stylesheet deferred, and loaded without JavaScript:
+    assert '<link rel="stylesheet" href="/static/style.css?v=1234" media="print" onload="this.media=\'all\'">' in head
+    assert '<noscript><link rel="stylesheet" href="/static/style.css?v=1234"></noscript>' in head
+    # Images preloaded once each, pictures by their preferred source:
+    assert head.count('rel="preload"') == 2
+    assert '<link rel="preload" as="image" href="/static/icon.svg">' in head
+    assert ('<link rel="preload" as="image" type="image/avif" '
+            'imagesrcset="/static/a-10.avif 10w, /static/a-20.avif 20w" imagesizes="2em">') in head
+    assert 'a.jpg' not in head
+
+
+def test_optimise_page_external_stylesheet(tmpdir):
+    """Only local stylesheets are inlined."""
+    page = PAGE.replace('/static/style.css?v=1234', 'https://cdn.example.com/style.css')
+    assert critical_css.optimise_page(page, '/static', str(tmpdir)) == page
+
+
+def test_rebase_urls():
+    css = """@import "print.css";
+.a { background: url(img/a.png); }
+.b { background: url( '../b.png' ); }
+.c { background: url("/static/c.png"), url(data:image/png;base64,AAAA); }
+.d { fill: url(#gradient); cursor: url(https://example.com/d.cur); }"""
+    assert critical_css.rebase_urls(css, '/static/css/style.css?v=1234') == """@import "/static/css/print.css";
+.a { background: url(/static/css/img/a.png); }
+.b { background: url( '/static/b.png' ); }
+.c { background: url("/static/c.png"), url(data:image/png;base64,AAAA); }
+.d { fill: url(#gradient); cursor: url(https://example.com/d.cur); }"""
+
+
+def test_optimise_page_rebases_urls(tmpdir):
+    """Inlined rules' URLs resolve as they did in the stylesheet, not against the page's URL."""
+    Path(tmpdir, 'style.css').write_text('body { background: url(img/bg.png); }')
+    html = critical_css.optimise_page(PAGE, '/static', str(tmpdir))
+    assert 'body { background: url(/static/img/bg.png); }' in html
+
+
+def test_pages_optimised(test_client):
+    for path in ['home/', 'projects/', 'about/', 'contact/']:
+        page = test_client.get(path, headers={'Accept-Encoding': 'identity'}).data.decode()
+        head = page[:page.index('</head>')]
+        assert '<style>' in head
+        assert '.top_navbar {' in head
+        assert 'media="print" onload=' in head
+        assert '<script></script>' not in page
+
+    contact = test_client.get('contact/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    assert 'imagesrcset="/static/img/github_logo-160.avif' in contact
+    assert '.contact_form {' in contact
+    home = test_client.get('home/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    assert 'github_logo' not in home
+    assert '.contact_form {' not in home
+
+
+def test_uncached_pages_not_cached(test_client):
+    """Contact pages, each with a fresh CSRF token, don't push cached pages out of the cache."""
+    test_client.get('home/')
+    cached = critical_css._optimise_cached_page.cache_info()
+    for _ in range(3):
+        assert '<style>' in test_client.get('contact/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    assert critical_css._optimise_cached_page.cache_info().currsize == cached.currsize
+    test_client.get('home/')
+    assert critical_css._optimise_cached_page.cache_info().hits == cached.hits + 1
+
+
+def test_optimised_before_compression(test_client):
+    identity = test_client.get('home/', headers={'Accept-Encoding': 'identity'})
+    compressed = test_client.get('home/', headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(compressed.data) == identity.data
+
+
+def test_critical_css_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, CRITICAL_CSS_ENABLED=False)
+    page = app.test_client().get('home/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    assert '<style>' not in page
+    assert 'rel="preload"' not in page
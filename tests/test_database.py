@@ -1,10 +1,20 @@
 """ Tests for database.py """
+import os
+import sqlite3
+import threading
+import time
+
 from pathlib import Path
 from random import randint
 
 import pytest
 
-from toonarmycaptain_website.database import ContactDatabase
+from toonarmycaptain_website import database, migrations
+from toonarmycaptain_website.database import (ConnectionPool,
+                                              ConnectionPoolTimeout,
+                                              ContactDatabase,
+                                              validate_durability_profile,
+                                              )
 
 TESTING_CONTACT_MESSAGE_MAX_LENGTH = 10000
 
@@ -37,6 +47,15 @@ def empty_sqlite_database(tmpdir) -> ContactDatabase:
     return test_db
 
 
+@pytest.fixture(params=[True, False], ids=['upsert_returning', 'lookup_then_write'])
+def upsert_returning_supported(request, monkeypatch) -> bool:
+    """Run test with both the upsert and fallback lookup paths for storing a person."""
+    if request.param and sqlite3.sqlite_version_info < (3, 35, 0):
+        pytest.skip('SQLite version does not support RETURNING.')
+    monkeypatch.setattr(database, '_UPSERT_RETURNING_SUPPORTED', request.param)
+    return request.param
+
+
 def test_empty_sqlite_database_fixture(empty_sqlite_database):
     """Ensure test db can be connected to and tables exist."""
     assert empty_sqlite_database
@@ -47,77 +66,108 @@ def test_empty_sqlite_database_fixture(empty_sqlite_database):
         assert (table,) in test_db_tables
 
 
+def insert_person(test_db: ContactDatabase, name: str, email: str, aliases: tuple = ()) -> None:
+    """
+    Insert person and their aliases directly.
+
+    :param test_db: ContactDatabase
+    :param name: str
+    :param email: str
+    :param aliases: tuple of str
+    :return: None
+    """
+    conn = test_db._connection()
+    person_id = conn.cursor().execute(
+        """INSERT INTO person(name, email)
+           VALUES(?,?);
+           """, (name, email)).lastrowid
+    conn.cursor().executemany(
+        """INSERT INTO person_alias(person_id, name)
+           VALUES(?,?);
+           """, [(person_id, alias) for alias in aliases])
+    conn.commit()
+
+
+def stored_person(test_db: ContactDatabase, person_id: int) -> tuple:
+    """
+    Person's name, email and aliases, as stored.
+
+    :param test_db: ContactDatabase
+    :param person_id: int
+    :return: tuple of (str name, str email, set of str aliases)
+    """
+    conn = test_db._connection()
+    name, email = conn.execute("""SELECT name, email FROM person WHERE id=?;""", (person_id,)).fetchone()
+    aliases = conn.execute("""SELECT name FROM person_alias WHERE person_id=?;""", (person_id,)).fetchall()
+    return name, email, {alias for alias, in aliases}
+
+
 @pytest.mark.parametrize(
     'stored_contacts, test_email, returned_contact',
     [((), 'some@email.com', None),  # No contacts in db, email not found.
-     ([('some contact', 'some@contact.com', None)], 'some@email.com', None),  # Email not found in contacts.
-     ([('some contact', 'some@email.com', None)], 'some@email.com',
-      (1, 'some contact', None)),  # Contact with no alt names
-     ([('some contact', 'some@email.com', None)], 'SomE@Email.com',
-      (1, 'some contact', None)),  # Capitalised email comparison.
-     ([('some contact', 'some@email.com', 'some, alt, names')
+     ([('some contact', 'some@contact.com', ())], 'some@email.com', None),  # Email not found in contacts.
+     ([('some contact', 'some@email.com', ())], 'some@email.com',
+      (1, 'some contact', ())),  # Contact with no alt names
+     ([('some contact', 'some@email.com', ())], 'SomE@Email.com',
+      (1, 'some contact', ())),  # Capitalised email comparison.
+     ([('some contact', 'some@email.com', ('some', 'alt', 'names'))
        ], 'some@email.com',
-      (1, 'some contact', 'some, alt, names')),  # Contact with alt names
-     ([('any contact', 'any@email.com', None),
-       ('some contact', 'some@email.com', 'some, alt, names'),
-       ('other contact', 'other@email.com', 'some, other, alt, names'),
+      (1, 'some contact', ('alt', 'names', 'some'))),  # Contact with alt names, in name order.
+     ([('any contact', 'any@email.com', ()),
+       ('some contact', 'some@email.com', ('some', 'alt', 'names')),
+       ('other contact', 'other@email.com', ('some', 'other', 'alt', 'names')),
        ], 'some@email.com',
-      (2, 'some contact', 'some, alt, names')),  # Multiple contacts.
+      (2, 'some contact', ('alt', 'names', 'some'))),  # Multiple contacts.
      ])
 def test_get_person_from_email(empty_sqlite_database,
                                stored_contacts, test_email, returned_contact):
     test_db = empty_sqlite_database
     for stored_contact in stored_contacts:
-        conn = test_db._connection()
-        conn.cursor().execute(
-            """INSERT INTO person(name, email, alternate_names)
-               VALUES(?,?,?);
-               """, (*stored_contact,))
-        conn.commit()
+        insert_person(test_db, *stored_contact)
 
     assert test_db.get_person_from_email(test_db._connection(),
                                          test_email) == returned_contact
 
 
 @pytest.mark.parametrize(
-    'new_contact, existing_person, returned_id, resulting_person_row',
+    'new_contact, existing_person, returned_id, resulting_person',
     [(('new contact', 'new@contact.com'), None,  # Brand new entry
-      1, ('new contact', 'new@contact.com', None)),  # NB null alt name.
+      1, ('new contact', 'new@contact.com', set())),  # NB no alt names.
      (('new contact', 'New@Contact.com'), None,  # Brand new entry with mixed case email.
-      1, ('new contact', 'new@contact.com', None)),
+      1, ('new contact', 'new@contact.com', set())),
      # Existing email with same name.
-     (('new contact', 'new@contact.com'), ('new contact', 'new@contact.com', None),
-      1, ('new contact', 'new@contact.com', None)),
-     (('new contact', 'New@Contact.com'), ('new contact', 'new@contact.com', None),
-      1, ('new contact', 'new@contact.com', None)),  # Mixed case orig email.
+     (('new contact', 'new@contact.com'), ('new contact', 'new@contact.com', ()),
+      1, ('new contact', 'new@contact.com', set())),
+     (('new contact', 'New@Contact.com'), ('new contact', 'new@contact.com', ()),
+      1, ('new contact', 'new@contact.com', set())),  # Mixed case orig email.
      # Existing email, different name, no initial alt names.
-     (('new name', 'new@contact.com'), ('new contact', 'new@contact.com', None),
-      1, ('new contact', 'new@contact.com', 'new name')),  # NB New alt name.
-     # Existing email, existing alt name.
-     (('new contact', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name'),
-      1, ('new contact', 'new@contact.com', 'new name')),  # NB New alt name.
-     # Existing email, alt name, existing alt name.
-     (('new name', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name'),
-      1, ('new contact', 'new@contact.com', 'new name')),  # NB No new alt name added.
+     (('new name', 'new@contact.com'), ('new contact', 'new@contact.com', ()),
+      1, ('new contact', 'new@contact.com', {'new name'})),  # NB New alt name.
      # Existing email, orig name, existing alt name.
-     (('new contact', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name'),
-      1, ('new contact', 'new@contact.com', 'new name')),  # NB No new alt name added.
+     (('new contact', 'new@contact.com'), ('new contact', 'new@contact.com', ('new name',)),
+      1, ('new contact', 'new@contact.com', {'new name'})),  # NB No new alt name added.
+     # Existing email, alt name, existing alt name.
+     (('new name', 'new@contact.com'), ('new contact', 'new@contact.com', ('new name',)),
+      1, ('new contact', 'new@contact.com', {'new name'})),  # NB No new alt name added.
      # Existing email, 1st alt name, existing alt names.
-     (('new name1', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name1, new name2'),
-      1, ('new contact', 'new@contact.com', 'new name1, new name2')),  # NB No new alt name added.
-     # Existing email, 2nd alt name, existing alt names.
-     (('new name2', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name1'),
-      1, ('new contact', 'new@contact.com', 'new name1, new name2')),  # NB No new alt name added.
-     # Existing email, new name, existing alt names.
-     (('new name3', 'new@contact.com'), ('new contact', 'new@contact.com', 'new name1, new name2'),
-      1, ('new contact', 'new@contact.com', 'new name1, new name2, new name3')),  # NB New alt name.
+     (('new name1', 'new@contact.com'), ('new contact', 'new@contact.com', ('new name1', 'new name2')),
+      1, ('new contact', 'new@contact.com', {'new name1', 'new name2'})),  # NB No new alt name added.
+     # Existing email, new name, existing alt name.
+     (('new name2', 'new@contact.com'), ('new contact', 'new@contact.com', ('new name1',)),
+      1, ('new contact', 'new@contact.com', {'new name1', 'new name2'})),  # NB New alt name.
+     # Existing email, new name contained in an existing alt name.
+     (('Ann', 'new@contact.com'), ('new contact', 'new@contact.com', ('Joanne',)),
+      1, ('new contact', 'new@contact.com', {'Joanne', 'Ann'})),  # NB New alt name, not a substring match.
+     # Existing email, new name containing a comma.
+     (('Smith, Jo', 'new@contact.com'), ('new contact', 'new@contact.com', ('Jo',)),
+      1, ('new contact', 'new@contact.com', {'Jo', 'Smith, Jo'})),
      # New contact where there is existing.
-     (('new contact', 'new@contact.com'), ('other contact', 'exists@contact.com', "whatever alt names"),
-      2, ('new contact', 'new@contact.com', None)),  # New contact added.
+     (('new contact', 'new@contact.com'), ('other contact', 'exists@contact.com', ('whatever alt name',)),
+      2, ('new contact', 'new@contact.com', set())),  # New contact added.
      ])
-def test_store_person(empty_sqlite_database,
+def test_store_person(empty_sqlite_database, upsert_returning_supported,
                       new_contact, existing_person,
-                      returned_id, resulting_person_row):
+                      returned_id, resulting_person):
     """
     Data stored
 
@@ -126,19 +176,11 @@ def test_store_person(empty_sqlite_database,
     """
     test_db = empty_sqlite_database
     if existing_person:
-        conn = test_db._connection()
-        conn.cursor().execute(
-            """INSERT INTO person(name, email, alternate_names)
-               VALUES(?,?,?);
-               """, (*existing_person,))
-        conn.commit()
+        insert_person(test_db, *existing_person)
 
     assert test_db.store_person(*new_contact) == returned_id
 
-    assert test_db._connection().cursor().execute(
-        """SELECT * 
-           FROM person
-           WHERE id=?""", (returned_id,)).fetchone() == (returned_id, *resulting_person_row)
+    assert stored_person(test_db, returned_id) == resulting_person
 
 
 def test_store_message_text(empty_sqlite_database):
@@ -148,7 +190,7 @@ def test_store_message_text(empty_sqlite_database):
     message_id = test_db.store_message_text(test_contact_id, test_message)
 
     assert test_db._connection().cursor().execute(
-        """SELECT * 
+        """SELECT id, person_id, contents, email_sent, sms_sent
            FROM message
            WHERE id=?
            """, (message_id,)).fetchone() == (message_id, test_contact_id, test_message,
@@ -164,28 +206,43 @@ def test_store_contact(empty_sqlite_database):
     test_message_text = 'some message'
     test_message_id = 34
 
-    called = {'mocked_store_person': False,
-              'mocked_store_message_text': False}
+    called = {'mocked_upsert_person': False,
+              'mocked_insert_message': False}
+    connections = []
 
-    def mocked_store_person(name, email):
-        """Mock db.store_person."""
-        called['mocked_store_person'] = True
+    def mocked_upsert_person(db_connection, name, email):
+        """Mock db._upsert_person."""
+        called['mocked_upsert_person'] = True
+        connections.append(db_connection)
         assert (name, email) == (test_name, test_email)
         return test_contact_id
 
-    def mocked_store_message_test(person_id, message):
-        """Mock db.store_message_test."""
-        called['mocked_store_message_text'] = True
+    def mocked_insert_message(db_connection, person_id, message, fingerprint=None):
+        """Mock db._insert_message."""
+        called['mocked_insert_message'] = True
+        connections.append(db_connection)
         assert (person_id, message) == (test_contact_id, test_message_text)
         return test_message_id
 
-    test_db.store_person = mocked_store_person
-    test_db.store_message_text = mocked_store_message_test
+    test_db._upsert_person = mocked_upsert_person
+    test_db._insert_message = mocked_insert_message
 
     assert test_db.store_contact(test_name,
                                  test_email,
                                  test_message_text) == test_message_id
     assert all([called[mock] for mock in called])
+    # Person and message written in the same transaction.
+    assert connections[0] is connections[1]
+
+
+def test_store_contact_failure_leaves_no_orphan_person(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    too_long_message = 'x' * (TESTING_CONTACT_MESSAGE_MAX_LENGTH + 1)
+
+    with pytest.raises(sqlite3.IntegrityError):
+        test_db.store_contact('name', 'name@email.com', too_long_message)
+
+    assert test_db._connection().execute("""SELECT * FROM person;""").fetchall() == []
 
 
 def test_store_contact_integration_unmocked(empty_sqlite_database):
@@ -200,16 +257,12 @@ def test_store_contact_integration_unmocked(empty_sqlite_database):
                                             test_email,
                                             test_message_text)
     # Stored contact
-    assert test_db._connection().cursor().execute(
-        """SELECT * 
-           FROM person
-           WHERE id=?""", (test_contact_id,)).fetchone() == (test_contact_id,
-                                                             test_name,
-                                                             test_email,
-                                                             None)  # No alt names.
+    assert stored_person(test_db, test_contact_id) == (test_name,
+                                                       test_email,
+                                                       set())  # No alt names.
     # Stored message
     assert test_db._connection().cursor().execute(
-        """SELECT * 
+        """SELECT id, person_id, contents, email_sent, sms_sent
            FROM message
            WHERE id=?
            """, (test_message_id,)).fetchone() == (test_message_id, test_contact_id, test_message_text,
@@ -224,7 +277,7 @@ def test_email_sent(empty_sqlite_database):
 
     # No existing field data:
     assert test_db._connection().cursor().execute(
-        """SELECT * 
+        """SELECT id, person_id, contents, email_sent, sms_sent
            FROM message
            WHERE id=?
            """, (test_message_id,)).fetchone() == (test_message_id,
@@ -250,7 +303,7 @@ def test_sms_sent(empty_sqlite_database):
 
     # No existing field data:
     assert test_db._connection().cursor().execute(
-        """SELECT * 
+        """SELECT id, person_id, contents, email_sent, sms_sent
            FROM message
            WHERE id=?
            """, (test_message_id,)).fetchone() == (test_message_id,
@@ -266,3 +319,511 @@ def test_sms_sent(empty_sqlite_database):
            FROM message
            WHERE id=?
            """, (test_message_id,)).fetchone() == (1,)
+
+
+def test_connection_pool_reuses_connection(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=2)
+    first = pool.checkout()
+    pool.checkin(first)
+    # Returned connection is reused rather than a new one created.
+    assert pool.checkout() is first
+
+
+def test_connection_pool_max_size(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=1, checkout_timeout=0.01)
+    connection = pool.checkout()
+    with pytest.raises(ConnectionPoolTimeout):
+        pool.checkout()
+
+    # Waiting checkout succeeds once a connection is returned by another thread.
+    pool.checkout_timeout = 5
+    threading.Timer(0.05, pool.checkin, args=(connection,)).start()
+    assert pool.checkout() is connection
+
+
+def test_connection_pool_idle_eviction(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=1, max_idle_seconds=0)
+    connection = pool.checkout()
+    pool.checkin(connection)
+    assert pool.checkout() is not connection
+    with pytest.raises(sqlite3.ProgrammingError):  # Evicted connection was closed.
+        connection.execute("""SELECT 1;""")
+
+
+def test_connection_pool_discards_connection_on_error(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=1)
+    with pytest.raises(ValueError):
+        with pool.connection() as connection:
+            raise ValueError
+    assert pool.checkout() is not connection
+
+
+def test_connection_pool_disabled(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=0)
+    connection = pool.checkout()
+    pool.checkin(connection)
+    with pytest.raises(sqlite3.ProgrammingError):  # Closed on return.
+        connection.execute("""SELECT 1;""")
+    assert pool.checkout() is not connection
+
+
+def test_connection_pool_close(empty_sqlite_database):
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=2)
+    idle, checked_out = pool.checkout(), pool.checkout()
+    pool.checkin(idle)
+
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle.execute("""SELECT 1;""")
+    # Checked out connection is closed when returned.
+    pool.checkin(checked_out)
+    with pytest.raises(sqlite3.ProgrammingError):
+        checked_out.execute("""SELECT 1;""")
+    with pytest.raises(sqlite3.ProgrammingError):
+        pool.checkout()
+
+
+def test_connection_pool_after_fork(empty_sqlite_database, monkeypatch):
+    """A forked process neither uses nor closes the parent's pooled connections."""
+    pool = ConnectionPool(empty_sqlite_database._connection, max_size=2, checkout_timeout=0.01)
+    idle, checked_out_by_parent = pool.checkout(), pool.checkout()
+    pool.checkin(idle)
+    parent_lock = pool._condition
+
+    monkeypatch.setattr(database.os, 'getpid', lambda: -1)  # As in a forked child.
+    connection = pool.checkout()
+    assert connection is not idle and connection is not checked_out_by_parent
+    assert pool.checkout() is not None  # Parent's checked out connection not counted.
+    assert pool._condition is not parent_lock
+    pool.checkin(connection)
+    assert pool.checkout() is connection
+    # Inherited connections left open, for the parent.
+    assert idle.execute("""SELECT 1;""").fetchone() == (1,)
+    assert checked_out_by_parent.execute("""SELECT 1;""").fetchone() == (1,)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires fork().')
+def test_contact_database_in_forked_process(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    message_id = test_db.store_contact('name', 'name@email.com', 'before fork')
+    inherited = test_db._pool._idle[0][0]
+
+    pid = os.fork()
+    if pid == 0:  # Child: exit status reports success, without running pytest's teardown.
+        try:
+            child_id = test_db.store_contact('name', 'name@email.com', 'in child')
+            ok = (child_id == message_id + 1 and test_db._pool._idle[0][0] is not inherited
+                  and test_db._pool._inherited == [inherited])
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    # Parent's connection unaffected.
+    assert test_db.store_contact('name', 'name@email.com', 'after fork') == message_id + 2
+    assert test_db._pool._idle[0][0] is inherited
+
+
+def test_contact_database_uses_pool(empty_sqlite_database):
+    """Public methods share pooled connections rather than connecting each call."""
+    test_db = empty_sqlite_database
+    connections_made = []
+    connection_factory = test_db._pool._connection_factory
+
+    def counting_connection_factory():
+        connections_made.append(True)
+        return connection_factory()
+
+    test_db._pool._connection_factory = counting_connection_factory
+    for _ in range(3):
+        message_id = test_db.store_contact('some name', 'some@email.com', 'some message')
+        test_db.email_sent(message_id)
+        test_db.sms_sent(message_id)
+    # _init_db's connection is reused, so no new connections are required.
+    assert not connections_made
+
+
+def test_durability_profile_applied_to_connections(tmpdir):
+    test_db = ContactDatabase(database_path=Path(tmpdir, 'test_db'),
+                              message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH,
+                              durability_profile={'journal_mode': 'wal',
+                                                  'synchronous': 'NORMAL',
+                                                  'busy_timeout': 1234,
+                                                  'cache_size': -4000,
+                                                  'mmap_size': 1024 * 1024,
+                                                  })
+    with test_db._pooled_connection() as conn:
+        assert conn.execute("""PRAGMA journal_mode;""").fetchone() == ('wal',)
+        assert conn.execute("""PRAGMA synchronous;""").fetchone() == (1,)  # NORMAL
+        assert conn.execute("""PRAGMA busy_timeout;""").fetchone() == (1234,)
+        assert conn.execute("""PRAGMA cache_size;""").fetchone() == (-4000,)
+        assert conn.execute("""PRAGMA mmap_size;""").fetchone() == (1024 * 1024,)
+        assert conn.execute("""PRAGMA foreign_keys;""").fetchone() == (1,)
+
+
+@pytest.mark.parametrize(
+    'profile',
+    [{'journal_mode': 'WAL; DROP TABLE person'},  # Not a journal mode.
+     {'synchronous': 2},  # Mode names only.
+     {'busy_timeout': '5000'},
+     {'cache_size': True},
+     {'page_size': 4096},  # Unsupported setting.
+     ])
+def test_validate_durability_profile_rejects_invalid(profile):
+    with pytest.raises(ValueError):
+        validate_durability_profile(profile)
+
+
+def test_app_database_durability_profile(test_app):
+    """App database configured from config."""
+    assert test_app.config['DATABASE'].durability_profile == {
+        'journal_mode': test_app.config['CONTACT_DATABASE_JOURNAL_MODE'],
+        'synchronous': test_app.config['CONTACT_DATABASE_SYNCHRONOUS'],
+        'busy_timeout': test_app.config['CONTACT_DATABASE_BUSY_TIMEOUT'],
+        'cache_size': test_app.config['CONTACT_DATABASE_CACHE_SIZE'],
+        'mmap_size': test_app.config['CONTACT_DATABASE_MMAP_SIZE'],
+    }
+
+
+def test_store_contact_queues_notifications(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    message_id = test_db.store_contact('name', 'name@email.com', 'some message',
+                                       notification_channels=('email', 'sms'))
+
+    assert test_db._connection().execute(
+        """SELECT message_id, channel, claimed_at
+           FROM outbox
+           ORDER BY id;""").fetchall() == [(message_id, 'email', None),
+                                           (message_id, 'sms', None)]
+
+
+def test_claim_notifications(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    first_id = test_db.store_contact('name', 'name@email.com', 'first message',
+                                     notification_channels=('email',))
+    second_id = test_db.store_contact('other', 'other@email.com', 'second message',
+                                      notification_channels=('email', 'sms'))
+
+    claimed = test_db.claim_notifications('email', limit=1, lease_seconds=60)
+    assert [row[1:] for row in claimed] == [(first_id, 'name@email.com', 'name', 'first message', 0)]
+    # Claimed notification is not claimed again while leased.
+    claimed = test_db.claim_notifications('email', limit=10, lease_seconds=60)
+    assert [row[1:] for row in claimed] == [(second_id, 'other@email.com', 'other', 'second message', 0)]
+    assert test_db.claim_notifications('email', limit=10, lease_seconds=60) == []
+
+    # Expired claims can be claimed again.
+    assert len(test_db.claim_notifications('email', limit=10, lease_seconds=-1)) == 2
+
+
+def test_complete_notification(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    test_db.store_contact('name', 'name@email.com', 'message', notification_channels=('email',))
+    (outbox_id, *_), = test_db.claim_notifications('email', limit=1, lease_seconds=60)
+
+    test_db.complete_notification(outbox_id)
+    assert test_db._connection().execute("""SELECT * FROM outbox;""").fetchall() == []
+
+
+def test_email_failed(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    message_id = test_db.store_contact('name', 'name@email.com', 'message')
+
+    test_db.email_failed(message_id, error='first error', retry_at=100.0)
+    test_db.email_failed(message_id, error='second error', retry_at=None)
+
+    assert test_db._connection().execute(
+        """SELECT email_sent, email_attempts, email_last_error, email_next_attempt_at
+           FROM message
+           WHERE id=?;""", (message_id,)).fetchone() == (0, 2, 'second error', None)
+
+
+def test_claim_email_retries(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    overdue_id, due_id, not_due_id, gave_up_id, sent_id = [
+        test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}') for n in range(5)]
+    now = time.time()
+    test_db.email_failed(due_id, error='error', retry_at=now - 10)
+    test_db.email_failed(overdue_id, error='error', retry_at=now - 20)
+    test_db.email_failed(overdue_id, error='error', retry_at=now - 20)
+    test_db.email_failed(not_due_id, error='error', retry_at=now + 60)
+    test_db.email_failed(gave_up_id, error='error', retry_at=None)
+    test_db.email_failed(sent_id, error='error', retry_at=now - 30)
+    test_db.email_sent(sent_id)
+
+    assert test_db.claim_email_retries(limit=10, lease_seconds=60) == [
+        (overdue_id, '0@email.com', 'name 0', 'message 0', 2),
+        (due_id, '1@email.com', 'name 1', 'message 1', 1),
+    ]
+    # Claimed retries leased to caller.
+    assert test_db.claim_email_retries(limit=10, lease_seconds=60) == []
+
+
+def test_claim_email_retries_uses_index(empty_sqlite_database):
+    """Retry scan reads the partial index of unsent messages rather than the whole table."""
+    query_plan = empty_sqlite_database._connection().execute(
+        """EXPLAIN QUERY PLAN
+           SELECT message.id, person.email, person.name, message.contents,
+                  message.email_attempts
+           FROM message
+           JOIN person ON person.id = message.person_id
+           WHERE message.email_sent=0
+             AND message.email_next_attempt_at <= ?
+           ORDER BY message.email_next_attempt_at
+           LIMIT ?;""", (0, 10)).fetchall()
+    assert any('USING INDEX message_email_retry_idx' in step[-1] for step in query_plan)
+
+
+def test_init_db_adds_retry_columns_to_existing_database(tmpdir):
+    """Database created before retries were recorded gets columns, unsent emails retried only when scheduled."""
+    database_path = Path(tmpdir, 'old_db')
+    conn = sqlite3.connect(database_path)
+    conn.executescript(
+        """CREATE TABLE person(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               name TEXT NOT NULL,
+                               email TEXT UNIQUE NOT NULL,
+                               alternate_names TEXT);
+           CREATE TABLE message(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                person_id INTEGER NOT NULL,
+                                contents TEXT NOT NULL,
+                                email_sent BOOLEAN NOT NULL DEFAULT 0,
+                                sms_sent BOOLEAN NOT NULL DEFAULT 0,
+                                FOREIGN KEY (person_id) REFERENCES person(id));
+           INSERT INTO person(name, email) VALUES('name', 'name@email.com');
+           INSERT INTO message(person_id, contents, email_sent) VALUES(1, 'unsent', 0);
+           INSERT INTO message(person_id, contents, email_sent) VALUES(1, 'sent', 1);""")
+    conn.commit()
+    conn.close()
+
+    test_db = ContactDatabase(database_path=database_path,
+                              message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH)
+    assert test_db.claim_email_retries(limit=10, lease_seconds=60) == []
+    assert test_db.schedule_email_retries(spread=0) == 1
+    assert test_db.claim_email_retries(limit=10, lease_seconds=60) == [
+        (1, 'name@email.com', 'name', 'unsent', 0)]
+
+
+def test_schedule_email_retries(empty_sqlite_database, monkeypatch):
+    test_db = empty_sqlite_database
+    monkeypatch.setattr(database.time, 'time', lambda: 1000.0)
+    old_id, gave_up_id, unsent_id, sent_id, due_id = [
+        test_db.store_contact(f'name {n}', f'{n}@email.com', f'message {n}') for n in range(5)]
+    queued_id = test_db.store_contact('name', 'name@email.com', 'queued', notification_channels=('email',))
+    test_db.email_failed(gave_up_id, error='error', retry_at=None)
+    test_db.email_sent(sent_id)
+    test_db.email_failed(due_id, error='error', retry_at=1050.0)
+
+    # Spread over 60 seconds, oldest first, from gave_up_id:
+    assert test_db.schedule_email_retries(spread=60, min_message_id=gave_up_id) == 2
+    assert test_db._connection().execute(
+        """SELECT id, email_next_attempt_at FROM message ORDER BY id;""").fetchall() == [
+        (old_id, None), (gave_up_id, 1000.0), (unsent_id, 1030.0), (sent_id, None), (due_id, 1050.0),
+        (queued_id, None)]
+
+
+def test_emails_sent(empty_sqlite_database, monkeypatch):
+    test_db = empty_sqlite_database
+    monkeypatch.setattr(database, 'ID_BATCH_SIZE', 2)  # Update in several batches.
+    message_ids = [test_db.store_contact('name', 'name@email.com', f'message {n}') for n in range(6)]
+
+    test_db.emails_sent(message_ids[:5])
+    assert test_db._connection().execute(
+        """SELECT email_sent FROM message ORDER BY id;""").fetchall() == [(1,)] * 5 + [(0,)]
+
+
+def test_outbox_status(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    assert test_db.outbox_status('email', lease_seconds=60) == (0, None)
+
+    before = time.time()
+    for n in range(3):
+        test_db.store_contact('name', 'name@email.com', f'message {n}', notification_channels=('email',))
+    test_db.store_contact('name', 'name@email.com', 'sms message', notification_channels=('sms',))
+    test_db.claim_notifications('email', limit=1, lease_seconds=60)
+
+    queued, oldest_queued_at = test_db.outbox_status('email', lease_seconds=60)
+    assert queued == 2  # Excludes claimed notification.
+    assert before <= oldest_queued_at <= time.time()
+
+
+def test_complete_notifications(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    for n in range(3):
+        test_db.store_contact('name', 'name@email.com', f'message {n}', notification_channels=('email',))
+    claimed = test_db.claim_notifications('email', limit=2, lease_seconds=60)
+
+    test_db.complete_notifications([outbox_id for outbox_id, *_ in claimed])
+    assert test_db._connection().execute("""SELECT id FROM outbox;""").fetchall() == [(3,)]
+
+
+def test_init_db_records_schema_version(empty_sqlite_database):
+    with empty_sqlite_database._pooled_connection() as conn:
+        assert conn.execute("""PRAGMA user_version;""").fetchone()[0] == migrations.SCHEMA_VERSION
+
+
+def test_init_db_skipped_when_schema_current(empty_sqlite_database):
+    with empty_sqlite_database._pooled_connection() as conn:
+        conn.execute("""DROP INDEX message_email_retry_idx;""")
+    empty_sqlite_database.close()
+
+    # Schema current, DDL skipped:
+    reopened = ContactDatabase(database_path=empty_sqlite_database.database_path,
+                               message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH)
+    with reopened._pooled_connection() as conn:
+        assert not conn.execute("""SELECT name FROM sqlite_master WHERE name='message_email_retry_idx';""").fetchall()
+        conn.execute("""PRAGMA user_version=0;""")
+    reopened.close()
+
+    # Earlier version, schema upgraded:
+    reopened = ContactDatabase(database_path=empty_sqlite_database.database_path,
+                               message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH)
+    with reopened._pooled_connection() as conn:
+        assert conn.execute("""SELECT name FROM sqlite_master WHERE name='message_email_retry_idx';""").fetchall()
+        assert conn.execute("""PRAGMA user_version;""").fetchone()[0] == migrations.SCHEMA_VERSION
+    reopened.close()
+
+
+def test_list_messages(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    for n in range(5):
+        test_db.store_contact(f'name {n % 2}', f'{n % 2}@email.com', f'message {n}')
+    test_db.emails_sent([1, 2])
+    test_db.sms_sent(5)
+
+    assert test_db.list_messages(limit=2) == [(5, 1, 'name 0', '0@email.com', 'message 4', 0, 1),
+                                              (4, 2, 'name 1', '1@email.com', 'message 3', 0, 0)]
+    assert [row[0] for row in test_db.list_messages(before_id=4, limit=2)] == [3, 2]
+    assert [row[0] for row in test_db.list_messages(before_id=2)] == [1]
+    assert [row[0] for row in test_db.list_messages(email_sent=False)] == [5, 4, 3]
+    assert [row[0] for row in test_db.list_messages(email_sent=True, before_id=2)] == [1]
+    assert [row[0] for row in test_db.list_messages(sms_sent=True)] == [5]
+    assert [row[0] for row in test_db.list_messages(person_id=2, sms_sent=False)] == [4, 2]
+
+
+@pytest.mark.parametrize('condition, parameters, index', [
+    ('message.person_id = ? AND message.id < ?', (1, 100), 'message_person_idx'),
+    ('message.email_sent = ? AND message.id < ?', (False, 100), 'message_email_sent_unsent_idx'),
+    ('message.sms_sent = ? AND message.id < ?', (False, 100), 'message_sms_sent_unsent_idx'),
+    ('message.id < ?', (100,), 'INTEGER PRIMARY KEY'),
+])
+def test_list_messages_uses_index(empty_sqlite_database, condition, parameters, index):
+    """Pages are seeks into an index, in message.id order, rather than scans and sorts."""
+    query_plan = empty_sqlite_database._connection().execute(
+        f"""EXPLAIN QUERY PLAN
+            SELECT message.id, person.name
+            FROM message
+            JOIN person ON person.id = message.person_id
+            WHERE {condition}
+            ORDER BY message.id DESC
+            LIMIT 50;""", parameters).fetchall()
+    details = [step[-1] for step in query_plan]
+    assert any(index in detail for detail in details)
+    assert not any('TEMP B-TREE' in detail for detail in details)
+
+
+@pytest.fixture(params=[True, False], ids=['fts5', 'like'])
+def full_text_search(request, empty_sqlite_database) -> bool:
+    """Run test searching with both the FTS5 index and LIKE."""
+    if request.param and not empty_sqlite_database.full_text_search:
+        pytest.skip('SQLite lacks FTS5.')
+    empty_sqlite_database.full_text_search = request.param
+    return request.param
+
+
+def test_search_messages(empty_sqlite_database, full_text_search):
+    test_db = empty_sqlite_database
+    test_db.store_contact('Jo Bloggs', 'jo@example.com', 'Question about your website.')
+    test_db.store_contact('Sam', 'sam@example.org', 'The website is down, website website.')
+    test_db.store_contact('Ann', 'ann@example.org', 'Hello "quoted" 100% _underscored_')
+
+    def found(query):
+        return [row[0] for row in test_db.search_messages(query)]
+
+    assert test_db.search_messages('question') == [
+        (1, 1, 'Jo Bloggs', 'jo@example.com', 'Question about your website.', 0, 0)]
+    assert sorted(found('website')) == [1, 2]
+    assert found('website example.org') == [2]  # All words, in contents or sender.
+    assert found('bloggs') == [1]
+    assert found('ann@example.org') == [3]
+    assert sorted(found('webs*')) == [1, 2]
+    assert found('"quoted"') == [3]  # Quotes aren't query syntax.
+    assert found('100%') == [3]
+    assert found('') == []
+    assert found('missing') == []
+    if full_text_search:
+        assert found('website') == [2, 1]  # Ranked by bm25, most occurrences first.
+        assert found('webs') == []  # Whole words, unless a prefix.
+
+
+def test_search_index_follows_changes(empty_sqlite_database):
+    test_db = empty_sqlite_database
+    if not test_db.full_text_search:
+        pytest.skip('SQLite lacks FTS5.')
+    test_db.store_contact('Jo', 'jo@example.com', 'original contents')
+    test_db.store_person('Joanna', 'jo@example.com')  # Alias, name unchanged.
+    with test_db._pooled_connection() as conn:
+        conn.execute("""UPDATE message SET contents='edited contents' WHERE id=1;""")
+        conn.execute("""UPDATE person SET name='Renamed' WHERE id=1;""")
+    assert [row[0] for row in test_db.search_messages('edited renamed')] == [1]
+    assert test_db.search_messages('original') == []
+
+    with test_db._pooled_connection() as conn:
+        conn.execute("""DELETE FROM message WHERE id=1;""")
+        # Index consistent with its content:
+        conn.execute("""INSERT INTO message_search(message_search, rank) VALUES('integrity-check', 1);""")
+    assert test_db.search_messages('edited') == []
+
+
+def test_search_without_fts5(tmpdir, monkeypatch):
+    monkeypatch.setattr(migrations, 'fts5_available', lambda connection: False)
+    test_db = empty_sqlite_test_db(tmpdir)
+    assert not test_db.full_text_search
+    test_db.store_contact('Jo', 'jo@example.com', 'some message')
+    assert [row[0] for row in test_db.search_messages('message')] == [1]
+
+
+def test_full_text_search_detected_without_migrating(tmpdir):
+    """A worker not migrating on startup still uses an existing FTS5 index."""
+    migrated = empty_sqlite_test_db(tmpdir)
+    migrated.close()
+    test_db = ContactDatabase(database_path=migrated.database_path, message_max_length=100,
+                              migrate_on_init=False)
+    assert test_db.full_text_search == migrated.full_text_search
+
+
+def test_store_contact_skips_recent_duplicate(empty_sqlite_database, monkeypatch):
+    test_db = empty_sqlite_database
+    now = [1000.0]
+    monkeypatch.setattr(database.time, 'time', lambda: now[0])
+    fingerprint = b'0123456789abcdef'
+
+    first_id = test_db.store_contact('name', 'name@email.com', 'some message',
+                                     notification_channels=('email',),
+                                     fingerprint=fingerprint, duplicate_window=60)
+    now[0] += 59
+    assert test_db.store_contact('other name', 'name@email.com', 'some message',
+                                 notification_channels=('email',),
+                                 fingerprint=fingerprint, duplicate_window=60) is None
+    # Nothing written for the duplicate:
+    assert stored_person(test_db, 1) == ('name', 'name@email.com', set())
+    assert test_db._connection().execute(
+        """SELECT message_id FROM outbox;""").fetchall() == [(first_id,)]
+    # Stored once outside the window, or without a window.
+    now[0] += 2
+    assert test_db.store_contact('name', 'name@email.com', 'some message',
+                                 fingerprint=fingerprint, duplicate_window=60) is not None
+    assert test_db.store_contact('name', 'name@email.com', 'some message',
+                                 fingerprint=fingerprint) is not None
+    assert test_db._connection().execute(
+        """SELECT fingerprint, received_at FROM message ORDER BY id;""").fetchall() == [
+        (fingerprint, 1000.0), (fingerprint, 1061.0), (fingerprint, 1061.0)]
+
+
+def test_duplicate_check_uses_index(empty_sqlite_database):
+    """Duplicate check is a seek into the fingerprint index, however many messages are stored."""
+    query_plan = empty_sqlite_database._connection().execute(
+        """EXPLAIN QUERY PLAN
+           SELECT 1
+           FROM message
+           WHERE fingerprint=? AND received_at >= ?
+           LIMIT 1;""", (b'fingerprint', 0)).fetchall()
+    assert any('message_fingerprint_idx' in step[-1] for step in query_plan)
@@ -0,0 +1,72 @@
+""" Test early_hints.py """
+import pytest
+
+from toonarmycaptain_website import early_hints
+from tests.test_app_fixture import app_with_test_config
+
+PAGE = """<!doctype html>
+<html>
+<head>
+    <style>body { padding: 1%; }</style>
+    <link rel="stylesheet" href="/static/style.css?v=1234" media="print" onload="this.media='all'">
+    <noscript><link rel="stylesheet" href="/static/style.css?v=1234"></noscript>
+    <link rel="preload" as="image" href="/static/icon.svg">
+    <link rel="preload" as="image" type="image/avif" imagesrcset="/static/a-10.avif 10w, /static/a-20.avif 20w" imagesizes="2em">
+    <link rel="icon" href="/static/favicon.png">
+</head>
+<body>
+<link rel="preload" as="image" href="/static/too_late.svg">
+</body>
+</html>"""
+
+
+def test_page_links():
+    """Stylesheets deferred by critical_css aren't preloaded, others are."""
+    assert early_hints.page_links(PAGE) == (
+        '</static/icon.svg>; rel=preload; as=image',
+        '</static/a-10.avif>; rel=preload; as=image; type="image/avif"; '
+        'imagesrcset="/static/a-10.avif 10w, /static/a-20.avif 20w"; imagesizes=2em',
+    )
+    assert early_hints.page_links('<head><link rel="stylesheet" href="/static/style.css"></head>') == (
+        '</static/style.css>; rel=preload; as=style',)
+
+
+def test_link_headers(test_app, test_client, monkeypatch):
+    response = test_client.get('contact/', headers={'Accept-Encoding': 'gzip'})
+    links = response.headers.getlist('Link')
+
+    # Stylesheet deferred by critical CSS:
+    assert not any(link.startswith('</static/style.css?v=') for link in links)
+    assert any('imagesrcset="/static/img/github_logo-160.avif' in link for link in links)
+    assert test_app.extensions['early_hints']['my_site.contact'] == tuple(links)
+
+    # Read from the endpoint's first page only:
+    monkeypatch.setattr(early_hints, 'page_links', lambda html: pytest.fail('Page parsed again.'))
+    assert test_client.get('contact/').headers.getlist('Link') == links
+
+
+def test_link_headers_without_critical_css(tmpdir):
+    app = app_with_test_config(tmpdir, CRITICAL_CSS_ENABLED=False)
+    links = app.test_client().get('home/').headers.getlist('Link')
+    assert any(link.startswith('</static/style.css?v=') and '; as=style' in link for link in links)
+
+
+def test_early_hints_sent(test_client):
+    hints = []
+    environ = {'wsgi.early_hints': hints.append}
+
+    test_client.get('home/', environ_overrides=environ)
+    assert hints == []  # Endpoint's links not yet known.
+
+    response = test_client.get('home/', environ_overrides=environ)
+    assert hints == [[('Link', link) for link in response.headers.getlist('Link')]]
+
+
+def test_link_headers_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, PRELOAD_LINK_HEADERS_ENABLED=False)
+    hints = []
+    client = app.test_client()
+    for _ in range(2):
+        response = client.get('home/', environ_overrides={'wsgi.early_hints': hints.append})
+        assert 'Link' not in response.headers
+    assert hints == []
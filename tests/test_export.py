@@ -0,0 +1,66 @@
+""" Test export.py """
+from pathlib import Path
+
+from toonarmycaptain_website import export
+
+
+def test_exportable_paths(test_app):
+    paths = export.exportable_paths(test_app)
+
+    assert {'/', '/home/', '/projects/', '/about/', '/about_text/', '/blog/', '/favicon.ico'} <= set(paths)
+    assert '/contact/' not in paths  # Dynamic.
+    assert not any(path.startswith('/static') for path in paths)  # Copied instead.
+
+
+def test_output_file(tmpdir):
+    assert export.output_file(Path(tmpdir), '/') == Path(tmpdir, 'index.html')
+    assert export.output_file(Path(tmpdir), '/home/') == Path(tmpdir, 'home', 'index.html')
+    assert export.output_file(Path(tmpdir), '/favicon.ico') == Path(tmpdir, 'favicon.ico')
+
+
+def test_export_site(test_app, test_client, tmpdir):
+    output_dir = Path(tmpdir, 'site')
+    report = {path: (status, description)
+              for path, status, description in export.export_site(test_app, output_dir)}
+
+    for path in ['/home/', '/projects/', '/about/', '/about_text/']:
+        assert report[path][0] == 200
+        assert (Path(output_dir, path.strip('/'), 'index.html').read_bytes()
+                == test_client.get(path, headers={'Accept-Encoding': 'identity'}).data)
+    assert not Path(output_dir, 'contact').exists()
+
+    # Redirects:
+    assert report['/'] == (301, 'redirect to /home/')
+    assert 'url=/home/' in Path(output_dir, 'index.html').read_text()
+    redirects = Path(output_dir, export.REDIRECTS_FILENAME).read_text().splitlines()
+    assert '/ /home/ 301' in redirects
+    assert f'/blog/ {test_app.config["BLOG_URL"]} 302' in redirects
+    assert any(redirect.startswith('/favicon.ico /static/favicon.ico') for redirect in redirects)
+    assert not Path(output_dir, 'favicon.ico').exists()
+
+    # Static files, and precompressed siblings:
+    assert (Path(output_dir, 'static', 'style.css').read_bytes()
+            == Path(test_app.static_folder, 'style.css').read_bytes())
+    assert Path(output_dir, 'static', 'style.css.gz').is_file()
+    assert Path(output_dir, 'home', 'index.html.gz').is_file()
+
+
+def test_export_site_skips_erroring_routes(test_app, tmpdir):
+    """adam_todo's template doesn't exist."""
+    report = {path: (status, description)
+              for path, status, description in export.export_site(test_app, Path(tmpdir), precompress=False)}
+
+    status, description = report['/adam_todo/']
+    assert status is None
+    assert description.startswith('skipped')
+    assert not Path(tmpdir, 'adam_todo').exists()
+    assert not Path(tmpdir, 'home', 'index.html.gz').exists()
+
+
+def test_export_static_command(test_app, tmpdir):
+    result = test_app.test_cli_runner().invoke(args=['export-static', str(Path(tmpdir, 'site'))])
+
+    assert result.exit_code == 0
+    assert '/home/ 200: home' in result.output
+    assert 'my_site.contact' in result.output
+    assert Path(tmpdir, 'site', 'home', 'index.html').is_file()
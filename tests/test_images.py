@@ -0,0 +1,100 @@
+""" Test images.py """
+import json
+
+from pathlib import Path
+
+import pytest
+
+from flask import render_template_string
+
+from toonarmycaptain_website import images
+
+PICTURE_TEMPLATE = ("{% from '_picture_macro.html' import picture %}"
+                    "{{ picture('avatar.png', alt='Avatar', sizes='2em', img_class='avatar', width=40) }}")
+
+
+@pytest.fixture
+def source_image(tmpdir) -> Path:
+    """Static folder with a 40x20 source image."""
+    image_module = pytest.importorskip('PIL.Image')
+    image_module.new('RGBA', (40, 20), (255, 0, 0, 128)).save(Path(tmpdir, 'avatar.png'))
+    return Path(tmpdir)
+
+
+def test_build_image_variants(source_image):
+    index = images.build_image_variants(source_image,
+                                        sources={'avatar.png': (10, 20, 40, 80)},
+                                        formats={'webp': {'quality': 80}})
+    entry = index['avatar.png']
+
+    assert (entry['width'], entry['height']) == (40, 20)
+    assert entry['bytes'] == Path(source_image, 'avatar.png').stat().st_size
+    # Not upscaled:
+    assert [variant['width'] for variant in entry['variants']['webp']] == [10, 20, 40]
+
+    from PIL import Image
+    for variant in entry['variants']['webp']:
+        with Image.open(Path(source_image, variant['filename'])) as image:
+            assert image.format == 'WEBP'
+            assert image.size == (variant['width'], variant['width'] // 2)
+            assert image.mode == 'RGBA'  # Transparency kept.
+    # Index written for the app to load:
+    assert images.load_image_variants(source_image) == json.loads(json.dumps(index))
+
+
+@pytest.mark.filterwarnings('ignore:Unknown feature')
+def test_build_image_variants_skips_unsupported_format(source_image):
+    index = images.build_image_variants(source_image,
+                                        sources={'avatar.png': (20,)},
+                                        formats={'webp': {}, 'not_a_format': {}})
+    assert list(index['avatar.png']['variants']) == ['webp']
+
+
+def test_load_image_variants_not_built(tmpdir):
+    assert images.load_image_variants(Path(tmpdir)) == {}
+
+
+def test_size_report():
+    index = {'avatar.png': {'width': 40, 'height': 20, 'bytes': 1000,
+                            'variants': {'webp': [{'filename': 'img/avatar-20.webp', 'width': 20, 'bytes': 100},
+                                                  {'filename': 'img/avatar-40.webp', 'width': 40, 'bytes': 250}]}}}
+    assert images.size_report(index) == ['avatar.png (40x20): 1000 bytes',
+                                         '  webp: 20w 100, 40w 250 (75% smaller at largest width)']
+
+
+def test_picture_macro(test_app):
+    test_app.jinja_env.globals['image_variants'] = {
+        'avatar.png': {'width': 40, 'height': 20, 'bytes': 1000,
+                       'variants': {'avif': [{'filename': 'img/avatar-20.avif', 'width': 20, 'bytes': 80},
+                                             {'filename': 'img/avatar-40.avif', 'width': 40, 'bytes': 200}],
+                                    'webp': [{'filename': 'img/avatar-20.webp', 'width': 20, 'bytes': 100}]}}}
+    with test_app.test_request_context():
+        html = ' '.join(render_template_string(PICTURE_TEMPLATE).split())
+
+    assert ('<source type="image/avif" sizes="2em" '
+            'srcset="/static/img/avatar-20.avif 20w, /static/img/avatar-40.avif 40w">') in html
+    assert '<source type="image/webp" sizes="2em" srcset="/static/img/avatar-20.webp 20w">' in html
+    assert html.index('image/avif') < html.index('image/webp')  # Preferred format first.
+    assert '<img class="avatar" src="/static/avatar.png" alt="Avatar" width="40">' in html
+
+
+def test_picture_macro_without_variants(test_app):
+    """Images without built variants are plain <img>."""
+    test_app.jinja_env.globals['image_variants'] = {}
+    with test_app.test_request_context():
+        html = ' '.join(render_template_string(PICTURE_TEMPLATE).split())
+
+    assert '<source' not in html
+    assert '<img class="avatar" src="/static/avatar.png" alt="Avatar" width="40">' in html
+
+
+def test_avatar_variants_built(test_app):
+    """Variants of RESPONSIVE_IMAGES are committed, and used by pages."""
+    assert set(test_app.config['IMAGE_VARIANTS']) == set(images.RESPONSIVE_IMAGES)
+    for entry in test_app.config['IMAGE_VARIANTS'].values():
+        for variants in entry['variants'].values():
+            for variant in variants:
+                assert Path(test_app.static_folder, variant['filename']).is_file()
+
+    page = test_app.test_client().get('home/', headers={'Accept-Encoding': 'identity'}).data
+    assert b'<source type="image/avif"' in page
@@ -0,0 +1,81 @@
+""" Test inbox.py """
+import pytest
+
+from toonarmycaptain_website.export import exportable_paths
+from tests.test_app_fixture import app_with_test_config
+
+TOKEN = 'some inbox token'
+
+
+@pytest.fixture
+def inbox_app(tmpdir):
+    app = app_with_test_config(tmpdir, INBOX_API_TOKEN=TOKEN)
+    for n in range(5):
+        app.config['DATABASE'].store_contact(f'name {n % 2}', f'{n % 2}@email.com', f'message {n}')
+    app.config['DATABASE'].emails_sent([1, 2])
+    return app
+
+
+def get(app, path, token=TOKEN):
+    return app.test_client().get(path, headers={'Authorization': f'Bearer {token}'} if token else {})
+
+
+def test_inbox_disabled_without_token(test_client):
+    assert test_client.get('/inbox/api/messages').status_code == 404
+
+
+@pytest.mark.parametrize('token', [None, 'wrong token'])
+def test_inbox_requires_token(inbox_app, token):
+    response = get(inbox_app, '/inbox/api/messages', token=token)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_inbox_messages(inbox_app):
+    response = get(inbox_app, '/inbox/api/messages?limit=2')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.json['messages'] == [
+        {'id': 5, 'person': {'id': 1, 'name': 'name 0', 'email': '0@email.com'},
+         'contents': 'message 4', 'email_sent': False, 'sms_sent': False},
+        {'id': 4, 'person': {'id': 2, 'name': 'name 1', 'email': '1@email.com'},
+         'contents': 'message 3', 'email_sent': False, 'sms_sent': False},
+    ]
+
+    pages = [[message['id'] for message in response.json['messages']]]
+    while next_url := response.json['next']:
+        response = get(inbox_app, next_url)
+        pages.append([message['id'] for message in response.json['messages']])
+    assert pages == [[5, 4], [3, 2], [1]]
+
+
+def test_inbox_filters(inbox_app):
+    response = get(inbox_app, '/inbox/api/messages?email_sent=false&person_id=1&limit=1')
+    assert [message['id'] for message in response.json['messages']] == [5]
+    # Filters carried to the next page:
+    assert 'email_sent=0' in response.json['next'] and 'person_id=1' in response.json['next']
+    response = get(inbox_app, response.json['next'])
+    assert [message['id'] for message in response.json['messages']] == [3]
+    assert response.json['next'] is None
+
+    response = get(inbox_app, '/inbox/api/messages?email_sent=1')
+    assert [message['id'] for message in response.json['messages']] == [2, 1]
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=501', 'email_sent=maybe'])
+def test_inbox_invalid_query(inbox_app, query):
+    assert get(inbox_app, f'/inbox/api/messages?{query}').status_code == 400
+
+
+def test_inbox_not_exported(inbox_app):
+    assert '/inbox/api/messages' not in exportable_paths(inbox_app)
+
+
+def test_inbox_search(inbox_app):
+    response = get(inbox_app, '/inbox/api/search?q=message+3')
+    assert response.status_code == 200
+    assert [message['id'] for message in response.json['messages']] == [4]
+    assert response.json['messages'][0]['person']['email'] == '1@email.com'
+
+    assert get(inbox_app, '/inbox/api/search?q=').status_code == 400
+    assert get(inbox_app, '/inbox/api/search?q=message', token='wrong token').status_code == 401
@@ -7,7 +7,10 @@ def test_favicon(test_client, test_app):
     response = test_client.get('/favicon.ico')
     assert response.status_code == 302
     import urllib.parse
-    assert urllib.parse.unquote(response.headers['Location']) in 'http://localhost/static/favicon.ico?mimetype=image/vnd.microsoft.icon'
+    location = urllib.parse.urlsplit(urllib.parse.unquote(response.headers['Location']))
+    assert location.path == '/static/favicon.ico'
+    assert urllib.parse.parse_qs(location.query) == {'mimetype': ['image/vnd.microsoft.icon'],
+                                                     'v': [test_app.config['STATIC_MANIFEST']['favicon.ico']]}
 
 
 def test_base_url_redirects_to_home(test_client, test_app):
@@ -64,3 +67,53 @@ def test_redirect_to_blog(test_client, test_app):
     response = test_client.get('blog/')
     assert response.status_code == 302
     assert response.headers['Location'] in test_app.config['BLOG_URL']
+
+
+def test_contact_post_queues_notification(test_client, test_app, monkeypatch):
+    """Contact POST stores message and queues notification without sending it."""
+    from toonarmycaptain_website.contact import email_notification
+
+    def mock_deliver_contact_email(*args, **kwargs):
+        raise AssertionError('Email should not be sent during the request.')
+
+    notified = []
+    monkeypatch.setattr(email_notification, 'deliver_contact_email', mock_deliver_contact_email)
+    monkeypatch.setattr(test_app.config['NOTIFICATION_DISPATCHER'], 'notify', lambda: notified.append(True))
+
+    response = test_client.post('contact/', data={'name': 'Sir Lancelot',
+                                                  'email': 'lancelot@camelot.com',
+                                                  'message': 'Some amusing message.'})
+    assert response.status_code == 302
+    assert notified == [True]
+
+    test_db = test_app.config['DATABASE']
+    assert test_db._connection().execute(
+        """SELECT message.contents, message.email_sent, outbox.channel
+           FROM message
+           JOIN outbox ON outbox.message_id = message.id;""").fetchall() == [
+        ('Some amusing message.', 0, 'email')]
+
+    # Sent by the dispatcher, after the request:
+    sent = []
+    monkeypatch.setattr(email_notification, 'deliver_contact_email', lambda app, *contact: sent.append(contact))
+    assert test_app.config['NOTIFICATION_DISPATCHER'].dispatch_pending() == 1
+    assert sent == [('lancelot@camelot.com', 'Sir Lancelot', 'Some amusing message.')]
+
+
+@pytest.mark.parametrize('same_worker', [True, False], ids=['same worker', 'other worker'])
+def test_contact_post_duplicate_not_stored(test_client, test_app, monkeypatch, same_worker):
+    """Resubmitted message is answered as a success, but not stored or notified again."""
+    notified = []
+    monkeypatch.setattr(test_app.config['NOTIFICATION_DISPATCHER'], 'notify', lambda: notified.append(True))
+    data = {'name': 'Sir Lancelot', 'email': 'lancelot@camelot.com', 'message': 'Some amusing message.'}
+
+    assert test_client.post('contact/', data=data).status_code == 302
+    if not same_worker:  # Found by the database's fingerprint index.
+        test_app.config['CONTACT_RECENT_FINGERPRINTS']._received.clear()
+    response = test_client.post('contact/', data={**data, 'message': ' some amusing  message.'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Thankyou!' in response.data
+    assert notified == [True]
+    assert test_app.config['DATABASE']._connection().execute(
+        """SELECT count(*) FROM message;""").fetchone() == (1,)
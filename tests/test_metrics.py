@@ -0,0 +1,122 @@
+""" Test metrics.py """
+import re
+
+import pytest
+
+from toonarmycaptain_website.contact import dispatch
+from toonarmycaptain_website.export import exportable_paths
+from toonarmycaptain_website.metrics import Histogram, Metrics
+from tests.test_app_fixture import app_with_test_config
+
+SERVER_TIMING = re.compile(r'[a-z_]+;dur=\d+\.\d{2}')
+TOKEN = 'some metrics token'
+
+
+@pytest.fixture
+def metrics_app(tmpdir):
+    """App serving /metrics, and Server-Timing headers."""
+    return app_with_test_config(tmpdir, METRICS_TOKEN=TOKEN, SERVER_TIMING_ENABLED=True)
+
+
+def server_timing(response) -> dict[str, float]:
+    """
+    :param response: Response
+    :return: dict of {stage: milliseconds}
+    """
+    entries = response.headers['Server-Timing'].split(', ')
+    assert all(SERVER_TIMING.fullmatch(entry) for entry in entries)
+    return {stage: float(duration) for stage, duration in
+            (entry.split(';dur=') for entry in entries)}
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [('0.1', 2), ('1', 3), ('+Inf', 4)]
+    assert histogram.sum == pytest.approx(2.65)
+
+
+def test_server_timing_template(metrics_app):
+    metrics_app.config['PAGE_CACHE'] = None
+    timings = server_timing(metrics_app.test_client().get('/home/'))
+    assert set(timings) == {'template', 'total'}
+    assert timings['template'] <= timings['total']
+
+
+def test_server_timing_database(metrics_app):
+    response = metrics_app.test_client().post('/contact/', data={'name': 'some name',
+                                                   'email': 'some@email.com',
+                                                   'message': 'some message'})
+    assert {'db_connect', 'db_execute', 'db_commit', 'total'} <= set(server_timing(response))
+
+
+def test_server_timing_disabled_by_default(test_client):
+    assert 'Server-Timing' not in test_client.get('/home/').headers
+
+
+def test_metrics_endpoint(metrics_app):
+    metrics_app.config['PAGE_CACHE'] = None
+    test_client = metrics_app.test_client()
+    test_client.get('/home/')
+    test_client.get('/home/')
+    test_client.get('/missing/')
+
+    response = test_client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert response.content_type == 'text/plain; version=0.0.4; charset=utf-8'
+    metrics = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="my_site.home",method="GET",status="200"} 2' in metrics
+    assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1' in metrics
+    assert 'http_request_duration_seconds_count{endpoint="my_site.home",method="GET"} 2' in metrics
+    assert 'http_request_duration_seconds_bucket{endpoint="my_site.home",method="GET",le="+Inf"} 2' in metrics
+    assert 'stage_duration_seconds_count{stage="template"} 2' in metrics
+    assert '# TYPE stage_duration_seconds histogram' in metrics
+
+
+@pytest.mark.parametrize('headers', [{},
+                                     {'Authorization': 'Bearer wrong token'},
+                                     {'Authorization': f'Basic {TOKEN}'},
+                                     ])
+def test_metrics_endpoint_requires_token(metrics_app, headers):
+    response = metrics_app.test_client().get('/metrics', headers=headers)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_metrics_endpoint_without_token(test_app, test_client):
+    """Metrics recorded, but not served."""
+    test_client.get('/home/')
+    assert test_app.config['METRICS'].requests
+    assert test_client.get('/metrics').status_code == 404
+
+
+def test_notification_send_timed(test_app, monkeypatch):
+    sent = []
+    monkeypatch.setattr('toonarmycaptain_website.contact.email_notification.deliver_contact_email',
+                        lambda app, *contact: sent.append(contact))
+    test_app.config['DATABASE'].store_contact('name', 'name@email.com', 'message',
+                                              notification_channels=('email',))
+    test_app.config['NOTIFICATION_DISPATCHER'].dispatch_pending()
+
+    assert sent
+    assert sum(test_app.config['METRICS'].stage_durations['notification_email'].counts) == 1
+
+
+def test_metrics_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, METRICS_ENABLED=False)
+    assert app.config['METRICS'] is None
+    assert app.config['DATABASE'].timer is None
+    response = app.test_client().get('/home/')
+    assert 'Server-Timing' not in response.headers
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_metrics_label_escaped():
+    metrics = Metrics()
+    metrics.observe_stage('some "stage"', 0.01)
+    assert 'stage="some \\"stage\\""' in metrics.prometheus()
+
+
+def test_metrics_not_exported(metrics_app):
+    assert '/metrics' not in exportable_paths(metrics_app)
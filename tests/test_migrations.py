@@ -0,0 +1,187 @@
+""" Test migrations.py """
+import sqlite3
+
+from pathlib import Path
+
+import pytest
+
+from toonarmycaptain_website import migrations
+from toonarmycaptain_website.database import ContactDatabase
+from toonarmycaptain_website.migrations import (Migration,
+                                                migrate,
+                                                schema_version,
+                                                SCHEMA_VERSION,
+                                                TableRebuild,
+                                                )
+from tests.test_app_fixture import app_with_test_config
+from tests.test_database import TESTING_CONTACT_MESSAGE_MAX_LENGTH
+
+
+@pytest.fixture
+def version_1_database(tmpdir) -> Path:
+    """
+    Database at schema version 1, with people and messages.
+
+    :param tmpdir: temporary directory path (fixture)
+    :return: Path
+    """
+    database_path = Path(tmpdir, 'version_1.db')
+    conn = sqlite3.connect(database_path)
+    migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH, migrations=migrations.MIGRATIONS[:1])
+    conn.executemany("""INSERT INTO person(name, email, alternate_names) VALUES(?,?,?);""",
+                     [(f'name {n}', f'{n}@email.com', f'alt {n}' if n % 2 else None) for n in range(1, 8)])
+    conn.execute("""DELETE FROM person WHERE id=7;""")  # Highest id deleted, not to be reused.
+    conn.executemany("""INSERT INTO message(person_id, contents) VALUES(?,?);""",
+                     [(n, f'message {n}') for n in range(1, 7)])
+    conn.commit()
+    conn.close()
+    return database_path
+
+
+def connect(database_path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(database_path)
+    connection.execute("""PRAGMA foreign_keys=ON;""")
+    return connection
+
+
+def test_new_database_at_schema_version(empty_sqlite_database):
+    with empty_sqlite_database._pooled_connection() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+        assert empty_sqlite_database.migrate() == []
+
+
+@pytest.mark.parametrize('statement, parameters', [
+    ("""INSERT INTO person(name, email) VALUES(?,?);""", ('name', 'e' * 256)),  # Previously unchecked.
+    ("""INSERT INTO person(name, email) VALUES(?,?);""", ('n' * 256, 'name@email.com')),
+    ("""INSERT INTO person_alias(person_id, name) VALUES(1,?);""", ('n' * 256,)),
+    ("""INSERT INTO person_alias(person_id, name) VALUES(2,?);""", ('no person 2',)),
+])
+def test_person_checks(empty_sqlite_database, statement, parameters):
+    empty_sqlite_database.store_person('name', 'name@email.com')
+    with pytest.raises(sqlite3.IntegrityError):
+        with empty_sqlite_database._pooled_connection() as conn:
+            conn.execute(statement, parameters)
+
+
+def test_rebuild_keeps_rows(version_1_database):
+    conn = connect(version_1_database)
+    before = conn.execute("""SELECT * FROM person ORDER BY id;""").fetchall()
+
+    assert migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH, batch_size=2,
+                   migrations=migrations.MIGRATIONS[:2]) == [2]
+    assert conn.execute("""SELECT * FROM person ORDER BY id;""").fetchall() == before
+    assert conn.execute("""SELECT name FROM sqlite_master
+                           WHERE name LIKE 'person_rebuild%';""").fetchall() == []
+    assert conn.execute("""PRAGMA foreign_key_check;""").fetchall() == []
+    # Messages still reference person, ids continue after the deleted person's:
+    assert 'REFERENCES person(id)' in conn.execute(
+        """SELECT sql FROM sqlite_master WHERE name='message';""").fetchone()[0]
+    assert conn.execute("""INSERT INTO person(name, email) VALUES('new', 'new@email.com')
+                           RETURNING id;""").fetchone() == (8,)
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("""INSERT INTO person(name, email) VALUES('long email', ?);""", ('e' * 256,))
+
+
+def test_rebuild_mirrors_concurrent_writes(version_1_database, monkeypatch):
+    """Writes by other workers between batches are kept."""
+    conn = connect(version_1_database)
+    other_worker = connect(version_1_database)
+    writes = iter([
+        """INSERT INTO person(name, email) VALUES('new', 'new@email.com');""",  # After copied rows.
+        """UPDATE person SET alternate_names='updated' WHERE id=1;""",  # Already copied.
+        """UPDATE person SET alternate_names='updated' WHERE id=6;""",  # Not yet copied.
+        """DELETE FROM person WHERE id=5 AND NOT EXISTS (SELECT 1 FROM message WHERE person_id=5);""",
+    ])
+
+    def write_between_batches(seconds):
+        for statement in writes:
+            other_worker.execute(statement)
+            other_worker.commit()
+            break
+
+    monkeypatch.setattr(migrations.time, 'sleep', write_between_batches)
+    conn.execute("""DELETE FROM message WHERE person_id=5;""")
+    conn.commit()
+
+    assert migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH, batch_size=2,
+                   migrations=migrations.MIGRATIONS[:2]) == [2]
+    assert conn.execute("""SELECT id, alternate_names FROM person ORDER BY id;""").fetchall() == [
+        (1, 'updated'), (2, None), (3, 'alt 3'), (4, None), (6, 'updated'), (8, None)]
+
+
+def test_failed_rebuild_leaves_table_usable(version_1_database):
+    conn = connect(version_1_database)
+    conn.execute("""INSERT INTO person(name, email) VALUES('long email', ?);""", ('e' * 256,))
+    conn.commit()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH, batch_size=2)
+    assert schema_version(conn) == 1
+    assert conn.execute("""SELECT name FROM sqlite_master
+                           WHERE name LIKE 'person_rebuild%';""").fetchall() == []
+    conn.execute("""INSERT INTO person(name, email) VALUES('new', 'new@email.com');""")
+    conn.commit()
+
+
+def test_failed_migration_rolled_back(tmpdir):
+    def create_then_fail(connection, message_max_length):
+        connection.execute("""CREATE TABLE some_table(id INTEGER PRIMARY KEY);""")
+        raise sqlite3.OperationalError('Some failure.')
+
+    conn = sqlite3.connect(Path(tmpdir, 'test.db'))
+    with pytest.raises(sqlite3.OperationalError):
+        migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH,
+                migrations=[*migrations.MIGRATIONS, Migration(SCHEMA_VERSION + 1, 'Fails.', create_then_fail)])
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert conn.execute("""SELECT name FROM sqlite_master WHERE name='some_table';""").fetchall() == []
+
+
+def test_migrate_skips_applied_versions(tmpdir):
+    def fail(connection, message_max_length):
+        raise AssertionError('Migration already applied.')
+
+    conn = sqlite3.connect(Path(tmpdir, 'test.db'))
+    conn.execute("""PRAGMA user_version=3;""")  # Eg migrated by a newer release.
+    assert migrate(conn, TESTING_CONTACT_MESSAGE_MAX_LENGTH,
+                   migrations=[Migration(3, 'Applied.', fail),
+                               TableRebuild(2, 'Applied.', 'person', ('id',), 'CREATE TABLE {table}(id);')]) == []
+    assert schema_version(conn) == 3
+
+
+def test_migrate_on_startup_disabled(tmpdir):
+    database_path = Path(tmpdir, 'test.db')
+    app = app_with_test_config(tmpdir, CONTACT_DATABASE_PATH=database_path,
+                               CONTACT_DATABASE_MIGRATE_ON_STARTUP=False)
+    assert schema_version(sqlite3.connect(database_path)) == 0
+
+    result = app.test_cli_runner().invoke(args=['migrate-db', '--batch-size', '10'])
+    assert result.exit_code == 0
+    assert str(list(range(1, SCHEMA_VERSION + 1))) in result.output
+    assert schema_version(sqlite3.connect(database_path)) == SCHEMA_VERSION
+
+    result = app.test_cli_runner().invoke(args=['migrate-db'])
+    assert 'already current' in result.output
+
+
+def test_contact_database_migrates_version_1(version_1_database):
+    test_db = ContactDatabase(database_path=version_1_database,
+                              message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH)
+    with test_db._pooled_connection() as conn:
+        assert schema_version(conn) == SCHEMA_VERSION
+    assert test_db.store_person('name 1', '1@email.com') == 1
+
+
+def test_alternate_names_moved_to_person_alias(version_1_database):
+    conn = connect(version_1_database)
+    conn.execute("""UPDATE person SET alternate_names='name 1, Jo, , Smith,Jo, Jo' WHERE id=1;""")
+    conn.commit()
+    test_db = ContactDatabase(database_path=version_1_database,
+                              message_max_length=TESTING_CONTACT_MESSAGE_MAX_LENGTH)
+
+    with test_db._pooled_connection() as conn:
+        # Primary name, empty and duplicate names dropped:
+        assert test_db.get_person_from_email(conn, '1@email.com') == (1, 'name 1', ('Jo', 'Smith,Jo'))
+        assert test_db.get_person_from_email(conn, '2@email.com') == (2, 'name 2', ())
+        assert test_db.get_person_from_email(conn, '3@email.com') == (3, 'name 3', ('alt 3',))
+        assert 'alternate_names' not in {column for _, column, *_ in conn.execute("""PRAGMA table_info(person);""")}
+        assert conn.execute("""PRAGMA foreign_key_check;""").fetchall() == []
@@ -0,0 +1,81 @@
+""" Test page_cache.py """
+import pytest
+
+from flask import Flask
+
+from tests.test_app_fixture import app_with_test_config
+from toonarmycaptain_website import main_site
+
+
+@pytest.fixture
+def render_calls(monkeypatch) -> list:
+    """Record templates rendered by main_site routes."""
+    calls = []
+    render_template = main_site.render_template
+
+    def counting_render_template(template_name, **context):
+        calls.append(template_name)
+        return render_template(template_name, **context)
+
+    monkeypatch.setattr(main_site, 'render_template', counting_render_template)
+    return calls
+
+
+@pytest.mark.parametrize('route, template',
+                         [('home', 'home.html'),
+                          ('projects', 'projects.html'),
+                          ('about', 'about.html'),
+                          ])
+def test_page_rendered_once(test_app, test_client, render_calls, route, template):
+    first = test_client.get(f'{route}/')
+    second = test_client.get(f'{route}/')
+
+    assert render_calls == [template]
+    assert first.status_code == second.status_code == 200
+    assert first.data == second.data
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.headers['Cache-Control'] == f'public, max-age={test_app.config["PAGE_CACHE_MAX_AGE"]}'
+
+
+def test_if_none_match_not_modified(test_client):
+    etag = test_client.get('home/').headers['ETag']
+    assert not etag.startswith('W/')  # Strong ETag.
+
+    response = test_client.get('home/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = test_client.get('home/', headers={'If-None-Match': '"some other etag"'})
+    assert response.status_code == 200
+
+
+def test_config_change_renders_fresh_page(test_app, test_client, render_calls):
+    test_client.get('home/')
+    test_app.config['BLOG_URL'] = 'https://another.blog.url'
+    response = test_client.get('home/')
+
+    assert render_calls == ['home.html', 'home.html']
+    assert b'https://another.blog.url' in response.data
+
+
+def test_page_cache_clear(test_app, test_client, render_calls):
+    test_client.get('home/')
+    test_app.config['PAGE_CACHE'].clear()
+    test_client.get('home/')
+
+    assert render_calls == ['home.html', 'home.html']
+
+
+def test_page_cache_disabled(tmpdir, monkeypatch, render_calls):
+    from tests import test_app_fixture
+    monkeypatch.setitem(test_app_fixture.default_test_config, 'PAGE_CACHE_ENABLED', False)
+    app: Flask = app_with_test_config(tmpdir)
+    assert app.config['PAGE_CACHE'] is None
+
+    test_client = app.test_client()
+    first = test_client.get('home/')
+    response = test_client.get('home/', headers={'If-None-Match': first.headers['ETag']})
+
+    assert render_calls == ['home.html', 'home.html']
+    assert response.status_code == 304  # Still conditional.
+    assert 'Cache-Control' not in first.headers
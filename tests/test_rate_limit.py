@@ -0,0 +1,169 @@
+""" Test rate_limit.py """
+import itertools
+import logging
+
+from pathlib import Path
+
+import pytest
+
+from toonarmycaptain_website.database import ContactDatabase
+from toonarmycaptain_website.rate_limit import (pseudonym,
+                                                SQLiteTokenBucketLimiter,
+                                                TokenBucketLimiter,
+                                                )
+from tests.test_app_fixture import app_with_test_config
+
+# Burst of 2, then a token every 10 seconds.
+LIMITS = {'ip': (2, 0.1), 'email': (3, 0.1)}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def limiter_and_clock(request, tmpdir):
+    now = [1000.0]
+    if request.param == 'memory':
+        limiter = TokenBucketLimiter(LIMITS, clock=lambda: now[0])
+    else:
+        database = ContactDatabase(database_path=Path(tmpdir, 'test.db'), message_max_length=100)
+        limiter = SQLiteTokenBucketLimiter(database, LIMITS, clock=lambda: now[0])
+    return limiter, now
+
+
+def test_token_bucket_limiter(limiter_and_clock):
+    limiter, now = limiter_and_clock
+    assert limiter.acquire({'ip': '192.0.2.1'}) == 0
+    assert limiter.acquire({'ip': '192.0.2.1'}) == 0
+    assert limiter.acquire({'ip': '192.0.2.1'}) == pytest.approx(10)
+    assert limiter.acquire({'ip': '192.0.2.2'}) == 0  # Limit is per key.
+
+    now[0] += 4
+    assert limiter.acquire({'ip': '192.0.2.1'}) == pytest.approx(6)
+    now[0] += 6  # Refilled one token.
+    assert limiter.acquire({'ip': '192.0.2.1'}) == 0
+    assert limiter.acquire({'ip': '192.0.2.1'}) == pytest.approx(10)
+
+    now[0] += 1000  # Refills to capacity, not beyond.
+    assert [limiter.acquire({'ip': '192.0.2.1'}) for _ in range(3)] == [0, 0, pytest.approx(10)]
+
+
+def test_token_bucket_limiter_takes_all_or_none(limiter_and_clock):
+    limiter, now = limiter_and_clock
+    for n in range(2):
+        assert limiter.acquire({'ip': '192.0.2.1', 'email': 'lancelot@camelot.com'}) == 0
+    # IP exhausted, so email token not taken:
+    assert limiter.acquire({'ip': '192.0.2.1', 'email': 'lancelot@camelot.com'}) == pytest.approx(10)
+    assert limiter.acquire({'ip': '192.0.2.2', 'email': 'lancelot@camelot.com'}) == 0
+    assert limiter.acquire({'ip': '192.0.2.3', 'email': 'lancelot@camelot.com'}) == pytest.approx(10)
+
+
+def test_token_bucket_limiter_forgets_full_buckets(monkeypatch):
+    from toonarmycaptain_website import rate_limit
+    monkeypatch.setattr(rate_limit, 'FORGET_FULL_MIN_BUCKETS', 10)
+    now = [1000.0]
+    limiter = TokenBucketLimiter(LIMITS, clock=lambda: now[0])
+    for n in range(10):
+        limiter.acquire({'ip': f'192.0.2.{n}'})
+    now[0] += 10  # All refilled.
+    limiter.acquire({'ip': '192.0.2.1'})
+    assert list(limiter._buckets) == [('ip', '192.0.2.1')]
+
+
+def test_sqlite_limiter_deletes_full_buckets(tmpdir):
+    now = [1000.0]
+    database = ContactDatabase(database_path=Path(tmpdir, 'test.db'), message_max_length=100)
+    limiter = SQLiteTokenBucketLimiter(database, LIMITS, clock=lambda: now[0])
+    limiter.acquire({'ip': '192.0.2.1'})
+    limiter.acquire({'ip': '192.0.2.2'})
+    limiter.acquire({'ip': '192.0.2.2'})
+    now[0] += 10  # 192.0.2.1 refilled.
+    limiter.acquire({'ip': '192.0.2.3'})
+    assert database._connection().execute("""SELECT key FROM rate_limit ORDER BY key;""").fetchall() == [
+        ('ip:192.0.2.2',), ('ip:192.0.2.3',)]
+
+
+def test_sqlite_limiter_shared_by_databases(tmpdir):
+    """Workers' limiters, each with its own ContactDatabase, share buckets."""
+    now = [1000.0]
+    limiters = [SQLiteTokenBucketLimiter(ContactDatabase(database_path=Path(tmpdir, 'test.db'),
+                                                         message_max_length=100),
+                                         LIMITS, clock=lambda: now[0])
+                for _ in range(2)]
+    assert limiters[0].acquire({'ip': '192.0.2.1'}) == 0
+    assert limiters[1].acquire({'ip': '192.0.2.1'}) == 0
+    assert limiters[0].acquire({'ip': '192.0.2.1'}) > 0
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_contact_post_rate_limited(tmpdir, backend):
+    app = app_with_test_config(tmpdir, CONTACT_RATE_LIMIT_BACKEND=backend,
+                               CONTACT_RATE_LIMIT_IP_BURST=3, CONTACT_RATE_LIMIT_EMAIL_BURST=2)
+    client = app.test_client()
+    messages = itertools.count()
+
+    def post(email, ip='192.0.2.1'):
+        return client.post('contact/', data={'name': 'Sir Lancelot', 'email': email,
+                                             'message': f'Hello {next(messages)}.'},
+                           environ_base={'REMOTE_ADDR': ip})
+
+    assert [post('lancelot@camelot.com').status_code for _ in range(2)] == [302, 302]
+    # Email limit, however submitted:
+    response = post(' Lancelot@Camelot.com ', ip='192.0.2.2')
+    assert response.status_code == 429
+    # EMAIL_PER_HOUR of 5 is a token every 720 seconds.
+    assert response.headers['Retry-After'] == '720'
+
+    assert post('galahad@camelot.com').status_code == 302
+    assert post('robin@camelot.com').status_code == 429  # IP limit.
+    # Invalid submissions are limited too, without being validated:
+    assert post('not an email').status_code == 429
+    assert client.get('contact/', environ_base={'REMOTE_ADDR': '192.0.2.1'}).status_code == 200
+
+    # Rejected POSTs stored nothing:
+    assert len(app.config['DATABASE'].list_messages(limit=100)) == 3
+
+
+def test_rate_limited_log_omits_ip_and_email(tmpdir, caplog):
+    caplog.set_level(logging.INFO)
+    app = app_with_test_config(tmpdir, CONTACT_RATE_LIMIT_IP_BURST=1)
+    client = app.test_client()
+    for n in range(2):
+        response = client.post('contact/', data={'name': 'Sir Lancelot', 'email': 'lancelot@camelot.com',
+                                                 'message': f'Hello {n}.'},
+                               environ_base={'REMOTE_ADDR': '192.0.2.1'})
+    assert response.status_code == 429
+    assert '192.0.2.1' not in caplog.text
+    assert 'lancelot' not in caplog.text
+    assert f"ip={pseudonym('192.0.2.1', app.config['SECRET_KEY'])}" in caplog.text
+
+
+def test_pseudonym():
+    assert pseudonym('192.0.2.1', 'key') == pseudonym('192.0.2.1', b'key')
+    assert pseudonym('192.0.2.1', 'key') != pseudonym('192.0.2.2', 'key')
+    assert pseudonym('192.0.2.1', 'key') != pseudonym('192.0.2.1', 'other key')
+    assert len(pseudonym('192.0.2.1', 'key')) == 12
+
+
+def test_contact_rate_limit_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, CONTACT_RATE_LIMIT_ENABLED=False)
+    assert app.config['CONTACT_RATE_LIMITER'] is None
+    client = app.test_client()
+    for n in range(10):
+        assert client.post('contact/', data={'name': 'Sir Lancelot',
+                                             'email': 'lancelot@camelot.com',
+                                             'message': f'Hello {n}.'}).status_code == 302
+
+
+def test_rate_limit_unknown_backend(tmpdir):
+    with pytest.raises(ValueError):
+        app_with_test_config(tmpdir, CONTACT_RATE_LIMIT_BACKEND='carrier pigeon')
+
+
+@pytest.mark.parametrize('config', [{'CONTACT_RATE_LIMIT_IP_PER_HOUR': 0},
+                                    {'CONTACT_RATE_LIMIT_EMAIL_PER_HOUR': -1},
+                                    {'CONTACT_RATE_LIMIT_EMAIL_BURST': 0},
+                                    ])
+def test_rate_limit_invalid_limits(tmpdir, config):
+    """Rejected at startup, rather than dividing by zero handling a submission."""
+    with pytest.raises(ValueError):
+        app_with_test_config(tmpdir, **config)
+    # Unchecked if rate limiting is disabled:
+    app_with_test_config(tmpdir, CONTACT_RATE_LIMIT_ENABLED=False, **config)
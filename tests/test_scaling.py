@@ -0,0 +1,91 @@
+""" Test benchmarks/synthetic_data.py, and that person lookups and inserts scale with database size. """
+import pytest
+
+from benchmarks.synthetic_data import generate
+from toonarmycaptain_website.database import ContactDatabase
+from tests.test_database import empty_sqlite_test_db
+
+
+def test_generate(tmpdir):
+    test_db = empty_sqlite_test_db(tmpdir)
+    people = generate(test_db, people=1000, messages=2000)
+    assert people == range(1, 1001)
+
+    conn = test_db._connection()
+    assert conn.execute("""SELECT count(*) FROM person;""").fetchone() == (1000,)
+    assert conn.execute("""SELECT count(*), count(fingerprint), count(received_at) FROM message;""").fetchone() == (
+        2000, 2000, 2000)
+    assert conn.execute("""PRAGMA foreign_key_check;""").fetchall() == []
+    # Some people have aliases, some write repeatedly:
+    aliased, = conn.execute("""SELECT count(DISTINCT person_id) FROM person_alias;""").fetchone()
+    assert 50 < aliased < 200
+    most_messages, = conn.execute(
+        """SELECT count(*) FROM message GROUP BY person_id ORDER BY count(*) DESC LIMIT 1;""").fetchone()
+    assert most_messages > 10
+
+    # Grows from existing rows:
+    assert generate(test_db, people=10, messages=10) == range(1001, 1011)
+    assert conn.execute("""SELECT count(*) FROM message;""").fetchone() == (2010,)
+
+    # Indexed for search, and the index trigger restored:
+    assert test_db.search_messages('hello', limit=1)
+    message_id = test_db.store_contact('name', 'name@email.com', 'xylophone')
+    assert [row[0] for row in test_db.search_messages('xylophone')] == [message_id]
+
+
+def test_generate_deterministic(tmpdir):
+    rows = []
+    for n in range(2):
+        test_db = ContactDatabase(database_path=tmpdir / f'test_db{n}', message_max_length=1000)
+        generate(test_db, people=100, messages=100, seed=3)
+        rows.append(test_db._connection().execute(
+            """SELECT person.email, message.contents
+               FROM message
+               JOIN person ON person.id = message.person_id
+               ORDER BY message.id;""").fetchall())
+    assert rows[0] == rows[1]
+
+
+def vm_steps(test_db: ContactDatabase, operation) -> int:
+    """
+    SQLite virtual machine instructions executed by operation(connection),
+    whose writes are rolled back.
+
+    Unlike timings, deterministic: a B-tree seek is a few instructions
+    whatever the table's size, a scan one or more per row.
+    """
+    steps = 0
+
+    def count() -> int:
+        nonlocal steps
+        steps += 1
+        return 0
+
+    conn = test_db._connection()
+    conn.set_progress_handler(count, 1)
+    operation(conn)
+    conn.rollback()  # So each operation sees only the generated rows.
+    conn.close()
+    return steps
+
+
+PERSON_OPERATIONS = {
+    'get_person_from_email': lambda test_db, conn, email: test_db.get_person_from_email(conn, email),
+    'email lookup': lambda test_db, conn, email: conn.execute(
+        """SELECT id FROM person WHERE email=?;""", (email,)).fetchone(),
+    'upsert alias': lambda test_db, conn, email: test_db._upsert_person(conn, 'new name', email),
+    'upsert new person': lambda test_db, conn, email: test_db._upsert_person(conn, 'new name', 'new@email.com'),
+}
+
+
+def test_person_operations_do_not_scan(tmpdir):
+    """Person lookups/inserts do the same work with 100 or 50,000 people."""
+    steps: dict[str, list[int]] = {name: [] for name in PERSON_OPERATIONS}
+    for people in (100, 50_000):
+        test_db = empty_sqlite_test_db(tmpdir)
+        generate(test_db, people=people, messages=0)
+        email = test_db._connection().execute("""SELECT email FROM person WHERE id=50;""").fetchone()[0]
+        for name, operation in PERSON_OPERATIONS.items():
+            steps[name].append(vm_steps(test_db, lambda conn: operation(test_db, conn, email)))
+    assert {name: small for name, (small, large) in steps.items()} == {
+        name: large for name, (small, large) in steps.items()}
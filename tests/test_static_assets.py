@@ -0,0 +1,64 @@
+""" Test static_assets.py """
+import hashlib
+import re
+
+from pathlib import Path
+
+from toonarmycaptain_website import static_assets
+from tests.test_app_fixture import app_with_test_config
+
+
+def test_build_manifest(tmpdir):
+    Path(tmpdir, 'icons').mkdir()
+    Path(tmpdir, 'icons', 'icon.svg').write_bytes(b'<svg></svg>')
+    Path(tmpdir, 'style.css').write_bytes(b'body {}')
+    Path(tmpdir, 'style.css.gz').write_bytes(b'compressed')
+
+    assert static_assets.build_manifest(Path(tmpdir)) == {
+        'icons/icon.svg': hashlib.sha256(b'<svg></svg>').hexdigest()[:static_assets.FINGERPRINT_LENGTH],
+        'style.css': hashlib.sha256(b'body {}').hexdigest()[:static_assets.FINGERPRINT_LENGTH],
+    }
+
+
+def test_manifest_covers_static_folder(test_app):
+    manifest = test_app.config['STATIC_MANIFEST']
+    assert manifest['style.css'] == hashlib.sha256(
+        Path(test_app.static_folder, 'style.css').read_bytes()).hexdigest()[:static_assets.FINGERPRINT_LENGTH]
+    assert len(manifest) == len([path for path in Path(test_app.static_folder).rglob('*')
+                                 if path.is_file() and path.suffix not in static_assets.PRECOMPRESSED_SUFFIXES])
+
+
+def test_pages_use_fingerprinted_urls(test_app, test_client):
+    page = test_client.get('home/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    static_urls = re.findall(r'"(/static/[^"]*)"', page)
+
+    assert '/static/style.css?v=' + test_app.config['STATIC_MANIFEST']['style.css'] in static_urls
+    assert all('?v=' in url for url in static_urls)
+
+
+def test_fingerprinted_url_immutable(test_app, test_client):
+    fingerprint = test_app.config['STATIC_MANIFEST']['avatar_full.jpg']
+    response = test_client.get(f'/static/avatar_full.jpg?v={fingerprint}')
+
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == test_app.config['STATIC_IMMUTABLE_MAX_AGE']
+    assert not response.cache_control.no_cache
+    response.close()
+
+
+def test_unfingerprinted_url_not_immutable(test_client):
+    """Requests with stale or no fingerprint must revalidate."""
+    for url in ['/static/avatar_full.jpg', '/static/avatar_full.jpg?v=stale']:
+        response = test_client.get(url)
+        assert response.status_code == 200
+        assert not response.cache_control.immutable
+        response.close()
+
+
+def test_fingerprinting_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, STATIC_FINGERPRINT_ENABLED=False)
+    page = app.test_client().get('home/', headers={'Accept-Encoding': 'identity'}).data.decode()
+    assert '/static/style.css"' in page
+    assert '?v=' not in page
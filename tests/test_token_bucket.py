@@ -0,0 +1,20 @@
+""" Test token_bucket.py """
+import pytest
+
+from toonarmycaptain_website.token_bucket import full_at, refill_tokens, wait_for_token
+
+
+def test_refill_tokens():
+    assert refill_tokens(0, updated_at=100, now=110, capacity=5, rate=0.2) == pytest.approx(2)
+    assert refill_tokens(4, updated_at=100, now=200, capacity=5, rate=0.2) == 5  # Capped at capacity.
+    assert refill_tokens(1, updated_at=100, now=90, capacity=5, rate=0.2) == 1  # Clock went backwards.
+
+
+def test_wait_for_token():
+    assert wait_for_token(1.5, capacity=5, rate=0.2) == 0
+    assert wait_for_token(0.5, capacity=5, rate=0.2) == pytest.approx(2.5)
+
+
+def test_full_at():
+    assert full_at(3, now=100, capacity=5, rate=0.2) == pytest.approx(110)
+    assert full_at(5, now=100, capacity=5, rate=0.2) == 100
@@ -0,0 +1,63 @@
+""" Test warm_up.py """
+import sys
+
+from pathlib import Path
+
+from toonarmycaptain_website import main_site
+from toonarmycaptain_website.warm_up import warm_up, warm_up_modules
+from tests.test_app_fixture import app_with_test_config
+
+
+def test_warm_up(test_app, test_client, monkeypatch):
+    timings = warm_up(test_app)
+    assert set(timings) == {'import modules', 'compile templates', 'render pages'}
+    assert 'toonarmycaptain_website.contact.form' in sys.modules
+
+    def render_template(*args, **kwargs):
+        raise AssertionError('Page should be served from PageCache.')
+
+    monkeypatch.setattr(main_site, 'render_template', render_template)
+    for path in ['home/', 'projects/', 'about/']:
+        assert test_client.get(path).status_code == 200
+    # Early hints known for warmed pages:
+    assert {'my_site.home', 'my_site.projects', 'my_site.about'} <= set(
+        test_app.extensions['early_hints'])
+
+
+def test_warm_up_modules(test_app):
+    assert warm_up_modules(test_app) == ['toonarmycaptain_website.contact.form']
+    test_app.config['NOTIFICATION_WORKER'] = 'thread'
+    assert 'toonarmycaptain_website.contact.email_notification' in warm_up_modules(test_app)
+
+
+def test_warm_up_on_startup(tmpdir):
+    app = app_with_test_config(tmpdir, WARM_UP_ON_STARTUP=True)
+    assert 'my_site.home' in app.extensions['early_hints']
+
+
+def test_bytecode_cache(tmpdir):
+    cache_dir = Path(tmpdir, 'jinja')
+    app = app_with_test_config(tmpdir, TEMPLATE_BYTECODE_CACHE_DIR=str(cache_dir))
+    assert app.test_client().get('home/').status_code == 200
+    cached = set(cache_dir.iterdir())
+    assert cached  # base.html, home.html, _picture_macro.html
+
+    # Another worker loads compiled templates from the cache:
+    app = app_with_test_config(tmpdir, TEMPLATE_BYTECODE_CACHE_DIR=str(cache_dir))
+    loaded = []
+    bytecode_cache = app.jinja_env.bytecode_cache
+    load_bytecode = bytecode_cache.load_bytecode
+
+    def recording_load_bytecode(bucket):
+        load_bytecode(bucket)
+        loaded.append(bucket.code is not None)
+
+    bytecode_cache.load_bytecode = recording_load_bytecode
+    assert app.test_client().get('home/').status_code == 200
+    assert loaded and all(loaded)
+    assert set(cache_dir.iterdir()) == cached
+
+
+def test_bytecode_cache_disabled(tmpdir):
+    app = app_with_test_config(tmpdir, TEMPLATE_BYTECODE_CACHE_ENABLED=False)
+    assert app.jinja_env.bytecode_cache is None
@@ -1,9 +1,24 @@
 """ App factory """
+import weakref
+
+from pathlib import Path
 
 from flask import Flask
 from flask_wtf.csrf import CSRFProtect
-
+from jinja2 import FileSystemBytecodeCache
+
+from . import compression, critical_css, early_hints, images, inbox, metrics, rate_limit, static_assets
+from .contact.dedupe import RecentFingerprints
+from .contact.dispatch import (NotificationDispatcher,
+                               dispatch_notifications_command,
+                               retry_unsent_emails_command,
+                               )
+from .contact.sms_notification import RecipientRateLimiter, sms_transport_from_config
 from .database import ContactDatabase
+from .export import export_static_command
+from .migrations import migrate_database_command
+from .page_cache import PageCache
+from .warm_up import warm_up
 
 ABOUT_TEXT_STRING = (
     b'<html>'
@@ -36,16 +51,84 @@ def create_app(test_config: dict|None = None) -> Flask:
     else:  # Load testing config:
         app.config.update(test_config)
 
+    # Share compiled templates between workers and restarts.
+    # Before anything uses app.jinja_env, which is created with jinja_options.
+    if app.config['TEMPLATE_BYTECODE_CACHE_ENABLED']:
+        if bytecode_cache_dir := app.config['TEMPLATE_BYTECODE_CACHE_DIR']:
+            Path(bytecode_cache_dir).mkdir(parents=True, exist_ok=True)
+        app.jinja_options = {**app.jinja_options,
+                             'bytecode_cache': FileSystemBytecodeCache(bytecode_cache_dir)}
+
     csrf = CSRFProtect(app)
 
     # CONTACT_MESSAGE_MAX_LENGTH: int = app.config['CONTACT_MESSAGE_MAX_LENGTH']
 
     # Instantiate/connect to db:
     app.config['DATABASE'] = ContactDatabase(database_path=app.config["CONTACT_DATABASE_PATH"],
-                                             message_max_length=app.config['CONTACT_MESSAGE_MAX_LENGTH'])
+                                             message_max_length=app.config['CONTACT_MESSAGE_MAX_LENGTH'],
+                                             pool_size=app.config['CONTACT_DATABASE_POOL_SIZE'],
+                                             pool_max_idle_seconds=app.config['CONTACT_DATABASE_POOL_MAX_IDLE'],
+                                             durability_profile={
+                                                 'journal_mode': app.config['CONTACT_DATABASE_JOURNAL_MODE'],
+                                                 'synchronous': app.config['CONTACT_DATABASE_SYNCHRONOUS'],
+                                                 'busy_timeout': app.config['CONTACT_DATABASE_BUSY_TIMEOUT'],
+                                                 'cache_size': app.config['CONTACT_DATABASE_CACHE_SIZE'],
+                                                 'mmap_size': app.config['CONTACT_DATABASE_MMAP_SIZE'],
+                                             },
+                                             migrate_on_init=app.config['CONTACT_DATABASE_MIGRATE_ON_STARTUP'])
+    # Close pooled connections cleanly when the worker process exits, or the app is garbage
+    # collected. Unlike atexit.register, the finalizer holds no reference to the app.
+    weakref.finalize(app, app.config['DATABASE'].close)
+    app.cli.add_command(migrate_database_command)
+
+    # Send contact notifications queued by the contact route:
+    app.config['NOTIFICATION_DISPATCHER'] = NotificationDispatcher(
+        app,
+        poll_interval=app.config['NOTIFICATION_POLL_INTERVAL'],
+        batch_size=app.config['NOTIFICATION_BATCH_SIZE'],
+        claim_lease=app.config['NOTIFICATION_CLAIM_LEASE'],
+        max_attempts=app.config['NOTIFICATION_MAX_ATTEMPTS'],
+        retry_base_delay=app.config['NOTIFICATION_RETRY_BASE_DELAY'],
+        retry_max_delay=app.config['NOTIFICATION_RETRY_MAX_DELAY'],
+        digest_window=app.config['NOTIFICATION_DIGEST_WINDOW'],
+        digest_max_messages=app.config['NOTIFICATION_DIGEST_MAX_MESSAGES'],
+        sms_transport=(sms_transport_from_config(app)
+                       if app.config['SMS_NOTIFICATIONS_ENABLED'] else None),
+        sms_rate_limiter=RecipientRateLimiter(max_messages=app.config['SMS_RATE_LIMIT_COUNT'],
+                                              period=app.config['SMS_RATE_LIMIT_PERIOD']))
+    app.cli.add_command(dispatch_notifications_command)
+    app.cli.add_command(retry_unsent_emails_command)
+
+    # Fingerprints of recent contact messages, to skip resubmissions. None if disabled:
+    app.config['CONTACT_RECENT_FINGERPRINTS'] = (
+        RecentFingerprints(window=app.config['CONTACT_DEDUPE_WINDOW'],
+                           max_size=app.config['CONTACT_DEDUPE_CACHE_SIZE'])
+        if app.config['CONTACT_DEDUPE_ENABLED'] else None)
+
+    # Token buckets limiting contact form submissions, None if disabled:
+    rate_limit.init_app(app)
+
+    # Cache of rendered static-content pages, None if disabled:
+    app.config['PAGE_CACHE'] = (PageCache(max_age=app.config['PAGE_CACHE_MAX_AGE'])
+                                if app.config['PAGE_CACHE_ENABLED'] else None)
+
+    # Request/stage timings, Server-Timing headers, /metrics. First, so times the other hooks:
+    metrics.init_app(app)
+    # Precompressed static files, compressed HTML:
+    compression.init_app(app)
+    # Link preload headers/103 Early Hints from pages' preloads, so runs after critical_css:
+    early_hints.init_app(app)
+    # Inline critical CSS, preload page's images. After compression, so runs before it:
+    critical_css.init_app(app)
+    # WebP/AVIF variants of images, for the picture template macro:
+    images.init_app(app)
+    # Content-hashed static file URLs:
+    static_assets.init_app(app)
 
     from toonarmycaptain_website import main_site
     app.register_blueprint(main_site.bp)
+    # Token-authenticated message API, if INBOX_API_TOKEN set:
+    inbox.init_app(app)
 
     @app.context_processor
     def blog_url() -> dict:
@@ -60,4 +143,16 @@ def create_app(test_config: dict|None = None) -> Flask:
         """
         return ABOUT_TEXT_STRING
 
+    # Export GET pages as a static site: flask --app toonarmycaptain_website export-static OUTPUT_DIR
+    app.cli.add_command(export_static_command)
+
+    if app.config['WARM_UP_ON_STARTUP']:
+        warm_up(app)
+
+    # Start the dispatcher thread in the process serving requests, not here: a pre-fork
+    # server's workers would not inherit it, and CLI commands should not run it. After
+    # warm_up, so warming up a server's master process starts no thread either.
+    if app.config['NOTIFICATION_WORKER'] == 'thread':
+        app.before_request(app.config['NOTIFICATION_DISPATCHER'].start)
+
     return app
@@ -0,0 +1,22 @@
+""" Bearer token authentication, for endpoints read by scripts rather than visitors. """
+import hmac
+
+from flask import (abort,
+                   request,
+                   Response,
+                   )
+
+
+def require_bearer_token(expected_token: str) -> None:
+    """
+    Reject request without `Authorization: Bearer <expected_token>`.
+
+    Tokens are compared in constant time.
+
+    :param expected_token: str
+    :return: None
+    """
+    authorization = request.authorization
+    token = authorization.token if authorization and authorization.type == 'bearer' else None
+    if not token or not hmac.compare_digest(token.encode(), expected_token.encode()):
+        abort(Response('Authentication required.', 401, {'WWW-Authenticate': 'Bearer'}))
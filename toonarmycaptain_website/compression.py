@@ -0,0 +1,199 @@
+""" Compressed static file and HTML responses. """
+import functools
+import gzip
+import mimetypes
+
+from pathlib import Path
+
+import click
+
+from flask import (current_app,
+                   Flask,
+                   g,
+                   request,
+                   Response,
+                   send_from_directory,
+                   )
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, serve gzip only.
+    brotli = None
+
+# Content-Encodings in order of preference, with precompressed file suffixes.
+ENCODING_SUFFIXES: dict[str, str] = {'br': '.br', 'gzip': '.gz'} if brotli else {'gzip': '.gz'}
+
+# Static files worth compressing. Images other than SVG are already compressed.
+COMPRESSIBLE_SUFFIXES: set[str] = {'.css', '.html', '.ico', '.js', '.json', '.svg', '.txt', '.xml'}
+
+
+def compress(data: bytes, encoding: str, fast: bool = False) -> bytes:
+    """
+    Compress data with Content-Encoding.
+
+    :param data: bytes
+    :param encoding: str 'br' or 'gzip'
+    :param fast: bool - trade compression ratio for speed, for on-the-fly compression.
+    :return: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if fast else 11)
+    # mtime=0 so precompressed files are reproducible.
+    return gzip.compress(data, compresslevel=6 if fast else 9, mtime=0)
+
+
+def precompress_static(static_folder: Path, min_size: int = 0) -> list[tuple[Path, int, dict[str, int]]]:
+    """
+    Write compressed siblings of compressible static files, eg style.css.gz.
+
+    Siblings are only written where smaller than the original, and stale
+    siblings of files no longer worth compressing are removed.
+
+    :param static_folder: Path
+    :param min_size: int bytes - smaller files are not compressed.
+    :return: list of (file path, original size, {encoding: compressed size})
+    """
+    report = []
+    for path in sorted(static_folder.rglob('*')):
+        if not path.is_file() or path.suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+            continue
+        data = path.read_bytes()
+        sizes = {}
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            compressed_path = path.with_name(path.name + suffix)
+            compressed = compress(data, encoding)
+            if len(data) >= min_size and len(compressed) < len(data):
+                compressed_path.write_bytes(compressed)
+                sizes[encoding] = len(compressed)
+            else:
+                compressed_path.unlink(missing_ok=True)
+        report.append((path, len(data), sizes))
+    return report
+
+
+def accepted_encoding(available: set[str]) -> str | None:
+    """
+    Preferred Content-Encoding accepted by the current request.
+
+    :param available: set of available encodings.
+    :return: str encoding, or None to send uncompressed.
+    """
+    for encoding in ENCODING_SUFFIXES:
+        if encoding in available and request.accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def send_static_file(filename: str) -> Response:
+    """
+    Serve static file, using a precompressed sibling the client accepts if present.
+
+    Replaces Flask's static view.
+
+    :param filename: str
+    :return: Response
+    """
+    static_folder = Path(current_app.static_folder or '')
+    if Path(filename).suffix.lower() not in COMPRESSIBLE_SUFFIXES:
+        return current_app.send_static_file(filename)
+
+    available = {encoding for encoding, suffix in ENCODING_SUFFIXES.items()
+                 if Path(static_folder, filename + suffix).is_file()}
+    if (encoding := accepted_encoding(available)) is None:
+        response = current_app.send_static_file(filename)
+    else:
+        mimetype, _ = mimetypes.guess_type(filename)
+        response = send_from_directory(static_folder,
+                                       filename + ENCODING_SUFFIXES[encoding],
+                                       mimetype=mimetype,
+                                       max_age=current_app.get_send_file_max_age(filename))
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def is_plain_html(response: Response) -> bool:
+    """
+    Whether response is a buffered, uncompressed 200 HTML page, which
+    after_request functions may read and rewrite.
+
+    :param response: Response
+    :return: bool
+    """
+    return (response.mimetype == 'text/html'
+            and response.status_code == 200
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and not response.content_encoding)
+
+
+@functools.lru_cache(maxsize=64)
+def _compress_cached(data: bytes, encoding: str) -> bytes:
+    """
+    Compress rendered page, caching result, as pages are served from PageCache.
+
+    :param data: bytes
+    :param encoding: str
+    :return: bytes
+    """
+    return compress(data, encoding, fast=True)
+
+
+def compress_response(response: Response) -> Response:
+    """
+    Compress static-content pages, see page_cache.cached_page, the client
+    accepts compressed.
+
+    Other pages, eg the contact page, are not compressed: compressing a
+    page carrying a secret (its CSRF token) alongside reflected input
+    leaks the secret through the compressed size (BREACH), and their
+    ever-changing bodies would churn _compress_cached.
+
+    Registered as an after_request function. An ETag is suffixed with the
+    encoding, as each encoding is a different representation, and
+    If-None-Match re-checked against it.
+
+    :param response: Response
+    :return: Response
+    """
+    if not is_plain_html(response) or not g.get('cached_page'):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if (len(data) < current_app.config['COMPRESSION_MIN_SIZE']
+            or (encoding := accepted_encoding(set(ENCODING_SUFFIXES))) is None):
+        return response
+
+    response.set_data(_compress_cached(data, encoding))
+    response.content_encoding = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=bool(weak))
+        response.make_conditional(request)
+    return response
+
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command() -> None:
+    """Precompress static files, writing .gz (and .br if Brotli installed) siblings."""
+    report = precompress_static(Path(current_app.static_folder or ''),
+                                min_size=current_app.config['COMPRESSION_MIN_SIZE'])
+    for path, size, compressed_sizes in report:
+        sizes = ', '.join(f'{encoding} {compressed_size}' for encoding, compressed_size in compressed_sizes.items())
+        click.echo(f'{path.name}: {size} bytes -> {sizes or "not compressed"}')
+
+
+def init_app(app: Flask) -> None:
+    """
+    Serve precompressed static files and compress HTML responses.
+
+    :param app: Flask
+    :return: None
+    """
+    app.cli.add_command(compress_static_command)
+    if app.config['COMPRESSION_ENABLED']:
+        app.view_functions['static'] = send_static_file
+        app.after_request(compress_response)
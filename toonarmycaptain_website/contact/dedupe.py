@@ -0,0 +1,77 @@
+""" Detect repeated contact submissions by a fingerprint of their content. """
+import hashlib
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Callable
+
+
+def message_fingerprint(email: str, message: str) -> bytes:
+    """
+    Hash of a submission's email and message, normalised so resubmissions match.
+
+    Email is lower-cased; the message case-folded, with runs of whitespace
+    collapsed to single spaces.
+
+    :param email: str
+    :param message: str
+    :return: bytes 16 byte digest.
+    """
+    normalised = '\0'.join((email.strip().lower(), ' '.join(message.split()).casefold()))
+    return hashlib.sha256(normalised.encode()).digest()[:16]
+
+
+class RecentFingerprints:
+    """
+    Least recently used fingerprints received in the last window seconds.
+
+    Catches repeats handled by this worker process without a database
+    read; ContactDatabase.store_contact checks the message table's
+    fingerprint index for those handled by other workers.
+
+    Thread-safe.
+    """
+
+    def __init__(self, window: float, max_size: int, clock: Callable[[], float] = time.time):
+        """
+        :param window: float seconds a fingerprint is a duplicate for.
+        :param max_size: int fingerprints held.
+        :param clock: Callable returning unix timestamp, as stored in message.received_at.
+        """
+        self.window: float = window
+        self.max_size: int = max_size
+        self.clock: Callable[[], float] = clock
+        # fingerprint: received_at, least recently used first.
+        self._received: OrderedDict[bytes, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, fingerprint: bytes) -> bool:
+        """
+        Whether fingerprint was added in the last window seconds.
+
+        :param fingerprint: bytes
+        :return: bool
+        """
+        with self._lock:
+            received_at = self._received.get(fingerprint)
+            if received_at is None:
+                return False
+            if received_at < self.clock() - self.window:
+                del self._received[fingerprint]
+                return False
+            self._received.move_to_end(fingerprint)
+            return True
+
+    def add(self, fingerprint: bytes) -> None:
+        """
+        Record fingerprint as received now, evicting the least recently used.
+
+        :param fingerprint: bytes
+        :return: None
+        """
+        with self._lock:
+            self._received[fingerprint] = self.clock()
+            self._received.move_to_end(fingerprint)
+            while len(self._received) > self.max_size:
+                self._received.popitem(last=False)
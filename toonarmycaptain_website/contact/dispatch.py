@@ -0,0 +1,439 @@
+""" Dispatch queued contact notifications off the request path. """
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import click
+
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+
+from .sms_notification import RecipientRateLimiter, SMSTransport, compose_notification_sms
+from ..metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Seconds the process waits at exit for a background thread to finish sending.
+EXIT_STOP_TIMEOUT: float = 5
+
+
+def retry_delay(attempts: int, base_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with jitter, in seconds.
+
+    Delay doubles with each failed attempt up to max_delay, then is
+    randomised over its upper half, so retries of messages that failed
+    together (eg during a Gmail outage) are spread out.
+
+    :param attempts: int - failed attempts so far, >= 1.
+    :param base_delay: float - delay after first failure.
+    :param max_delay: float
+    :return: float
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _stop_thread(stop: threading.Event, wake: threading.Event, thread: threading.Thread | None,
+                 timeout: float | None) -> None:
+    """
+    Stop a dispatcher's background thread, given its events rather than
+    the dispatcher, so a finalizer can hold them without keeping it alive.
+
+    :param stop: threading.Event
+    :param wake: threading.Event
+    :param thread: threading.Thread or None if not started.
+    :param timeout: float seconds to wait for thread to finish.
+    :return: None
+    """
+    stop.set()
+    wake.set()
+    if thread is not None:
+        thread.join(timeout)
+
+
+class NotificationDispatcher:
+    """
+    Drain notification outbox in ContactDatabase, sending notifications.
+
+    The contact route only queues notifications, in the same transaction as
+    storing the message, so a POST costs a local database write. Queued
+    notifications are sent either by a background thread in each web
+    worker, or by a separate process running the dispatch-notifications
+    command.
+
+    The background thread is started lazily, by start() or notify(), in
+    the process that will use it. Threads are not copied into a forked
+    process, and locks another thread held at the fork stay held, so a
+    dispatcher used in a process forked from the one that created it
+    replaces its thread and synchronisation primitives.
+
+    In digest mode (digest_window > 0) queued emails are held until the
+    oldest has waited digest_window seconds, or digest_max_messages are
+    queued, then sent together as one email.
+
+    Queued SMS notifications are sent to CONTACT_CELL_NUMBER via
+    sms_transport, subject to sms_rate_limiter. SMS are best effort: email
+    is the durable notification, so rate limited or failed SMS are dropped.
+    """
+
+    def __init__(self,
+                 app: Flask,
+                 poll_interval: float = 30,
+                 batch_size: int = 20,
+                 claim_lease: float = 300,
+                 max_attempts: int = 10,
+                 retry_base_delay: float = 60,
+                 retry_max_delay: float = 6 * 60 * 60,
+                 digest_window: float = 0,
+                 digest_max_messages: int = 20,
+                 sms_transport: SMSTransport | None = None,
+                 sms_rate_limiter: RecipientRateLimiter | None = None,
+                 ):
+        """
+        :param app: Flask
+        :param poll_interval: float - seconds between outbox and retry scans
+                              when not notified.
+        :param batch_size: int - notifications claimed per scan.
+        :param claim_lease: float - seconds before an unfinished claim expires.
+        :param max_attempts: int - attempts to send an email before giving up.
+        :param retry_base_delay: float - seconds before first retry.
+        :param retry_max_delay: float - maximum seconds between retries.
+        :param digest_window: float - seconds to collect emails into a
+                              digest, 0 sends each email immediately.
+        :param digest_max_messages: int - send digest early once this many
+                                    emails are queued, max per digest.
+        :param sms_transport: SMSTransport, or None if SMS disabled.
+        :param sms_rate_limiter: RecipientRateLimiter, or None for no limit.
+        """
+        self.app: Flask = app
+        self.poll_interval: float = poll_interval
+        self.batch_size: int = batch_size
+        self.claim_lease: float = claim_lease
+        self.max_attempts: int = max_attempts
+        self.retry_base_delay: float = retry_base_delay
+        self.retry_max_delay: float = retry_max_delay
+        self.digest_window: float = digest_window
+        self.digest_max_messages: int = digest_max_messages
+        self.sms_transport: SMSTransport | None = sms_transport
+        self.sms_rate_limiter: RecipientRateLimiter | None = sms_rate_limiter
+
+        self._pid: int = os.getpid()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        # Stops the thread at exit, see start.
+        self._exit_finalizer: weakref.finalize | None = None
+
+    def _after_fork(self) -> None:
+        """
+        Reset thread state inherited from parent, if in a forked process.
+
+        The parent's thread did not survive the fork, and may have held
+        _lock, or an Event's lock, when the process forked. Its exit
+        finalizer is detached, so exiting does not wait on those locks.
+
+        :return: None
+        """
+        if self._pid == os.getpid():
+            return
+        if self._exit_finalizer is not None:
+            self._exit_finalizer.detach()
+            self._exit_finalizer = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def _claim_limit(self) -> int:
+        """Emails claimed at once, all sent in one digest in digest mode."""
+        return self.digest_max_messages if self.digest_window else self.batch_size
+
+    def dispatch_pending(self) -> int:
+        """
+        Send queued notifications until the outbox is empty, or in digest
+        mode, until no digest is due.
+
+        Failed sends are recorded for retry by retry_due.
+
+        :return: int number of notifications dispatched.
+        """
+        database = self.app.config['DATABASE']
+        dispatched = 0
+        while self._digest_due() and (notifications := database.claim_notifications(
+                'email', limit=self._claim_limit, lease_seconds=self.claim_lease)):
+            self._send_emails([email for _, *email in notifications])
+            database.complete_notifications([outbox_id for outbox_id, *_ in notifications])
+            dispatched += len(notifications)
+        return dispatched + self._dispatch_sms()
+
+    def _dispatch_sms(self) -> int:
+        """
+        Send queued SMS notifications until none are left.
+
+        :return: int number of SMS notifications dispatched.
+        """
+        database = self.app.config['DATABASE']
+        dispatched = 0
+        while notifications := database.claim_notifications('sms',
+                                                            limit=self.batch_size,
+                                                            lease_seconds=self.claim_lease):
+            for outbox_id, message_id, contact_email, contact_name, message_body, _ in notifications:
+                self._send_sms(message_id, contact_email, contact_name, message_body)
+                database.complete_notification(outbox_id)
+                dispatched += 1
+        return dispatched
+
+    def _send_sms(self, message_id: int, contact_email: str, contact_name: str, message_body: str) -> bool:
+        """
+        Send notification SMS if SMS enabled and not rate limited.
+
+        :param message_id: int
+        :param contact_email: str
+        :param contact_name: str
+        :param message_body: str
+        :return: bool True if sent.
+        """
+        recipient = self.app.config['CONTACT_CELL_NUMBER']
+        if self.sms_transport is None:
+            logger.warning('SMS notification for message %s dropped, SMS disabled.', message_id)
+            return False
+        if self.sms_rate_limiter is not None and not self.sms_rate_limiter.acquire(recipient):
+            logger.warning('SMS notification for message %s dropped, rate limit reached.', message_id)
+            return False
+        try:
+            with span(self.app, 'notification_sms'):
+                self.sms_transport.send(recipient,
+                                        compose_notification_sms(contact_email, contact_name, message_body))
+        except Exception:
+            logger.exception('Failed to send SMS notification for message %s.', message_id)
+            return False
+        self.app.config['DATABASE'].sms_sent(message_id)
+        return True
+
+    def _digest_due(self) -> bool:
+        """
+        Whether queued emails should be sent now.
+
+        Always, unless in digest mode, where a digest is due when the
+        oldest queued email has waited digest_window seconds, or
+        digest_max_messages emails are queued.
+
+        :return: bool
+        """
+        if not self.digest_window:
+            return True
+        queued, oldest_queued_at = self.app.config['DATABASE'].outbox_status(
+            'email', lease_seconds=self.claim_lease)
+        return bool(queued) and (queued >= self.digest_max_messages
+                                 or oldest_queued_at <= time.time() - self.digest_window)
+
+    def retry_due(self) -> int:
+        """
+        Retry notification emails that previously failed, and are due a retry.
+
+        :return: int number of emails retried.
+        """
+        database = self.app.config['DATABASE']
+        retried = 0
+        while due := database.claim_email_retries(limit=self._claim_limit,
+                                                  lease_seconds=self.claim_lease):
+            self._send_emails(due)
+            retried += len(due)
+        return retried
+
+    def _send_emails(self, emails: list) -> None:
+        """
+        Send notification emails, as one digest in digest mode.
+
+        :param emails: list of (message_id, contact_email, contact_name, message_body, attempts)
+        :return: None
+        """
+        if self.digest_window and len(emails) > 1:
+            self._send_digest(emails)
+        else:
+            for email in emails:
+                self._send_email(*email)
+
+    def _send_email(self,
+                    message_id: int,
+                    contact_email: str, contact_name: str, message_body: str,
+                    attempts: int) -> bool:
+        """
+        Send notification email, recording success, or failure and next retry.
+
+        :param message_id: int
+        :param contact_email: str
+        :param contact_name: str
+        :param message_body: str
+        :param attempts: int - previous failed attempts.
+        :return: bool True if sent.
+        """
+        # Imported here to keep ezgmail/Google API client imports off the request path.
+        from toonarmycaptain_website.contact.email_notification import deliver_contact_email
+
+        try:
+            with span(self.app, 'notification_email'):
+                deliver_contact_email(self.app, contact_email, contact_name, message_body)
+        except Exception as error:
+            self._email_failed(message_id, attempts, error)
+            return False
+        self.app.config['DATABASE'].email_sent(message_id)
+        return True
+
+    def _send_digest(self, emails: list) -> bool:
+        """
+        Send notification emails as one digest email, recording success,
+        or failure and next retry for each message.
+
+        :param emails: list of (message_id, contact_email, contact_name, message_body, attempts)
+        :return: bool True if sent.
+        """
+        from toonarmycaptain_website.contact.email_notification import deliver_digest_email
+
+        try:
+            with span(self.app, 'notification_email'):
+                deliver_digest_email(self.app, [(contact_email, contact_name, message_body)
+                                                for _, contact_email, contact_name, message_body, _ in emails])
+        except Exception as error:
+            for message_id, *_, attempts in emails:
+                self._email_failed(message_id, attempts, error)
+            return False
+        self.app.config['DATABASE'].emails_sent([message_id for message_id, *_ in emails])
+        return True
+
+    def _email_failed(self, message_id: int, attempts: int, error: Exception) -> None:
+        """
+        Record failed attempt to email message, scheduling retry with backoff.
+
+        :param message_id: int
+        :param attempts: int - previous failed attempts.
+        :param error: Exception
+        :return: None
+        """
+        attempts += 1
+        retry_at = None
+        if attempts < self.max_attempts:
+            retry_at = time.time() + retry_delay(attempts, self.retry_base_delay, self.retry_max_delay)
+        logger.warning('Attempt %s to send notification email for message %s failed: %r%s',
+                       attempts, message_id, error,
+                       '' if retry_at else ', giving up.')
+        self.app.config['DATABASE'].email_failed(message_id, error=repr(error), retry_at=retry_at)
+
+    def notify(self) -> None:
+        """
+        Wake dispatcher to send newly queued notifications.
+
+        Starts the background thread if it is not running in this process,
+        eg in a worker forked after the app was created.
+
+        :return: None
+        """
+        self._after_fork()
+        if self.app.config['NOTIFICATION_WORKER'] == 'thread':
+            self.start()
+        self._wake.set()
+
+    def start(self) -> None:
+        """
+        Start background dispatch thread, if not already running in this process.
+
+        Called before every request in thread mode, so returns without
+        taking the lock once the thread is running.
+
+        :return: None
+        """
+        if self._running():
+            return
+        self._after_fork()
+        with self._lock:
+            if self._running():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run,
+                                            name='notification-dispatcher',
+                                            daemon=True)
+            self._thread.start()
+            # Stop the thread cleanly at exit, before the app's DATABASE is closed, as finalizers
+            # run newest first. Unlike atexit.register, holds no reference to the dispatcher or app.
+            if self._exit_finalizer is not None:
+                self._exit_finalizer.detach()
+            self._exit_finalizer = weakref.finalize(self, _stop_thread, self._stop, self._wake, self._thread,
+                                                    EXIT_STOP_TIMEOUT)
+
+    def _running(self) -> bool:
+        """
+        Whether this process's background thread is running, without locking.
+
+        :return: bool
+        """
+        thread = self._thread
+        return self._pid == os.getpid() and thread is not None and thread.is_alive()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """
+        Stop background dispatch thread.
+
+        :param timeout: float seconds to wait for thread to finish.
+        :return: None
+        """
+        self._after_fork()
+        _stop_thread(self._stop, self._wake, self._thread, timeout)
+
+    def run(self) -> None:
+        """
+        Dispatch notifications until stopped.
+
+        Scans the outbox when notified of new notifications, and every
+        poll_interval seconds for any queued by other processes, and for
+        failed emails due a retry.
+
+        :return: None
+        """
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.dispatch_pending()
+                    self.retry_due()
+            except Exception:  # Keep dispatching, unsent notifications remain queued.
+                self.app.logger.exception('Error dispatching notifications.')
+            # Check back in time to send a digest started by a notification.
+            self._wake.wait(min(self.poll_interval, self.digest_window or self.poll_interval))
+
+
+@click.command('dispatch-notifications')
+@with_appcontext
+def dispatch_notifications_command() -> None:
+    """
+    Send queued contact notifications until interrupted.
+
+    Runs in the foreground only: create_app starts no dispatcher thread,
+    so this is the only dispatch loop in the process.
+    """
+    dispatcher: NotificationDispatcher = current_app.config['NOTIFICATION_DISPATCHER']
+    click.echo('Dispatching notifications, Ctrl+C to stop.')
+    try:
+        dispatcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command('retry-unsent-emails')
+@click.option('--spread', type=float, default=None,
+              help='Seconds to spread retries over.  [default: NOTIFICATION_RETRY_MAX_DELAY]')
+@click.option('--min-message-id', type=int, default=0, show_default=True,
+              help='Only retry messages from this id, eg to skip old messages.')
+@with_appcontext
+def retry_unsent_emails_command(spread: float | None, min_message_id: int) -> None:
+    """Schedule notification emails never sent, or given up on, to be retried."""
+    scheduled = current_app.config['DATABASE'].schedule_email_retries(
+        spread=current_app.config['NOTIFICATION_RETRY_MAX_DELAY'] if spread is None else spread,
+        min_message_id=min_message_id)
+    click.echo(f'Scheduled {scheduled} notification emails for retry.')
@@ -1,15 +1,46 @@
 """ Send notification via email."""
-from typing import Tuple
+from typing import Sequence, Tuple
 import ezgmail
 
 from flask import Flask
 
 
-def send_contact_email(app: Flask,
-                       message_id: int,
-                       contact_email: str, contact_name: str, message_body: str) -> None:
+def deliver_contact_email(app: Flask,
+                          contact_email: str, contact_name: str, message_body: str) -> None:
     """
-    Forward contact via email, from server address to contact address.
+    Send notification email, raising any error.
+
+    See _send_notification_email for EZGmail setup.
+
+    :param app: Flask
+    :param contact_email: str
+    :param contact_name: str
+    :param message_body: str
+    :return: None
+    """
+    email_subject, email_body = compose_notification_email(contact_email,
+                                                           contact_name,
+                                                           message_body)
+    _send_notification_email(app, email_subject, email_body)
+
+
+def deliver_digest_email(app: Flask, contacts: Sequence[Tuple[str, str, str]]) -> None:
+    """
+    Send one notification email for several contacts, raising any error.
+
+    See _send_notification_email for EZGmail setup.
+
+    :param app: Flask
+    :param contacts: Sequence of (contact_email, contact_name, message_body)
+    :return: None
+    """
+    email_subject, email_body = compose_digest_email(contacts)
+    _send_notification_email(app, email_subject, email_body)
+
+
+def _send_notification_email(app: Flask, email_subject: str, email_body: str) -> None:
+    """
+    Send email from server address to contact address, raising any error.
 
     NB EZGmail requires pre-setup with a credentials.json and token.json, and
     previously run ezgmail.init(), which must be obtained on a personal machine,
@@ -20,29 +51,17 @@ def send_contact_email(app: Flask,
     machine). The credentials must be placed in the top folder, with
     README.md/requirements.txt etc.
 
-    Then update message db entry with email_sent=True.
-
     :param app: Flask
-    :param message_id: int
-    :param contact_email: str
-    :param contact_name: str
-    :param message_body: str
+    :param email_subject: str
+    :param email_body: str
     :return: None
     """
-    DATABASE = app.config['DATABASE']
     to_address = app.config['CONTACT_EMAIL_ADDRESS']
-    email_subject, email_body = compose_notification_email(contact_email,
-                                                           contact_name,
-                                                           message_body)
-
-    try:
-        assert ezgmail.EMAIL_ADDRESS == app.config['SERVER_EMAIL_ADDRESS']
+    if ezgmail.EMAIL_ADDRESS != app.config['SERVER_EMAIL_ADDRESS']:
+        raise RuntimeError(f'EZGmail is authenticated as {ezgmail.EMAIL_ADDRESS!r}, '
+                           f'not SERVER_EMAIL_ADDRESS {app.config["SERVER_EMAIL_ADDRESS"]!r}.')
 
-        ezgmail.send(recipient=to_address, subject=email_subject, body=email_body)
-        DATABASE.email_sent(message_id)
-    except Exception as e:
-        print(e)
-        # notify of error (eg with login), using sms
+    ezgmail.send(recipient=to_address, subject=email_subject, body=email_body)
 
 
 def compose_notification_email(contact_email: str, contact_name: str, message_body: str
@@ -63,3 +82,27 @@ def compose_notification_email(contact_email: str, contact_name: str, message_bo
                   )
 
     return email_subject, email_body
+
+
+def compose_digest_email(contacts: Sequence[Tuple[str, str, str]]) -> Tuple[str, str]:
+    """
+    Compose one notification email for several contacts.
+
+    Body is each contact's notification email, oldest first.
+    A single contact gets its usual notification email.
+
+    :param contacts: Sequence of (contact_email, contact_name, message_body)
+    :return: Tuple[str, str] subject, body
+    """
+    if len(contacts) == 1:
+        return compose_notification_email(*contacts[0])
+
+    names = list(dict.fromkeys(contact_name for _, contact_name, _ in contacts))  # Unique, ordered.
+    if len(names) > 3:
+        names = [*names[:3], f'{len(names) - 3} others']
+    email_subject = f'{len(contacts)} contacts from {", ".join(names)}'
+    email_body = '\n\n----------\n\n'.join(
+        f'{subject}\n\n{body}'
+        for subject, body in (compose_notification_email(*contact) for contact in contacts))
+
+    return email_subject, email_body
@@ -1,3 +1,151 @@
 """ Send notification via SMS """
 
 """NB Keep actual account data secret, do not commit to github."""
+import abc
+import base64
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from collections import defaultdict, deque
+
+from flask import Flask
+
+
+class SMSTransport(abc.ABC):
+    """Sends an SMS. Subclass for each SMS provider/backend."""
+
+    @abc.abstractmethod
+    def send(self, to_number: str, body: str) -> None:
+        """
+        Send SMS, raising any error.
+
+        :param to_number: str
+        :param body: str
+        :return: None
+        """
+
+
+class HTTPSMSTransport(SMSTransport):
+    """
+    Send SMS via a provider's HTTP API.
+
+    POSTs form encoded To, From and Body fields with HTTP basic auth, as
+    accepted by eg Twilio's Messages resource.
+    """
+
+    def __init__(self, url: str, from_number: str, username: str, password: str, timeout: float = 10):
+        """
+        :param url: str - provider's send message endpoint.
+        :param from_number: str
+        :param username: str
+        :param password: str
+        :param timeout: float seconds
+        """
+        self.url: str = url
+        self.from_number: str = from_number
+        self._credentials: str = base64.b64encode(f'{username}:{password}'.encode()).decode()
+        self.timeout: float = timeout
+
+    def send(self, to_number: str, body: str) -> None:
+        """
+        Send SMS, raising any error, including non-2xx responses.
+
+        :param to_number: str
+        :param body: str
+        :return: None
+        """
+        request = urllib.request.Request(
+            self.url,
+            data=urllib.parse.urlencode({'To': to_number, 'From': self.from_number, 'Body': body}).encode(),
+            headers={'Authorization': f'Basic {self._credentials}'},
+            method='POST')
+        # urlopen raises HTTPError for error status codes.
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class FakeSMSTransport(SMSTransport):
+    """Record SMS rather than sending them, for development and tests."""
+
+    def __init__(self) -> None:
+        self.sent: list[tuple[str, str]] = []
+
+    def send(self, to_number: str, body: str) -> None:
+        """
+        :param to_number: str
+        :param body: str
+        :return: None
+        """
+        self.sent.append((to_number, body))
+
+
+def sms_transport_from_config(app: Flask) -> SMSTransport:
+    """
+    Create SMS transport selected by app's SMS_BACKEND config.
+
+    :param app: Flask
+    :return: SMSTransport
+    """
+    backend = app.config['SMS_BACKEND']
+    if backend == 'http':
+        return HTTPSMSTransport(url=app.config['SMS_HTTP_URL'],
+                                from_number=app.config['SMS_FROM_NUMBER'],
+                                username=app.config['SMS_HTTP_USERNAME'],
+                                password=app.config['SMS_HTTP_PASSWORD'])
+    if backend == 'fake':
+        return FakeSMSTransport()
+    raise ValueError(f"Unknown SMS_BACKEND {backend!r}, expected 'http' or 'fake'.")
+
+
+class RecipientRateLimiter:
+    """
+    Allow at most max_messages per recipient in any period seconds.
+
+    Thread-safe.
+    """
+
+    def __init__(self, max_messages: int, period: float):
+        """
+        :param max_messages: int
+        :param period: float seconds
+        """
+        self.max_messages: int = max_messages
+        self.period: float = period
+        self._sent: defaultdict[str, deque[float]] = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def acquire(self, recipient: str) -> bool:
+        """
+        Record message to recipient if within limit.
+
+        :param recipient: str
+        :return: bool True if message may be sent.
+        """
+        now = time.monotonic()
+        with self._lock:
+            sent = self._sent[recipient]
+            while sent and sent[0] <= now - self.period:
+                sent.popleft()
+            if len(sent) >= self.max_messages:
+                return False
+            sent.append(now)
+            return True
+
+
+def compose_notification_sms(contact_email: str, contact_name: str, message_body: str,
+                             max_length: int = 160) -> str:
+    """
+    Compose notification SMS, truncating message to fit a single SMS.
+
+    :param contact_email: str - address of person submitting contact form
+    :param contact_name: str
+    :param message_body: str
+    :param max_length: int characters
+    :return: str
+    """
+    sms = f'Contact from {contact_name} ({contact_email}): {message_body}'
+    if len(sms) > max_length:
+        sms = sms[:max_length - 3] + '...'
+    return sms
@@ -0,0 +1,283 @@
+""" Inline the CSS a page uses, defer its stylesheet, and preload the images it shows. """
+import functools
+import re
+
+from html import escape
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urljoin
+
+from flask import (current_app,
+                   Flask,
+                   g,
+                   Response,
+                   )
+
+from .compression import is_plain_html
+
+# Selector parts matched against a page: .class, #id and leading tag names.
+_CLASS = re.compile(r'\.([\w-]+)')
+_ID = re.compile(r'#([\w-]+)')
+_TAG = re.compile(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)')
+# Pseudo-classes/elements and attribute selectors, which depend on state, not markup.
+_STATE = re.compile(r'::?[\w-]+(\([^)]*\))?|\[[^\]]*\]')
+_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_LINK_TAG = re.compile(r'<link\b[^>]*>', re.IGNORECASE)
+# url(...) references, and @import's string form.
+_URL = re.compile(r'(url\(\s*([\'"]?))([^\'")]+)(\2\s*\))|(@import\s+([\'"]))([^\'"]+)(\6)', re.IGNORECASE)
+# References not relative to the stylesheet: absolute, root-relative, or a fragment of the document.
+_NOT_RELATIVE = re.compile(r'^(?:[a-zA-Z][\w+.-]*:|/|#)')
+
+
+class CSSRule:
+    """A rule of a stylesheet, and what it selects."""
+
+    def __init__(self, selectors: str, text: str):
+        """
+        :param selectors: str - selector list, or at-rule prelude eg @media.
+        :param text: str - rule as written, including its block.
+        """
+        self.selectors: list[str] = [selector.strip() for selector in selectors.split(',')]
+        self.text: str = text
+
+    def may_match(self, tags: set[str], classes: set[str], ids: set[str]) -> bool:
+        """
+        Whether rule may apply to a page with these tags, classes and ids.
+
+        Conservative: at-rules, and selectors whose classes, ids and tags
+        all appear on the page, match, regardless of combinators or state.
+
+        :param tags: set of str
+        :param classes: set of str
+        :param ids: set of str
+        :return: bool
+        """
+        for selector in self.selectors:
+            if selector.startswith('@'):
+                return True
+            selector = _STATE.sub('', selector)
+            if (set(_CLASS.findall(selector)) <= classes
+                    and set(_ID.findall(selector)) <= ids
+                    and {tag.lower() for tag in _TAG.findall(selector)} <= tags):
+                return True
+        return False
+
+
+def parse_stylesheet(css: str) -> list[CSSRule]:
+    """
+    Split stylesheet into top level rules, including at-rules with blocks.
+
+    :param css: str
+    :return: list of CSSRule
+    """
+    css = _COMMENT.sub('', css)
+    rules = []
+    depth = 0
+    start = 0
+    prelude_end = 0
+    for position, character in enumerate(css):
+        if character == '{':
+            if depth == 0:
+                prelude_end = position
+            depth += 1
+        elif character == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                rules.append(CSSRule(css[start:prelude_end], css[start:position + 1].strip()))
+                start = position + 1
+        elif character == ';' and depth == 0:  # Statement at-rule, eg @import.
+            rules.append(CSSRule(css[start:position], css[start:position + 1].strip()))
+            start = position + 1
+    return rules
+
+
+class PageScanner(HTMLParser):
+    """
+    Collect what a page's CSS and preload hints depend on: tags, classes and
+    ids used, stylesheets linked, and images shown.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.tags: set[str] = set()
+        self.classes: set[str] = set()
+        self.ids: set[str] = set()
+        self.stylesheets: list[str] = []
+        # (href, type, srcset, sizes) of images to preload.
+        self.images: list[tuple[str | None, str | None, str | None, str | None]] = []
+        self._in_picture: bool = False
+        self._picture_preloaded: bool = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        attributes = dict(attrs)
+        self.tags.add(tag)
+        self.classes.update((attributes.get('class') or '').split())
+        if attributes.get('id'):
+            self.ids.add(attributes['id'])  # type: ignore[arg-type]
+
+        if tag == 'link' and 'stylesheet' in (attributes.get('rel') or '').split() and attributes.get('href'):
+            self.stylesheets.append(attributes['href'])  # type: ignore[arg-type]
+        elif tag == 'picture':
+            self._in_picture, self._picture_preloaded = True, False
+        elif tag == 'source' and self._in_picture and not self._picture_preloaded:
+            # Browser preloads the first source type it supports, skipping others.
+            self.images.append((None, attributes.get('type'), attributes.get('srcset'), attributes.get('sizes')))
+            self._picture_preloaded = True
+        elif tag == 'img' and not (self._in_picture and self._picture_preloaded) and attributes.get('src'):
+            self.images.append((attributes['src'], None, attributes.get('srcset'), attributes.get('sizes')))
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'picture':
+            self._in_picture = False
+
+
+def preload_links(images: list[tuple[str | None, str | None, str | None, str | None]]) -> str:
+    """
+    Preload hints for images.
+
+    :param images: list of (href, type, srcset, sizes), as collected by PageScanner.
+    :return: str <link> tags
+    """
+    links = []
+    for href, image_type, srcset, sizes in dict.fromkeys(images):  # Deduplicated, in order.
+        attributes = {'rel': 'preload', 'as': 'image', 'href': href, 'type': image_type,
+                      'imagesrcset': srcset, 'imagesizes': sizes}
+        links.append('<link ' + ' '.join(f'{name}="{escape(value)}"'
+                                         for name, value in attributes.items() if value) + '>')
+    return '\n'.join(links)
+
+
+def rebase_urls(css: str, stylesheet_href: str) -> str:
+    """
+    Rewrite css's relative URLs, relative to stylesheet_href, for
+    inlining in a page elsewhere.
+
+    :param css: str
+    :param stylesheet_href: str eg /static/style.css?v=0123456789ab
+    :return: str
+    """
+    base = stylesheet_href.split('?', 1)[0].split('#', 1)[0]
+
+    def rebase(match: re.Match) -> str:
+        prefix, url, suffix = ((match.group(1), match.group(3), match.group(4)) if match.group(1)
+                               else (match.group(5), match.group(7), match.group(8)))
+        url = url.strip()
+        return prefix + (url if _NOT_RELATIVE.match(url) else urljoin(base, url)) + suffix
+    return _URL.sub(rebase, css)
+
+
+@functools.lru_cache(maxsize=16)
+def _stylesheet_rules(path: Path, modified: float, href: str) -> list[CSSRule]:
+    """
+    Parsed stylesheet, its URLs rebased for inlining, cached until modified.
+
+    :param path: Path
+    :param modified: float mtime, part of cache key.
+    :param href: str stylesheet is served at, eg /static/style.css?v=0123456789ab
+    :return: list of CSSRule
+    """
+    return parse_stylesheet(rebase_urls(path.read_text(encoding='utf-8'), href))
+
+
+def _static_file(href: str, static_url_path: str, static_folder: str) -> Path | None:
+    """
+    File in static_folder served at href, if any.
+
+    :param href: str eg /static/style.css?v=0123456789ab
+    :param static_url_path: str eg /static
+    :param static_folder: str
+    :return: Path, or None if href is not a static file.
+    """
+    path = href.split('?', 1)[0].split('#', 1)[0]
+    if not path.startswith(f'{static_url_path}/'):
+        return None
+    file = Path(static_folder, path[len(static_url_path) + 1:])
+    return file if file.is_file() else None
+
+
+def optimise_page(html: str, static_url_path: str, static_folder: str) -> str:
+    """
+    Inline rules of the page's local stylesheets that may match it, defer
+    loading the full stylesheets, and add preload hints for its images.
+
+    Stylesheets are still loaded, after first paint, for anything the
+    inlined rules miss, and the preload hints replace any hard-coded ones.
+    Inlined rules' relative URLs are rebased to the stylesheet's location.
+
+    :param html: str page
+    :param static_url_path: str
+    :param static_folder: str
+    :return: str page
+    """
+    scanner = PageScanner()
+    scanner.feed(html)
+    scanner.close()
+
+    preloads_added = False
+    for href in scanner.stylesheets:
+        if (file := _static_file(href, static_url_path, static_folder)) is None:
+            continue
+        rules = _stylesheet_rules(file, file.stat().st_mtime, href)
+        critical = '\n'.join(rule.text for rule in rules
+                             if rule.may_match(scanner.tags, scanner.classes, scanner.ids))
+        replacement = (f'<style>\n{critical}\n</style>\n'
+                       f'<link rel="stylesheet" href="{escape(href)}" media="print" onload="this.media=\'all\'">\n'
+                       f'<noscript><link rel="stylesheet" href="{escape(href)}"></noscript>')
+        if not preloads_added and scanner.images:
+            replacement += '\n' + preload_links(scanner.images)
+            preloads_added = True
+        html = _LINK_TAG.sub(lambda match: (replacement if 'stylesheet' in match.group(0)
+                                            and f'"{escape(href)}"' in match.group(0)
+                                            else match.group(0)),
+                             html)
+    return html
+
+
+@functools.lru_cache(maxsize=64)
+def _optimise_cached_page(html: str, static_url_path: str, static_folder: str) -> str:
+    """
+    optimise_page, cached for PageCache pages, which are served unchanged.
+
+    :param html: str page
+    :param static_url_path: str
+    :param static_folder: str
+    :return: str page
+    """
+    return optimise_page(html, static_url_path, static_folder)
+
+
+def optimise_response(response: Response) -> Response:
+    """
+    Apply optimise_page to HTML responses.
+
+    Only PageCache pages, see page_cache.cached_page, are cached: other
+    pages, eg the contact page with its CSRF token, differ each request,
+    so would only push them out of the cache.
+
+    Registered as an after_request function, before compress_response.
+
+    :param response: Response
+    :return: Response
+    """
+    if not is_plain_html(response):
+        return response
+    optimise = _optimise_cached_page if g.get('cached_page') else optimise_page
+    html = response.get_data(as_text=True)
+    optimised = optimise(html, current_app.static_url_path or '', current_app.static_folder or '')
+    if optimised != html:
+        response.set_data(optimised)
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Optimise HTML responses, if CRITICAL_CSS_ENABLED.
+
+    Call after compression.init_app, as after_request functions run in
+    reverse order of registration, so pages are optimised before compression.
+
+    :param app: Flask
+    :return: None
+    """
+    if app.config['CRITICAL_CSS_ENABLED']:
+        app.after_request(optimise_response)
@@ -1,9 +1,276 @@
 """ Contact form submission database. """
 
+import os
 import sqlite3
+import threading
+import time
 
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+from .migrations import REBUILD_BATCH_SIZE, migrate
+from .token_bucket import full_at, refill_tokens, wait_for_token
+
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING requires SQLite 3.35+.
+_UPSERT_RETURNING_SUPPORTED: bool = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Ids per batched UPDATE/DELETE ... WHERE id IN (...), within SQLite's
+# minimum bound parameter limit of 999.
+ID_BATCH_SIZE: int = 500
+
+# Durability profile settings accepted by ContactDatabase.
+# PRAGMA values cannot be bound as parameters, so are validated before use.
+DURABILITY_MODE_PRAGMAS: dict[str, set[str]] = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+}
+DURABILITY_INT_PRAGMAS: set[str] = {'busy_timeout',  # milliseconds
+                                    'cache_size',  # pages, or KiB if negative
+                                    'mmap_size',  # bytes
+                                    }
+
+
+def validate_durability_profile(profile: dict) -> dict:
+    """
+    Check durability profile only contains known PRAGMAs with valid values.
+
+    Mode names are normalised to upper case.
+
+    :param profile: dict of PRAGMA name: value
+    :return: dict
+    """
+    validated: dict[str, str | int] = {}
+    for pragma, value in profile.items():
+        if pragma in DURABILITY_MODE_PRAGMAS:
+            if not isinstance(value, str) or value.upper() not in DURABILITY_MODE_PRAGMAS[pragma]:
+                raise ValueError(f'{pragma} must be one of '
+                                 f'{sorted(DURABILITY_MODE_PRAGMAS[pragma])}, not {value!r}')
+            validated[pragma] = value.upper()
+        elif pragma in DURABILITY_INT_PRAGMAS:
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f'{pragma} must be an int, not {value!r}')
+            validated[pragma] = value
+        else:
+            raise ValueError(f'Unsupported durability setting: {pragma!r}')
+    return validated
+
+
+def _batched(ids: Sequence[int]) -> Iterator[Sequence[int]]:
+    """
+    Split ids into batches of at most ID_BATCH_SIZE.
+
+    :param ids: Sequence of int
+    :return: Iterator of Sequence of int
+    """
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        yield ids[start:start + ID_BATCH_SIZE]
+
+
+def _fts_query(terms: Sequence[str]) -> str:
+    """
+    FTS5 query matching all terms, each quoted so it isn't read as query syntax.
+
+    :param terms: Sequence of str words, prefixes if ending in *.
+    :return: str
+    """
+    return ' '.join('"{}"{}'.format(term.rstrip('*').replace('"', '""'), '*' if term.endswith('*') else '')
+                    for term in terms)
+
+
+def _like_pattern(term: str) -> str:
+    """
+    LIKE pattern, with ESCAPE '\\', matching term anywhere in a value.
+
+    :param term: str word, a trailing * is ignored.
+    :return: str
+    """
+    escaped = term.rstrip('*').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+class ConnectionPoolTimeout(sqlite3.OperationalError):
+    """No pooled connection became available before the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of reusable SQLite connections.
+
+    Connections are made on demand by connection_factory, with at most
+    max_size checked out at once. A checked out connection belongs to a
+    single thread until it is returned. Idle connections are reused most
+    recently returned first, so a busy worker keeps reusing the same warm
+    connection, and are closed once idle for longer than max_idle_seconds.
+
+    A max_size of 0 disables pooling: every checkout opens a new
+    connection, which is closed again on return.
+
+    Fork-safe: SQLite connections must not be used across fork(), so a
+    process forked from the one that created the pool, eg a pre-fork
+    server's worker, starts with an empty pool and a fresh lock.
+    Connections inherited from the parent are kept referenced but never
+    used or closed, as closing them could disturb the parent's database
+    state.
+    """
+
+    def __init__(self,
+                 connection_factory: Callable[[], sqlite3.Connection],
+                 max_size: int = 5,
+                 max_idle_seconds: float = 300,
+                 checkout_timeout: float = 30,
+                 ):
+        """
+        :param connection_factory: Callable returning a new sqlite3.Connection
+        :param max_size: int - maximum connections checked out at once
+        :param max_idle_seconds: float
+        :param checkout_timeout: float - seconds to wait for a free connection
+        """
+        self._connection_factory = connection_factory
+        self.max_size: int = max_size
+        self.max_idle_seconds: float = max_idle_seconds
+        self.checkout_timeout: float = checkout_timeout
+
+        self._idle: list[tuple[sqlite3.Connection, float]] = []  # (connection, time returned)
+        self._checked_out: int = 0
+        self._closed: bool = False
+        self._condition = threading.Condition()
+        self._pid: int = os.getpid()
+        # Connections inherited from a parent process, see _after_fork.
+        self._inherited: list[sqlite3.Connection] = []
+
+    def _after_fork(self) -> bool:
+        """
+        Reset the pool if this process was forked since it was last used.
+
+        The lock may have been held by another of the parent's threads at
+        the fork, so is replaced rather than acquired.
+
+        :return: bool True if the pool was reset.
+        """
+        if self._pid == os.getpid():
+            return False
+        self._inherited += [connection for connection, _ in self._idle]
+        self._idle = []
+        self._checked_out = 0
+        self._condition = threading.Condition()
+        self._pid = os.getpid()
+        return True
+
+    def checkout(self) -> sqlite3.Connection:
+        """
+        Take a connection from the pool, creating one if none are idle.
+
+        Blocks for up to checkout_timeout seconds if max_size connections
+        are already checked out.
+
+        :return: sqlite3.Connection
+        """
+        if not self.max_size:  # Pooling disabled.
+            return self._connection_factory()
+
+        self._after_fork()
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError('Cannot operate on a closed connection pool.')
+                self._evict_idle()
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    self._checked_out += 1
+                    return connection
+                if self._checked_out < self.max_size:
+                    self._checked_out += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionPoolTimeout(
+                        f'No database connection available after {self.checkout_timeout} seconds.')
+                self._condition.wait(remaining)
+
+        # Connect outside the lock, so other threads can return connections meanwhile.
+        try:
+            return self._connection_factory()
+        except BaseException:
+            with self._condition:
+                self._checked_out -= 1
+                self._condition.notify()
+            raise
+
+    def checkin(self, connection: sqlite3.Connection, discard: bool = False) -> None:
+        """
+        Return a checked out connection to the pool.
+
+        :param connection: sqlite3.Connection
+        :param discard: bool - close connection rather than reuse it, eg
+                        after an error that may have left it unusable.
+        :return: None
+        """
+        if not self.max_size:  # Pooling disabled.
+            connection.close()
+            return
+
+        if self._after_fork():  # Checked out by the parent process.
+            self._inherited.append(connection)
+            return
+        with self._condition:
+            self._checked_out -= 1
+            if self._closed or discard:
+                connection.close()
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._evict_idle()
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Check out a connection for the duration of a with block.
+
+        The connection is rolled back and discarded if the block raises.
+
+        :return: Iterator[sqlite3.Connection]
+        """
+        connection = self.checkout()
+        try:
+            yield connection
+        except BaseException:
+            try:
+                connection.rollback()
+            finally:
+                self.checkin(connection, discard=True)
+            raise
+        else:
+            self.checkin(connection)
+
+    def close(self) -> None:
+        """
+        Close idle connections, and any checked out ones as they are returned.
+
+        :return: None
+        """
+        self._after_fork()
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                connection.close()
+            self._condition.notify_all()
+
+    def _evict_idle(self) -> None:
+        """
+        Close connections idle for longer than max_idle_seconds.
+
+        Caller must hold self._condition.
+
+        :return: None
+        """
+        cutoff = time.monotonic() - self.max_idle_seconds
+        # Oldest connections are at the front of the list.
+        while self._idle and self._idle[0][1] < cutoff:
+            connection, _ = self._idle.pop(0)
+            connection.close()
 
 
 class ContactDatabase:
@@ -12,145 +279,352 @@ class ContactDatabase:
 
     Hold contact form submissions.
 
-    Schema:
+    Schema, created and upgraded by migrations.MIGRATIONS:
         Table: `person`
             key `id` - INTEGER primary key
             key `name` TEXT <= 255 chars
             key `email` TEXT <= 255 chars
-            key 'alternate_names' TEXT <= 510 chars # comma sep str of alt names.
+
+        Table: `person_alias` - names a person submitted other than person.name.
+            key `person_id` - INTEGER ie person.id
+            key `name` TEXT <= 255 chars
+            primary key (person_id, name)
 
         Table: `message`
             key `id` - INTEGER primary key
             key `person_id` - TEXT <= 255 chars ie person.id
             key `contents` - TEXT <= max_message_length
+            key `email_sent` - BOOLEAN
+            key `sms_sent` - BOOLEAN
+            key `email_attempts` - INTEGER failed notification email attempts.
+            key `email_last_error` - TEXT error from last failed attempt.
+            key `email_next_attempt_at` - REAL unix timestamp of next retry,
+                                          NULL if not due a retry.
+            key `fingerprint` - BLOB hash of email and contents, see
+                                contact.dedupe.message_fingerprint.
+            key `received_at` - REAL unix timestamp
+
+        Table: `outbox` - notifications waiting to be dispatched.
+            key `id` - INTEGER primary key
+            key `message_id` - INTEGER ie message.id
+            key `channel` - TEXT 'email' or 'sms'
+            key `created_at` - REAL unix timestamp
+            key `claimed_at` - REAL unix timestamp, NULL if unclaimed.
+
+        Table: `rate_limit` - token buckets, see rate_limit.py.
+            key `key` - TEXT primary key, eg 'ip:192.0.2.1'
+            key `tokens` - REAL tokens at updated_at.
+            key `updated_at` - REAL unix timestamp
+            key `full_at` - REAL unix timestamp bucket refills to capacity.
 
     """
 
     def __init__(self,
                  database_path: Path,
                  message_max_length: int,
+                 pool_size: int = 5,
+                 pool_max_idle_seconds: float = 300,
+                 durability_profile: Optional[dict] = None,
+                 migrate_on_init: bool = True,
                  ):
         """
         :param database_path: Path
         :param message_max_length: int
+        :param pool_size: int - max pooled connections, 0 disables pooling.
+        :param pool_max_idle_seconds: float
+        :param durability_profile: dict of PRAGMA settings applied to each
+                                   connection, see DURABILITY_MODE_PRAGMAS and
+                                   DURABILITY_INT_PRAGMAS.
+                                   SQLite defaults if None.
+        :param migrate_on_init: bool - migrate schema when created, else
+                                call migrate before use.
         """
 
         self.database_path: Path = (database_path
                                     or Path(Path.cwd(), 'contact.db'))
         self._message_max_length: int = message_max_length
+        self.durability_profile: dict = validate_durability_profile(durability_profile or {})
+        self._pool = ConnectionPool(self._connection,
+                                    max_size=pool_size,
+                                    max_idle_seconds=pool_max_idle_seconds)
+        self._migrate_on_init: bool = migrate_on_init
+        # Whether search_messages uses the FTS5 index, set by _init_db and migrate.
+        self.full_text_search: bool = False
+        # Called with (stage, seconds) for db_connect/db_execute/db_commit, eg by metrics.
+        self.timer: Optional[Callable[[str, float], None]] = None
         # check if db file exists/db has appropriate tables etc
         self._init_db()
 
     def _connection(self) -> sqlite3.Connection:
         """
-        Return connection to database.
+        Return new connection to database.
 
-        Execute command enforcing foreign key support in SQLite.
+        Execute command enforcing foreign key support in SQLite, and apply
+        durability profile. Pooled connections are reused, so these are
+        applied once per connection rather than per query.
+        Connections may be closed by a different thread to the one that
+        opened them when pooled, but are only used by one thread at a time.
         :return: sqlite3.Connection
         """
-        connection = sqlite3.connect(self.database_path)
+        connection = sqlite3.connect(self.database_path, check_same_thread=False)
         # Ensure foreign key constraint enforcement.
         connection.cursor().execute("""PRAGMA foreign_keys=ON;""")
+        for pragma, value in self.durability_profile.items():
+            # Values validated in validate_durability_profile.
+            connection.cursor().execute(f"""PRAGMA {pragma}={value};""")
         return connection
         # handle case where connection fails?
         # or should it fail, since on disk db connection should not fail?
 
-    def _init_db(self):
+    @contextmanager
+    def _pooled_connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Check out pooled connection, committing on success.
+
+        Rolls back and discards the connection on error.
+        Time spent checking out, using and committing the connection is
+        reported to timer, if set.
+
+        :return: Iterator[sqlite3.Connection]
+        """
+        start = time.perf_counter()
+        with self._pool.connection() as conn:
+            checked_out = time.perf_counter()
+            yield conn
+            executed = time.perf_counter()
+            conn.commit()
+        if self.timer is not None:
+            self.timer('db_connect', checked_out - start)
+            self.timer('db_execute', executed - checked_out)
+            self.timer('db_commit', time.perf_counter() - executed)
+
+    def close(self) -> None:
         """
-        Create empty database, create missing tables.
+        Close pooled database connections.
 
         :return: None
         """
+        self._pool.close()
 
-        with self._connection() as conn:
-            conn.cursor().execute(
-                """CREATE TABLE IF NOT EXISTS person(
-                         -- primary key must be INTEGER not INT, NOT NULL is implicit.
-                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                         name TEXT NOT NULL CHECK(typeof("name") = 'text' AND
-                                                  length("name") <= 255
-                                                  ),
-                         email TEXT UNIQUE NOT NULL CHECK(typeof("name") = 'text' AND
-                                                          length("name") <= 255
-                                                          ),
-                         alternate_names TEXT CHECK(typeof("name") = 'text' AND
-                                                    length("name") <= 510 
-                                                    )                                                   
-                         );
-                         """)
-            conn.cursor().execute(
-                f"""CREATE TABLE IF NOT EXISTS message(
-                         -- primary key must be INTEGER not INT, NOT NULL is implicit.
-                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                         person_id INTEGER NOT NULL,
-                         contents TEXT NOT NULL CHECK(typeof("contents") = 'text' AND
-                                                      length("contents") <= {self._message_max_length}
-                                                      ),
-                         email_sent BOOLEAN NOT NULL CHECK(email_sent IN (0,1)) DEFAULT 0, -- Default False,
-                         sms_sent BOOLEAN NOT NULL CHECK(sms_sent IN (0,1)) DEFAULT 0,     -- Stored as 1,0.
-                         FOREIGN KEY (person_id) REFERENCES person(id)
-                         );
-                         """)
-        conn.commit()
-        conn.close()
-
-    def get_person_from_email(self, db_connection: sqlite3.Connection, email: str) -> tuple:
-        """
-        Get person.id from email.
+    def _init_db(self) -> None:
+        """
+        Create empty database, or migrate it to the current schema.
+
+        Only the database's user_version is read if its schema is current,
+        so workers starting against an existing database only read a header.
+        Skipped if migrate_on_init is False, see migrate, in which case
+        the FTS5 index is still used if an earlier migration created it.
+
+        :return: None
+        """
+        if self._migrate_on_init:
+            self.migrate()
+        else:
+            with self._pooled_connection() as conn:
+                self._detect_full_text_search(conn)
+
+    def _detect_full_text_search(self, conn: sqlite3.Connection) -> None:
+        """
+        Set full_text_search, if the database has the FTS5 message_search index.
+
+        :param conn: sqlite3.Connection
+        :return: None
+        """
+        self.full_text_search = conn.execute(
+            """SELECT 1 FROM sqlite_master WHERE name='message_search';""").fetchone() is not None
+
+    def migrate(self, batch_size: int = REBUILD_BATCH_SIZE, pause: float = 0) -> list[int]:
+        """
+        Apply schema migrations the database is missing.
+
+        Tables rebuilt by a migration are copied batch_size rows per
+        transaction, so other workers can write to them meanwhile.
+
+        :param batch_size: int rows copied per transaction when rebuilding tables.
+        :param pause: float seconds between batches.
+        :return: list of int schema versions applied.
+        """
+        with self._pooled_connection() as conn:
+            applied = migrate(conn, self._message_max_length, batch_size=batch_size, pause=pause)
+            self._detect_full_text_search(conn)
+        return applied
+
+    def get_person_from_email(self, db_connection: sqlite3.Connection, email: str) -> Optional[tuple]:
+        """
+        Get person.id, name and aliases from email.
         Email column is lower-cased/case-insensitive.
 
+        Aliases are read from person_alias's primary key index, so in name
+        order, however many the person has.
+
         :param db_connection: sqlite3.Connection
         :param email: str
-        :return: float
+        :return: tuple of (int person.id, str name, tuple of str aliases),
+                 or None if email not found.
         """
-        return db_connection.cursor().execute(
-            """SELECT person.id, person.name, person.alternate_names
+        person = db_connection.cursor().execute(
+            """SELECT person.id, person.name
                FROM person
                WHERE email=?
                LIMIT 1;
                """, (email.lower(),)).fetchone()
+        if person is None:
+            return None
+        aliases = db_connection.cursor().execute(
+            """SELECT name
+               FROM person_alias
+               WHERE person_id=?
+               ORDER BY name;
+               """, (person[0],)).fetchall()
+        return (*person, tuple(alias for alias, in aliases))
 
     def store_person(self, name: str, email: str) -> int:
         """
         Store contact details in database.
 
         If nonexistent based on email, add contact.
-        If existent email, new name, add alternate name to
-        alternate_names column.
+        If existent email, new name, add name to the person's aliases.
         Email column is case-insensitive, stores/checked as lowercase.
 
-        NB alternate_names column might have spurious commas if user submits
-        data containing commas.
+        :param name: str
+        :param email: str
+        :return: int person.id
+        """
+        with self._pooled_connection() as conn:
+            return self._upsert_person(conn, name, email)
+
+    def _upsert_person(self, db_connection: sqlite3.Connection, name: str, email: str) -> int:
+        """
+        Insert person, or add name to existing person's aliases.
+
+        Runs in the caller's transaction, does not commit.
+        Uses a single INSERT ... ON CONFLICT ... RETURNING statement where
+        SQLite supports it, otherwise looks up the email first. A new alias
+        is then one INSERT OR IGNORE on person_alias's unique index.
 
+        :param db_connection: sqlite3.Connection
         :param name: str
         :param email: str
         :return: int person.id
         """
         email = email.lower()
-        with self._connection() as conn:
-            cursor = conn.cursor()
-            # Check if email already in db, update with any new data:
-            if existing_record := self.get_person_from_email(conn, email):
-                person_id, person_name, alternate_names = existing_record
-
-                if name != person_name and (not alternate_names  # Avoid str comparison to None.
-                                            or name not in alternate_names):
-                    alternate_names = name if not alternate_names else f'{alternate_names}, ' + name
-                    cursor.execute(
-                        """UPDATE person
-                           SET alternate_names=?
-                           WHERE person.id=?;
-                           """, (alternate_names, person_id,))
-
-            else:  # Create new record:
-                cursor.execute(
-                    """INSERT INTO person(name, email)
-                       VALUES(?,?);
-                       """, (name, email))
-                person_id = cursor.lastrowid
-        conn.commit()
+        cursor = db_connection.cursor()
+        if _UPSERT_RETURNING_SUPPORTED:
+            # No-op update, so RETURNING returns an existing person's row.
+            person_id, person_name = cursor.execute(
+                """INSERT INTO person(name, email)
+                   VALUES(?,?)
+                   ON CONFLICT(email) DO UPDATE
+                   SET name=person.name
+                   RETURNING id, name;
+                   """, (name, email)).fetchone()
+        elif existing_record := cursor.execute(
+                """SELECT id, name
+                   FROM person
+                   WHERE email=?;
+                   """, (email,)).fetchone():
+            person_id, person_name = existing_record
+        else:  # Create new record:
+            cursor.execute(
+                """INSERT INTO person(name, email)
+                   VALUES(?,?);
+                   """, (name, email))
+            person_id, person_name = cursor.lastrowid, name
+
+        if name != person_name:
+            cursor.execute(
+                """INSERT OR IGNORE INTO person_alias(person_id, name)
+                   VALUES(?,?);
+                   """, (person_id, name))
         return person_id
 
+    def list_messages(self,
+                      before_id: Optional[int] = None,
+                      limit: int = 50,
+                      email_sent: Optional[bool] = None,
+                      sms_sent: Optional[bool] = None,
+                      person_id: Optional[int] = None,
+                      ) -> list[tuple]:
+        """
+        Page of messages, newest first, with their sender.
+
+        Keyset pagination: pass the last message.id of a page as before_id
+        for the next page. Each page seeks into the primary key, or the
+        index for the filter, rather than skipping earlier pages' rows as
+        OFFSET would, so takes the same time however deep.
+
+        :param before_id: int - only messages with a lower message.id,
+                          None for the first page.
+        :param limit: int
+        :param email_sent: bool, or None for either.
+        :param sms_sent: bool, or None for either.
+        :param person_id: int, or None for all people.
+        :return: list of (message.id, person.id, person.name, person.email,
+                          message.contents, message.email_sent, message.sms_sent)
+        """
+        conditions, parameters = [], []
+        for condition, value in (('message.id < ?', before_id),
+                                 ('message.email_sent = ?', email_sent),
+                                 ('message.sms_sent = ?', sms_sent),
+                                 ('message.person_id = ?', person_id)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        with self._pooled_connection() as conn:
+            return conn.cursor().execute(
+                f"""SELECT message.id, person.id, person.name, person.email,
+                           message.contents, message.email_sent, message.sms_sent
+                    FROM message
+                    JOIN person ON person.id = message.person_id
+                    WHERE {' AND '.join(conditions) or 1}
+                    ORDER BY message.id DESC
+                    LIMIT ?;
+                    """, (*parameters, limit)).fetchall()
+
+    def search_messages(self, query: str, limit: int = 20) -> list[tuple]:
+        """
+        Messages whose contents or sender's name or email contain every
+        word of query, best match first.
+
+        Words are matched as whole words, or as prefixes if ending in *.
+        Ranked by bm25 using the FTS5 index if full_text_search, otherwise
+        newest first, scanning every message with LIKE substring matches.
+
+        :param query: str
+        :param limit: int
+        :return: list of (message.id, person.id, person.name, person.email,
+                          message.contents, message.email_sent, message.sms_sent)
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        with self._pooled_connection() as conn:
+            if self.full_text_search:
+                return conn.cursor().execute(
+                    """SELECT message.id, person.id, person.name, person.email,
+                              message.contents, message.email_sent, message.sms_sent
+                       FROM message_search
+                       JOIN message ON message.id = message_search.rowid
+                       JOIN person ON person.id = message.person_id
+                       WHERE message_search MATCH ?
+                       ORDER BY message_search.rank
+                       LIMIT ?;
+                       """, (_fts_query(terms), limit)).fetchall()
+
+            patterns = [_like_pattern(term) for term in terms]
+            condition = """(message.contents LIKE ? ESCAPE '\\'
+                             OR person.name LIKE ? ESCAPE '\\'
+                             OR person.email LIKE ? ESCAPE '\\')"""
+            return conn.cursor().execute(
+                f"""SELECT message.id, person.id, person.name, person.email,
+                           message.contents, message.email_sent, message.sms_sent
+                    FROM message
+                    JOIN person ON person.id = message.person_id
+                    WHERE {' AND '.join([condition] * len(patterns))}
+                    ORDER BY message.id DESC
+                    LIMIT ?;
+                    """, (*(pattern for pattern in patterns for _ in range(3)), limit)).fetchall()
+
     def store_message_text(self, person_id: int, message_text: str) -> Optional[int]:
         """
         Store message text in database, return id of message.
@@ -159,27 +633,220 @@ class ContactDatabase:
         :param message_text: str
         :return: int: message.id
         """
-        with self._connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """INSERT INTO message(person_id, contents)
-                   VALUES(?,?)
-                   """, (person_id, message_text))
-            message_id = cursor.lastrowid
-        conn.commit()
-        return message_id
+        with self._pooled_connection() as conn:
+            return self._insert_message(conn, person_id, message_text)
+
+    def _insert_message(self, db_connection: sqlite3.Connection,
+                        person_id: int, message_text: str,
+                        fingerprint: Optional[bytes] = None) -> Optional[int]:
+        """
+        Insert message text, received now, return id of message.
 
-    def store_contact(self, name: str, email: str, message: str) -> Optional[int]:
+        Runs in the caller's transaction, does not commit.
+
+        :param db_connection: sqlite3.Connection
+        :param person_id: int
+        :param message_text: str
+        :param fingerprint: bytes or None
+        :return: int: message.id
+        """
+        cursor = db_connection.cursor()
+        cursor.execute(
+            """INSERT INTO message(person_id, contents, fingerprint, received_at)
+               VALUES(?,?,?,?)
+               """, (person_id, message_text, fingerprint, time.time()))
+        return cursor.lastrowid
+
+    def store_contact(self, name: str, email: str, message: str,
+                      notification_channels: Iterable[str] = (),
+                      fingerprint: Optional[bytes] = None,
+                      duplicate_window: float = 0,
+                      ) -> Optional[int]:
         """
+        Store person and their message, return id of message.
+
+        Person and message are written in a single transaction, so a
+        submission is one commit, and a failed message insert does not
+        leave an orphaned person.
+        Notifications of the message are queued in the outbox in the same
+        transaction, for each channel in notification_channels.
+
+        If a message with the same fingerprint was received in the last
+        duplicate_window seconds, nothing is written. The check and the
+        insert share a write transaction, so concurrent duplicates from
+        several workers store one message.
 
         :param name: str
         :param email: str
         :param message: str
-        :return: int
+        :param notification_channels: Iterable of 'email'/'sms'
+        :param fingerprint: bytes or None, see contact.dedupe.message_fingerprint.
+        :param duplicate_window: float seconds, 0 stores duplicates.
+        :return: int message.id, or None if a duplicate.
+        """
+        with self._pooled_connection() as conn:
+            if fingerprint is not None and duplicate_window:
+                # Take the write lock before reading, so concurrent duplicates serialise.
+                conn.execute("""BEGIN IMMEDIATE;""")
+                if conn.cursor().execute(
+                        """SELECT 1
+                           FROM message
+                           WHERE fingerprint=? AND received_at >= ?
+                           LIMIT 1;
+                           """, (fingerprint, time.time() - duplicate_window)).fetchone():
+                    return None
+            person_id = self._upsert_person(conn, name, email)
+            message_id = self._insert_message(conn, person_id, message, fingerprint)
+            conn.cursor().executemany(
+                """INSERT INTO outbox(message_id, channel, created_at)
+                   VALUES(?,?,?);
+                   """, [(message_id, channel, time.time()) for channel in notification_channels])
+            return message_id
+
+    def claim_notifications(self, channel: str, limit: int, lease_seconds: float) -> list[tuple]:
+        """
+        Claim queued notifications for dispatch, oldest first.
+
+        Claimed notifications are not returned to other callers until
+        lease_seconds has passed, so several worker processes can drain
+        the outbox without sending duplicates. A notification whose
+        dispatcher died without completing it is claimable again once
+        its lease has expired.
+
+        :param channel: str 'email' or 'sms'
+        :param limit: int
+        :param lease_seconds: float
+        :return: list of (outbox.id, message.id, person.email, person.name,
+                          message.contents, message.email_attempts)
+        """
+        now = time.time()
+        with self._pooled_connection() as conn:
+            # Take the write lock before reading, so concurrent claims serialise.
+            conn.execute("""BEGIN IMMEDIATE;""")
+            candidates = conn.cursor().execute(
+                """SELECT outbox.id, message.id, person.email, person.name, message.contents,
+                          message.email_attempts
+                   FROM outbox
+                   JOIN message ON message.id = outbox.message_id
+                   JOIN person ON person.id = message.person_id
+                   WHERE outbox.channel=?
+                     AND (outbox.claimed_at IS NULL OR outbox.claimed_at < ?)
+                   ORDER BY outbox.id
+                   LIMIT ?;
+                   """, (channel, now - lease_seconds, limit)).fetchall()
+            conn.cursor().executemany(
+                """UPDATE outbox
+                   SET claimed_at=?
+                   WHERE id=?;
+                   """, [(now, candidate[0]) for candidate in candidates])
+        return candidates
+
+    def outbox_status(self, channel: str, lease_seconds: float) -> tuple[int, Optional[float]]:
+        """
+        Count claimable queued notifications, and when the oldest was queued.
+
+        :param channel: str 'email' or 'sms'
+        :param lease_seconds: float - as for claim_notifications.
+        :return: tuple of (int count, float unix timestamp or None if none)
+        """
+        with self._pooled_connection() as conn:
+            return conn.cursor().execute(
+                """SELECT count(*), min(created_at)
+                   FROM outbox
+                   WHERE channel=?
+                     AND (claimed_at IS NULL OR claimed_at < ?);
+                   """, (channel, time.time() - lease_seconds)).fetchone()
+
+    def complete_notification(self, outbox_id: int) -> None:
+        """
+        Remove dispatched notification from the outbox.
+
+        :param outbox_id: int
+        :return: None
+        """
+        self.complete_notifications([outbox_id])
+
+    def complete_notifications(self, outbox_ids: Sequence[int]) -> None:
+        """
+        Remove dispatched notifications from the outbox, in one transaction.
+
+        :param outbox_ids: Sequence of int outbox.id
+        :return: None
+        """
+        with self._pooled_connection() as conn:
+            for batch in _batched(outbox_ids):
+                conn.cursor().execute(
+                    f"""DELETE FROM outbox
+                        WHERE id IN ({', '.join('?' * len(batch))});
+                        """, batch)
+
+    def claim_email_retries(self, limit: int, lease_seconds: float) -> list[tuple]:
+        """
+        Claim unsent messages due a notification email retry, most overdue first.
+
+        Claimed messages have their next attempt pushed back by
+        lease_seconds, so concurrent dispatchers do not retry the same
+        message, and a retry abandoned by a dead dispatcher is picked up
+        again once the lease expires.
+        Uses the partial index on unsent messages' email_next_attempt_at,
+        so only due messages are read however large the table grows.
+
+        :param limit: int
+        :param lease_seconds: float
+        :return: list of (message.id, person.email, person.name, message.contents,
+                          message.email_attempts)
+        """
+        now = time.time()
+        with self._pooled_connection() as conn:
+            # Take the write lock before reading, so concurrent claims serialise.
+            conn.execute("""BEGIN IMMEDIATE;""")
+            due = conn.cursor().execute(
+                """SELECT message.id, person.email, person.name, message.contents,
+                          message.email_attempts
+                   FROM message
+                   JOIN person ON person.id = message.person_id
+                   WHERE message.email_sent=0
+                     AND message.email_next_attempt_at <= ?
+                   ORDER BY message.email_next_attempt_at
+                   LIMIT ?;
+                   """, (now, limit)).fetchall()
+            conn.cursor().executemany(
+                """UPDATE message
+                   SET email_next_attempt_at=?
+                   WHERE id=?;
+                   """, [(now + lease_seconds, message[0]) for message in due])
+        return due
+
+    def schedule_email_retries(self, spread: float, min_message_id: int = 0) -> int:
+        """
+        Schedule notification email retries for unsent messages not due one,
+        eg emails that failed before retries were recorded, or were given up on.
+
+        Retries are spread evenly over the next spread seconds, oldest
+        message first, so a backlog is not sent all at once. Messages
+        queued in the outbox are skipped, as they are yet to be sent.
+
+        :param spread: float seconds
+        :param min_message_id: int - only schedule messages from this id.
+        :return: int number of messages scheduled.
         """
-        person_id = self.store_person(name, email)
-        message_id = self.store_message_text(person_id, message)
-        return message_id
+        now = time.time()
+        with self._pooled_connection() as conn:
+            unsent = [message_id for message_id, in conn.cursor().execute(
+                """SELECT id
+                   FROM message
+                   WHERE email_sent=0
+                     AND email_next_attempt_at IS NULL
+                     AND id >= ?
+                     AND id NOT IN (SELECT message_id FROM outbox WHERE channel='email')
+                   ORDER BY id;
+                   """, (min_message_id,))]
+            conn.cursor().executemany(
+                """UPDATE message
+                   SET email_next_attempt_at=?
+                   WHERE id=?;
+                   """, [(now + spread * n / len(unsent), message_id) for n, message_id in enumerate(unsent)])
+        return len(unsent)
 
     def email_sent(self, message_id: int) -> None:
         """
@@ -188,13 +855,42 @@ class ContactDatabase:
         :param message_id:
         :return: None
         """
-        with self._connection() as conn:
+        self.emails_sent([message_id])
+
+    def emails_sent(self, message_ids: Sequence[int]) -> None:
+        """
+        Register in db that emails for several messages have been sent,
+        eg in one digest, with a batched update.
+
+        :param message_ids: Sequence of int message.id
+        :return: None
+        """
+        with self._pooled_connection() as conn:
+            for batch in _batched(message_ids):
+                conn.cursor().execute(
+                    f"""UPDATE message
+                        SET email_sent=1, email_next_attempt_at=NULL
+                        WHERE id IN ({', '.join('?' * len(batch))});
+                        """, batch)
+
+    def email_failed(self, message_id: int, error: str, retry_at: Optional[float]) -> None:
+        """
+        Register in db a failed attempt to send a message email.
+
+        :param message_id: int
+        :param error: str description of failure.
+        :param retry_at: float unix timestamp of next attempt, or None to
+                         stop retrying.
+        :return: None
+        """
+        with self._pooled_connection() as conn:
             conn.cursor().execute(
                 """UPDATE message
-                   SET email_sent=?
+                   SET email_attempts=email_attempts + 1,
+                       email_last_error=?,
+                       email_next_attempt_at=?
                    WHERE id=?;
-                   """, (True, message_id))
-        conn.commit()
+                   """, (error, retry_at, message_id))
 
     def sms_sent(self, message_id: int) -> None:
         """
@@ -203,10 +899,45 @@ class ContactDatabase:
         :param message_id:
         :return: None
         """
-        with self._connection() as conn:
+        with self._pooled_connection() as conn:
             conn.cursor().execute(
                 """UPDATE message
                    SET sms_sent=?
                    WHERE id=?;
                    """, (True, message_id))
-        conn.commit()
+
+    def take_tokens(self, buckets: dict[str, tuple[float, float]], now: float) -> float:
+        """
+        Take a token from each bucket, if all have one, in one transaction.
+
+        Buckets without a row are full. Rows of buckets that have refilled
+        are deleted, so the table only holds recently limited keys.
+
+        :param buckets: dict of {key: (capacity, tokens per second)}
+        :param now: float unix timestamp
+        :return: float 0 if tokens were taken, else seconds until they could be.
+        """
+        with self._pooled_connection() as conn:
+            # Take the write lock before reading, so concurrent takes serialise.
+            conn.execute("""BEGIN IMMEDIATE;""")
+            conn.cursor().execute(
+                """DELETE FROM rate_limit
+                   WHERE full_at <= ?;
+                   """, (now,))
+            keys = list(buckets)
+            stored = {key: (tokens, updated_at) for key, tokens, updated_at in conn.cursor().execute(
+                f"""SELECT key, tokens, updated_at
+                    FROM rate_limit
+                    WHERE key IN ({', '.join('?' * len(keys))});
+                    """, keys)}
+            available = {key: refill_tokens(*stored[key], now, capacity, rate) if key in stored else capacity
+                         for key, (capacity, rate) in buckets.items()}
+            retry_after = max((wait_for_token(available[key], *bucket) for key, bucket in buckets.items()),
+                              default=0)
+            if not retry_after:
+                conn.cursor().executemany(
+                    """INSERT OR REPLACE INTO rate_limit(key, tokens, updated_at, full_at)
+                       VALUES(?,?,?,?);
+                       """, [(key, available[key] - 1, now, full_at(available[key] - 1, now, capacity, rate))
+                             for key, (capacity, rate) in buckets.items()])
+        return retry_after
@@ -5,10 +5,115 @@ SECRET_KEY: bytes = b'some secret key'
 
 CONTACT_DATABASE_PATH = Path('some_instance.db')
 CONTACT_MESSAGE_MAX_LENGTH: int = 10000  # characters
+CONTACT_DATABASE_POOL_SIZE: int = 5  # Max pooled connections, 0 disables pooling.
+CONTACT_DATABASE_POOL_MAX_IDLE: float = 300  # seconds
+# Durability profile, applied to each database connection.
+# WAL lets readers and a writer proceed concurrently, and with synchronous=NORMAL
+# commits do not fsync (a power loss may lose the latest commits, not corrupt the db).
+CONTACT_DATABASE_JOURNAL_MODE: str = 'WAL'
+CONTACT_DATABASE_SYNCHRONOUS: str = 'NORMAL'
+CONTACT_DATABASE_BUSY_TIMEOUT: int = 5000  # milliseconds to wait on a locked db
+CONTACT_DATABASE_CACHE_SIZE: int = -8000  # pages, or KiB if negative
+CONTACT_DATABASE_MMAP_SIZE: int = 64 * 1024 * 1024  # bytes
+# Migrate the database schema in create_app. If False, run before starting new workers:
+#   flask --app toonarmycaptain_website migrate-db [--batch-size N] [--pause SECONDS]
+CONTACT_DATABASE_MIGRATE_ON_STARTUP: bool = True
 
 SERVER_EMAIL_ADDRESS: str = 'some email to send contact emails from'
 CONTACT_EMAIL_ADDRESS: str = 'where to send contact emails to'
 
 CONTACT_CELL_NUMBER: str = 'some number'
 
+# SMS notifications, sent to CONTACT_CELL_NUMBER. Keep credentials in app_config.py.
+SMS_NOTIFICATIONS_ENABLED: bool = False
+SMS_BACKEND: str = 'http'  # 'http' provider API, or 'fake' to record rather than send.
+SMS_HTTP_URL: str = 'https://api.twilio.com/2010-04-01/Accounts/<account sid>/Messages.json'
+SMS_HTTP_USERNAME: str = 'provider account id'
+SMS_HTTP_PASSWORD: str = 'provider auth token'
+SMS_FROM_NUMBER: str = 'number to send SMS from'
+SMS_RATE_LIMIT_COUNT: int = 5  # Max SMS to a recipient...
+SMS_RATE_LIMIT_PERIOD: float = 60 * 60  # ...per this many seconds.
+
+# Contact notifications are queued by the contact route and sent by either:
+#   'thread' - a background thread in each web worker process.
+#   'process' - a separate process: flask --app toonarmycaptain_website dispatch-notifications
+NOTIFICATION_WORKER: str = 'thread'
+NOTIFICATION_POLL_INTERVAL: float = 30  # seconds between scans for queued notifications
+NOTIFICATION_BATCH_SIZE: int = 20
+NOTIFICATION_CLAIM_LEASE: float = 300  # seconds before a claimed, unsent notification is retried
+# Failed emails are retried with exponential backoff and jitter:
+NOTIFICATION_MAX_ATTEMPTS: int = 10
+NOTIFICATION_RETRY_BASE_DELAY: float = 60  # seconds
+NOTIFICATION_RETRY_MAX_DELAY: float = 6 * 60 * 60  # seconds
+# Digest mode: collect emails for up to NOTIFICATION_DIGEST_WINDOW seconds, or until
+# NOTIFICATION_DIGEST_MAX_MESSAGES are queued, and send them as one email. 0 disables.
+NOTIFICATION_DIGEST_WINDOW: float = 0  # seconds
+NOTIFICATION_DIGEST_MAX_MESSAGES: int = 20
+
+# Token bucket limits on contact form submissions, checked before the form is validated.
+# Each client IP, and each submitted email, may submit a burst of up to *_BURST messages,
+# then *_PER_HOUR (*_BURST >= 1, *_PER_HOUR > 0). Over the limit, the client is sent 429 Too Many
+# Requests with Retry-After.
+# Behind a reverse proxy, wrap app.wsgi_app in werkzeug's ProxyFix so the client IP is used.
+CONTACT_RATE_LIMIT_ENABLED: bool = True
+# 'memory' - buckets held by each worker process, or
+# 'sqlite' - held in the contact database, shared by worker processes.
+CONTACT_RATE_LIMIT_BACKEND: str = 'memory'
+CONTACT_RATE_LIMIT_IP_BURST: int = 5
+CONTACT_RATE_LIMIT_IP_PER_HOUR: float = 10
+CONTACT_RATE_LIMIT_EMAIL_BURST: int = 3
+CONTACT_RATE_LIMIT_EMAIL_PER_HOUR: float = 5
+
+# Skip storing and notifying of a message whose email and text (ignoring case and
+# whitespace) match one received in the last CONTACT_DEDUPE_WINDOW seconds.
+# Each worker remembers up to CONTACT_DEDUPE_CACHE_SIZE recent messages, and checks
+# the database for those received by other workers.
+CONTACT_DEDUPE_ENABLED: bool = True
+CONTACT_DEDUPE_WINDOW: float = 24 * 60 * 60  # seconds
+CONTACT_DEDUPE_CACHE_SIZE: int = 10000  # messages
+
 BLOG_URL: str = 'https://some.blog.url'
+
+# Read and search stored messages at /inbox/api/messages and /inbox/api/search,
+# with header `Authorization: Bearer <token>`.
+# Keep the token in app_config.py. None disables the inbox.
+INBOX_API_TOKEN: str | None = None
+INBOX_PAGE_SIZE: int = 50  # messages
+INBOX_MAX_PAGE_SIZE: int = 500  # messages
+
+# Serve home/projects/about pages from an in-process cache of rendered pages.
+PAGE_CACHE_ENABLED: bool = True
+PAGE_CACHE_MAX_AGE: int = 5 * 60  # seconds browsers may reuse a page before revalidating.
+
+# Serve static files precompressed by `flask compress-static`, compress static-content (PAGE_CACHE) pages.
+COMPRESSION_ENABLED: bool = True
+COMPRESSION_MIN_SIZE: int = 500  # bytes, smaller responses are sent uncompressed.
+
+# Inline the rules of style.css each page uses, load the rest after first paint,
+# and add preload hints for the images each page shows.
+CRITICAL_CSS_ENABLED: bool = True
+
+# Send pages' preloads and stylesheets as Link headers, and as 103 Early Hints where
+# the server provides a wsgi.early_hints callable.
+PRELOAD_LINK_HEADERS_ENABLED: bool = True
+
+# Add content hashes to static file URLs, eg style.css?v=0123456789ab, and let browsers
+# cache them for STATIC_IMMUTABLE_MAX_AGE without revalidating. Restart after changing static files.
+STATIC_FINGERPRINT_ENABLED: bool = True
+STATIC_IMMUTABLE_MAX_AGE: int = 365 * 24 * 60 * 60  # seconds
+
+# Cache compiled templates on disk, shared by workers. None uses a directory in the system temp dir.
+TEMPLATE_BYTECODE_CACHE_ENABLED: bool = True
+TEMPLATE_BYTECODE_CACHE_DIR: str | None = None
+# Compile templates and render static pages in create_app, before the worker accepts traffic.
+WARM_UP_ON_STARTUP: bool = False
+
+# Record request latency and time spent rendering templates, in the database and sending
+# notifications, served in Prometheus format at /metrics. Each worker process reports its own.
+METRICS_ENABLED: bool = True
+# Prometheus scrapes /metrics with header `Authorization: Bearer <token>`.
+# Keep the token in app_config.py. None serves no /metrics, metrics are still recorded.
+METRICS_TOKEN: str | None = None
+# Send each request's stage timings to the client in a Server-Timing header. They reveal
+# internals, eg database time, to anyone, so only enable for local profiling.
+SERVER_TIMING_ENABLED: bool = False
@@ -0,0 +1,150 @@
+""" Link preload headers, and 103 Early Hints, from pages' preload hints. """
+import re
+
+from html.parser import HTMLParser
+
+from flask import (current_app,
+                   Flask,
+                   request,
+                   Response,
+                   )
+
+from .compression import is_plain_html
+
+# <link> attributes carried over to Link header parameters.
+LINK_PARAMETERS: tuple[str, ...] = ('as', 'type', 'imagesrcset', 'imagesizes', 'crossorigin')
+
+_TOKEN = re.compile(r"[!#$%&'*+.^_`|~0-9A-Za-z-]+")
+
+
+def _parameter_value(value: str) -> str:
+    """
+    Link header parameter value, quoted unless a token.
+
+    :param value: str
+    :return: str
+    """
+    if _TOKEN.fullmatch(value):
+        return value
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class PreloadScanner(HTMLParser):
+    """
+    Collect Link header values for a page's preload and stylesheet <link>s.
+
+    Deferred stylesheets, eg those critical_css loads after first paint
+    with media="print" or in <noscript>, are not preloaded, which would
+    fetch them ahead of what the page needs to render.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.links: list[str] = []
+        self._head_ended: bool = False
+        self._in_noscript: bool = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag == 'noscript':
+            self._in_noscript = True
+        if tag != 'link' or self._head_ended:  # Preloads only take effect from <head>.
+            return
+        attributes = dict(attrs)
+        rel = (attributes.get('rel') or '').split()
+        if 'stylesheet' in rel:
+            if self._in_noscript or (attributes.get('media') or 'all') not in ('all', 'screen'):
+                return
+            attributes['as'] = 'style'
+        elif 'preload' not in rel:
+            return
+        # Preloads by srcset alone need a URL, browsers not supporting imagesrcset fetch it.
+        href = attributes.get('href') or (attributes.get('imagesrcset') or '').split(' ', 1)[0]
+        if not href:
+            return
+        parameters = ''.join(f'; {name}={_parameter_value(attributes[name])}'  # type: ignore[arg-type]
+                             for name in LINK_PARAMETERS if attributes.get(name))
+        link = f'<{href}>; rel=preload{parameters}'
+        if link not in self.links:  # Eg stylesheet in <noscript> too.
+            self.links.append(link)
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'head':
+            self._head_ended = True
+        elif tag == 'noscript':
+            self._in_noscript = False
+
+
+def page_links(html: str) -> tuple[str, ...]:
+    """
+    Link header values preloading what page's <head> preloads or links as stylesheets.
+
+    :param html: str page
+    :return: tuple of str
+    """
+    scanner = PreloadScanner()
+    scanner.feed(html)
+    return tuple(scanner.links)
+
+
+def add_link_headers(response: Response) -> Response:
+    """
+    Add Link preload headers to HTML responses.
+
+    An endpoint's links are read from the first page it serves, then
+    remembered for its later responses and send_early_hints. Views
+    render the same <head> each request, so the rest of a page, eg the
+    contact page's CSRF token, need not be parsed again.
+
+    Registered as an after_request function, between critical_css (which
+    generates preloads) and compression.
+
+    :param response: Response
+    :return: Response
+    """
+    if not is_plain_html(response):
+        return response
+    links: dict[str, tuple[str, ...]] = current_app.extensions['early_hints']
+    if (page := links.get(request.endpoint or '')) is None:
+        page = page_links(response.get_data(as_text=True))
+        if request.endpoint:
+            links[request.endpoint] = page
+    for link in page:
+        response.headers.add('Link', link)
+    return response
+
+
+def send_early_hints() -> None:
+    """
+    Send 103 Early Hints with the endpoint's Link headers, if the server
+    supports it, so clients fetch them while the page is generated.
+
+    Servers offer early hints via a wsgi.early_hints callable in the WSGI
+    environ, called with a list of (header, value). Endpoints' links are
+    known once they have served a page.
+
+    Registered as a before_request function.
+
+    :return: None
+    """
+    early_hints = request.environ.get('wsgi.early_hints')
+    if not callable(early_hints) or request.method != 'GET':
+        return
+    if links := current_app.extensions['early_hints'].get(request.endpoint):
+        early_hints([('Link', link) for link in links])
+
+
+def init_app(app: Flask) -> None:
+    """
+    Add Link preload headers and early hints, if PRELOAD_LINK_HEADERS_ENABLED.
+
+    Call after compression.init_app and before critical_css.init_app, as
+    after_request functions run in reverse order of registration.
+
+    :param app: Flask
+    :return: None
+    """
+    # Endpoint: its pages' Link header values, see add_link_headers.
+    app.extensions['early_hints'] = {}
+    if app.config['PRELOAD_LINK_HEADERS_ENABLED']:
+        app.before_request(send_early_hints)
+        app.after_request(add_link_headers)
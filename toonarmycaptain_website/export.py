@@ -0,0 +1,121 @@
+""" Export GET pages and static files as a static site, for a plain file server or CDN. """
+import shutil
+
+from html import escape
+from pathlib import Path
+
+import click
+
+from flask import current_app, Flask
+from flask.cli import with_appcontext
+
+from .compression import precompress_static
+
+# Endpoints that must stay dynamic, served by the app.
+DYNAMIC_ENDPOINTS: set[str] = {'my_site.contact', 'inbox.messages', 'inbox.search', 'metrics'}
+
+# Redirect rules, in the _redirects format read by Netlify and Cloudflare Pages.
+REDIRECTS_FILENAME: str = '_redirects'
+
+REDIRECT_STUB = ('<!doctype html>\n'
+                 '<html lang="en-GB">\n'
+                 '<head>\n'
+                 '    <meta charset="utf-8">\n'
+                 '    <meta http-equiv="refresh" content="0; url={location}">\n'
+                 '    <link rel="canonical" href="{location}">\n'
+                 '    <title>Redirecting to {location}</title>\n'
+                 '</head>\n'
+                 '<body><a href="{location}">{location}</a></body>\n'
+                 '</html>\n')
+
+
+def exportable_paths(app: Flask) -> list[str]:
+    """
+    Paths of app's GET routes that render the same response for every request.
+
+    Routes with URL arguments (eg static) and DYNAMIC_ENDPOINTS are excluded.
+
+    :param app: Flask
+    :return: list of str paths.
+    """
+    return sorted(rule.rule for rule in app.url_map.iter_rules()
+                  if 'GET' in (rule.methods or ())
+                  and not rule.arguments
+                  and rule.endpoint not in DYNAMIC_ENDPOINTS)
+
+
+def output_file(output_dir: Path, path: str) -> Path:
+    """
+    File a plain file server would serve for path.
+
+    :param output_dir: Path
+    :param path: str URL path, eg /home/ or /favicon.ico
+    :return: Path - path/index.html for directory-style paths.
+    """
+    relative_path = path.lstrip('/')
+    if not relative_path or path.endswith('/'):
+        return Path(output_dir, relative_path, 'index.html')
+    return Path(output_dir, relative_path)
+
+
+def export_site(app: Flask, output_dir: Path, precompress: bool = True) -> list[tuple[str, int | None, str]]:
+    """
+    Render app's exportable GET routes, and copy its static files, to output_dir.
+
+    200 responses are written as files. Redirects are written as
+    REDIRECTS_FILENAME rules, plus a meta refresh stub page for
+    directory-style paths, for servers that don't read redirect rules.
+    Routes that error are skipped and reported.
+
+    :param app: Flask
+    :param output_dir: Path
+    :param precompress: bool - write .gz/.br siblings of exported files.
+    :return: list of (path, status code or None if view raised, description)
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    client = app.test_client()
+    report: list[tuple[str, int | None, str]] = []
+    redirects = []
+    for path in exportable_paths(app):
+        try:
+            response = client.get(path, headers={'Accept-Encoding': 'identity'})
+        except Exception as error:  # Eg a template that doesn't exist.
+            report.append((path, None, f'skipped, {error!r}'))
+            continue
+        file = output_file(output_dir, path)
+        if response.status_code == 200:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file.write_bytes(response.get_data())
+            report.append((path, 200, str(file.relative_to(output_dir))))
+        elif 300 <= response.status_code < 400:
+            location = response.headers['Location']
+            redirects.append(f'{path} {location} {response.status_code}')
+            if file.name == 'index.html':
+                file.parent.mkdir(parents=True, exist_ok=True)
+                file.write_text(REDIRECT_STUB.format(location=escape(location)))
+            report.append((path, response.status_code, f'redirect to {location}'))
+        else:
+            report.append((path, response.status_code, 'skipped'))
+        response.close()
+    Path(output_dir, REDIRECTS_FILENAME).write_text(''.join(f'{redirect}\n' for redirect in redirects))
+
+    static_url_path = (app.static_url_path or '/static').lstrip('/')
+    shutil.copytree(app.static_folder or '', Path(output_dir, static_url_path), dirs_exist_ok=True)
+    report.append((f'/{static_url_path}/', None, f'copied {app.static_folder}'))
+
+    if precompress:
+        precompress_static(output_dir, min_size=app.config['COMPRESSION_MIN_SIZE'])
+    return report
+
+
+@click.command('export-static')
+@click.argument('output_dir', type=click.Path(file_okay=False, path_type=Path))
+@click.option('--no-precompress', is_flag=True, help='Do not write .gz/.br siblings.')
+@with_appcontext
+def export_static_command(output_dir: Path, no_precompress: bool) -> None:
+    """Pre-render GET pages and copy static files to OUTPUT_DIR."""
+    for path, status, description in export_site(current_app._get_current_object(),  # type: ignore[attr-defined]
+                                                  output_dir,
+                                                  precompress=not no_precompress):
+        click.echo(f'{path} {status or "-"}: {description}')
+    click.echo(f'Dynamic endpoints, serve from the app: {", ".join(sorted(DYNAMIC_ENDPOINTS))}')
@@ -0,0 +1,132 @@
+""" Responsive WebP/AVIF image variants, generated offline by `flask build-images`. """
+import json
+
+from pathlib import Path
+
+import click
+
+from flask import current_app, Flask
+from flask.cli import with_appcontext
+
+# Source images in the static folder, and widths in pixels to generate for each.
+# Widths larger than the source are skipped, images are never upscaled.
+RESPONSIVE_IMAGES: dict[str, tuple[int, ...]] = {
+    'avatar_full.jpg': (64, 128, 256, 379),  # Navbar (2em) and home page (full size).
+    'github_logo.png': (160, 320),  # Contact page, 3em high.
+    'ln_logo_128px.png': (200, 400),  # Contact page, 3em high.
+}
+
+# Formats in order of preference, with Pillow save options.
+IMAGE_FORMATS: dict[str, dict] = {
+    'avif': {'quality': 50},
+    'webp': {'quality': 80, 'method': 6},
+}
+
+# Variants are written to, and indexed in, this static subfolder.
+VARIANTS_FOLDER: str = 'img'
+VARIANTS_INDEX: str = 'variants.json'
+
+
+def build_image_variants(static_folder: Path,
+                         sources: dict[str, tuple[int, ...]] | None = None,
+                         formats: dict[str, dict] | None = None,
+                         ) -> dict[str, dict]:
+    """
+    Write resized, re-encoded variants of source images, and an index of them.
+
+    Requires Pillow. Formats the installed Pillow cannot encode are skipped.
+
+    :param static_folder: Path
+    :param sources: dict of {source filename: widths}, default RESPONSIVE_IMAGES.
+    :param formats: dict of {format: Pillow save options}, default IMAGE_FORMATS.
+    :return: dict index, as written to VARIANTS_INDEX:
+             {source filename: {'width': int, 'height': int, 'bytes': int,
+                                'variants': {format: [{'filename': str, 'width': int, 'bytes': int}, ...]}}}
+    """
+    # Imported here, Pillow is only needed to build images, not to serve them.
+    from PIL import features, Image
+
+    sources = RESPONSIVE_IMAGES if sources is None else sources
+    formats = IMAGE_FORMATS if formats is None else formats
+    encodable_formats = {image_format: options for image_format, options in formats.items()
+                         if features.check(image_format)}
+
+    variants_folder = Path(static_folder, VARIANTS_FOLDER)
+    variants_folder.mkdir(exist_ok=True)
+    index: dict[str, dict] = {}
+    for filename, widths in sources.items():
+        source_path = Path(static_folder, filename)
+        with Image.open(source_path) as source:
+            image = source.convert('RGBA' if 'A' in source.getbands() or source.mode == 'P' else 'RGB')
+        entry: dict = {'width': image.width,
+                       'height': image.height,
+                       'bytes': source_path.stat().st_size,
+                       'variants': {}}
+        for image_format, options in encodable_formats.items():
+            entry['variants'][image_format] = []
+            for width in sorted(width for width in widths if width <= image.width):
+                resized = (image if width == image.width
+                           else image.resize((width, round(image.height * width / image.width)),
+                                             Image.Resampling.LANCZOS))
+                variant_path = Path(variants_folder, f'{source_path.stem}-{width}.{image_format}')
+                resized.save(variant_path, image_format.upper(), **options)
+                entry['variants'][image_format].append(
+                    {'filename': variant_path.relative_to(static_folder).as_posix(),
+                     'width': width,
+                     'bytes': variant_path.stat().st_size})
+        index[filename] = entry
+
+    Path(variants_folder, VARIANTS_INDEX).write_text(json.dumps(index, indent=2, sort_keys=True))
+    return index
+
+
+def load_image_variants(static_folder: Path) -> dict[str, dict]:
+    """
+    Load index of image variants written by build_image_variants.
+
+    :param static_folder: Path
+    :return: dict index, empty if variants have not been built.
+    """
+    try:
+        return json.loads(Path(static_folder, VARIANTS_FOLDER, VARIANTS_INDEX).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def size_report(index: dict[str, dict]) -> list[str]:
+    """
+    Describe bytes saved by each format's largest variant, relative to its source.
+
+    :param index: dict as returned by build_image_variants.
+    :return: list of str lines.
+    """
+    lines = []
+    for filename, entry in index.items():
+        lines.append(f'{filename} ({entry["width"]}x{entry["height"]}): {entry["bytes"]} bytes')
+        for image_format, variants in entry['variants'].items():
+            sizes = ', '.join(f'{variant["width"]}w {variant["bytes"]}' for variant in variants)
+            largest = variants[-1]['bytes'] if variants else entry['bytes']
+            lines.append(f'  {image_format}: {sizes} '
+                         f'({100 * (entry["bytes"] - largest) / entry["bytes"]:.0f}% smaller at largest width)')
+    return lines
+
+
+@click.command('build-images')
+@with_appcontext
+def build_images_command() -> None:
+    """Generate WebP/AVIF variants of RESPONSIVE_IMAGES, and report sizes."""
+    index = build_image_variants(Path(current_app.static_folder or ''))
+    for line in size_report(index):
+        click.echo(line)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Load image variants, for the picture template macro.
+
+    :param app: Flask
+    :return: None
+    """
+    app.config['IMAGE_VARIANTS'] = load_image_variants(Path(app.static_folder or ''))
+    app.add_template_global(app.config['IMAGE_VARIANTS'], 'image_variants')
+    app.cli.add_command(build_images_command)
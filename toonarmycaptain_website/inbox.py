@@ -0,0 +1,137 @@
+""" Token-authenticated JSON API for reading stored contact messages. """
+from typing import Any
+
+from flask import (abort,
+                   Blueprint,
+                   current_app,
+                   Flask,
+                   jsonify,
+                   request,
+                   Response,
+                   url_for,
+                   )
+
+from .auth import require_bearer_token
+
+bp = Blueprint('inbox', __name__, url_prefix='/inbox')
+
+# Query string values accepted for the email_sent/sms_sent filters.
+FLAG_VALUES: dict[str, bool] = {'1': True, 'true': True, '0': False, 'false': False}
+
+
+@bp.before_request
+def require_token() -> None:
+    """
+    Reject requests without `Authorization: Bearer <INBOX_API_TOKEN>`.
+
+    :return: None
+    """
+    require_bearer_token(current_app.config['INBOX_API_TOKEN'])
+
+
+def _flag(name: str) -> bool | None:
+    """
+    Boolean filter from the query string, None if absent.
+
+    :param name: str query string parameter.
+    :return: bool or None
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if value.lower() not in FLAG_VALUES:
+        abort(400, f'{name} must be one of {sorted(FLAG_VALUES)}.')
+    return FLAG_VALUES[value.lower()]
+
+
+def _message_json(row: tuple) -> dict:
+    """
+    JSON representation of a ContactDatabase message row.
+
+    :param row: tuple as returned by ContactDatabase.list_messages
+    :return: dict
+    """
+    message_id, sender_id, name, email, contents, email_sent, sms_sent = row
+    return {'id': message_id,
+            'person': {'id': sender_id, 'name': name, 'email': email},
+            'contents': contents,
+            'email_sent': bool(email_sent),
+            'sms_sent': bool(sms_sent),
+            }
+
+
+def _limit() -> int:
+    """
+    Page size from the query string, INBOX_PAGE_SIZE if absent.
+
+    :return: int
+    """
+    limit = request.args.get('limit', current_app.config['INBOX_PAGE_SIZE'], type=int)
+    if not 1 <= limit <= current_app.config['INBOX_MAX_PAGE_SIZE']:
+        abort(400, f'limit must be between 1 and {current_app.config["INBOX_MAX_PAGE_SIZE"]}.')
+    return limit
+
+
+@bp.route('/api/messages', methods=['GET'])
+def messages() -> Response:
+    """
+    Page of messages, newest first.
+
+    Query string:
+        before - message id, from the previous page's `next` link.
+        limit - messages per page, up to INBOX_MAX_PAGE_SIZE.
+        email_sent, sms_sent - 1/true or 0/false.
+        person_id - messages from one person.
+
+    Responds with {"messages": [...], "next": URL of next page or null}.
+    """
+    before_id = request.args.get('before', type=int)
+    person_id = request.args.get('person_id', type=int)
+    limit = _limit()
+    filters = {'email_sent': _flag('email_sent'),
+               'sms_sent': _flag('sms_sent'),
+               'person_id': person_id,
+               }
+
+    # One extra row shows whether there is a next page.
+    rows = current_app.config['DATABASE'].list_messages(before_id=before_id, limit=limit + 1, **filters)
+    page = [_message_json(row) for row in rows[:limit]]
+    next_url = None
+    if len(rows) > limit:
+        query: dict[str, Any] = {name: int(value) for name, value in filters.items() if value is not None}
+        next_url = url_for('inbox.messages', before=page[-1]['id'], limit=limit, **query)
+    response = jsonify(messages=page, next=next_url)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/api/search', methods=['GET'])
+def search() -> Response:
+    """
+    Messages matching every word of query string parameter q, best match first.
+
+    Query string:
+        q - words to find in messages, or their sender's name or email.
+            A word ending in * matches as a prefix.
+        limit - messages, up to INBOX_MAX_PAGE_SIZE.
+
+    Responds with {"messages": [...]}.
+    """
+    query = request.args.get('q', '')
+    if not query.strip():
+        abort(400, 'q is required.')
+    rows = current_app.config['DATABASE'].search_messages(query, limit=_limit())
+    response = jsonify(messages=[_message_json(row) for row in rows])
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Register inbox API, if INBOX_API_TOKEN is set.
+
+    :param app: Flask
+    :return: None
+    """
+    if app.config['INBOX_API_TOKEN']:
+        app.register_blueprint(bp)
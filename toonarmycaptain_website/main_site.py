@@ -9,6 +9,9 @@ from flask import (current_app as app,
                    )
 from flask_wtf.csrf import CSRFError
 
+from toonarmycaptain_website.page_cache import cached_page
+from toonarmycaptain_website.rate_limit import rate_limited
+
 bp = Blueprint("my_site", __name__)
 
 
@@ -31,12 +34,14 @@ def base_url():
 
 
 @bp.route('/home/', methods=['GET'])
+@cached_page
 def home():
     """Home page."""
     return render_template('home.html')
 
 
 @bp.route('/projects/', methods=['GET'])
+@cached_page
 def projects():
     """Projects page."""
     return render_template('projects.html', methods=['GET'])
@@ -53,16 +58,23 @@ def blog():
 
 
 @bp.route('/contact/', methods=['GET', 'POST'])
+@rate_limited
 def contact():
     """
     Contact form route.
 
-    Saves data to db, sends text message and email.
+    POSTs over the rate limits are rejected with 429 before reaching here.
+
+    Saves data to db, queueing notification email (and SMS if enabled) to be
+    sent by the notification dispatcher, so the request only waits on a
+    local db write.
+    Resubmissions of a recent message, eg double-clicks, are not stored
+    again, but answered as though they were.
     Returns successful message on form validation, error on error.
     """
 
+    from toonarmycaptain_website.contact.dedupe import message_fingerprint
     from toonarmycaptain_website.contact.form import ContactForm
-    from toonarmycaptain_website.contact.email_notification import send_contact_email
 
     form = ContactForm()
 
@@ -70,18 +82,25 @@ def contact():
         'receive/validate format'
         if form.validate_on_submit():
             DATABASE = app.config['DATABASE']
-            'store form contents in databases'
-            message_id = DATABASE.store_contact(name=form.name.data,
+            recent = app.config['CONTACT_RECENT_FINGERPRINTS']
+            fingerprint = message_fingerprint(form.email.data, form.message.data)
+            message_id = None
+            if recent is None or not recent.seen(fingerprint):
+                'store form contents in databases, queue notifications'
+                message_id = DATABASE.store_contact(name=form.name.data,
                                                     email=form.email.data,
-                                                    message=form.message.data)
-            'using async:'
-            '    send myself email'
-            send_contact_email(app,
-                               message_id=message_id,
-                               contact_email=form.email.data,
-                               contact_name=form.name.data,
-                               message_body=form.message.data)
-            '    send myself text message'
+                                                    message=form.message.data,
+                                                    notification_channels=(('email', 'sms')
+                                                                           if app.config['SMS_NOTIFICATIONS_ENABLED']
+                                                                           else ('email',)),
+                                                    fingerprint=fingerprint,
+                                                    duplicate_window=recent.window if recent else 0)
+            if message_id is None:
+                app.logger.info('Duplicate contact submission from %s not stored.', form.email.data)
+            else:
+                if recent is not None:
+                    recent.add(fingerprint)
+                app.config['NOTIFICATION_DISPATCHER'].notify()
 
             flash("success message", 'successful_submission')
             return redirect(url_for('my_site.contact'))
@@ -91,6 +110,7 @@ def contact():
 
 
 @bp.route('/about/', methods=['GET'])
+@cached_page
 def about():
     """About page."""
     return render_template('about.html')
@@ -0,0 +1,272 @@
+""" Request latency and per-stage timings, as Server-Timing headers and Prometheus metrics. """
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Iterator
+
+from flask import (before_render_template,
+                   current_app,
+                   Flask,
+                   g,
+                   has_request_context,
+                   request,
+                   Response,
+                   template_rendered,
+                   )
+from jinja2 import Template
+
+from .auth import require_bearer_token
+
+# Histogram bucket upper bounds, seconds.
+BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Counts of observed values by bucket, with their sum. Not thread-safe, see Metrics."""
+
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        """
+        :param buckets: tuple of float upper bounds, ascending.
+        """
+        self.buckets: tuple[float, ...] = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)  # Last is +Inf.
+        self.sum: float = 0
+
+    def observe(self, value: float) -> None:
+        """
+        :param value: float
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> list[tuple[str, int]]:
+        """
+        Count of values <= each bucket bound, as Prometheus reports them.
+
+        :return: list of (str le label, int count), ending with +Inf.
+        """
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        cumulative, total = [], 0
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Metrics:
+    """
+    Request counts, and histograms of request and stage durations, for
+    this process.
+
+    Each worker process keeps its own metrics, labelled by Prometheus with
+    the scraped instance. One lock guards all updates, held only to add
+    to counts.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (endpoint, method, status): requests
+        self.requests: dict[tuple[str, str, int], int] = {}
+        # (endpoint, method): request durations
+        self.request_durations: dict[tuple[str, str], Histogram] = {}
+        # stage: stage durations
+        self.stage_durations: dict[str, Histogram] = {}
+
+    def observe_request(self, endpoint: str, method: str, status: int, seconds: float) -> None:
+        """
+        :param endpoint: str
+        :param method: str
+        :param status: int
+        :param seconds: float
+        :return: None
+        """
+        with self._lock:
+            self.requests[endpoint, method, status] = self.requests.get((endpoint, method, status), 0) + 1
+            if (endpoint, method) not in self.request_durations:
+                self.request_durations[endpoint, method] = Histogram()
+            self.request_durations[endpoint, method].observe(seconds)
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """
+        Record time spent in a stage, eg db_execute, adding it to the
+        current request's Server-Timing, if in a request.
+
+        Passed to ContactDatabase as its timer.
+
+        :param stage: str - token, no spaces.
+        :param seconds: float
+        :return: None
+        """
+        with self._lock:
+            if stage not in self.stage_durations:
+                self.stage_durations[stage] = Histogram()
+            self.stage_durations[stage].observe(seconds)
+        if has_request_context():
+            spans = g.setdefault('metrics_spans', {})
+            spans[stage] = spans.get(stage, 0) + seconds
+
+    def prometheus(self) -> str:
+        """
+        Metrics in Prometheus text exposition format.
+
+        :return: str
+        """
+        lines = ['# HELP http_requests_total Requests served, by endpoint, method and status.',
+                 '# TYPE http_requests_total counter']
+        with self._lock:
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",method="{method}",'
+                             f'status="{status}"}} {count}')
+            lines += ['# HELP http_request_duration_seconds Time to serve requests, by endpoint and method.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for (endpoint, method), histogram in sorted(self.request_durations.items()):
+                lines += _histogram_lines('http_request_duration_seconds',
+                                          f'endpoint="{_label(endpoint)}",method="{method}"', histogram)
+            lines += ['# HELP stage_duration_seconds Time spent in stages of handling requests and '
+                      'notifications, eg template rendering, database access.',
+                      '# TYPE stage_duration_seconds histogram']
+            for stage, histogram in sorted(self.stage_durations.items()):
+                lines += _histogram_lines('stage_duration_seconds', f'stage="{_label(stage)}"', histogram)
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value: str) -> str:
+    """
+    Prometheus label value, escaped.
+
+    :param value: str
+    :return: str
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list[str]:
+    """
+    :param name: str metric name.
+    :param labels: str formatted labels, without braces.
+    :param histogram: Histogram
+    :return: list of str sample lines.
+    """
+    lines = [f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+             for bound, count in histogram.cumulative_counts()]
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {sum(histogram.counts)}')
+    return lines
+
+
+@contextmanager
+def span(app: Flask, stage: str) -> Iterator[None]:
+    """
+    Time the enclosed code as stage, if app records metrics.
+
+    :param app: Flask
+    :param stage: str
+    :return: Iterator[None]
+    """
+    metrics: Metrics | None = app.config.get('METRICS')
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe_stage(stage, time.perf_counter() - start)
+
+
+def start_timer() -> None:
+    """
+    Note request's start time.
+
+    Registered as a before_request function, first, so timing includes
+    other before_request functions.
+
+    :return: None
+    """
+    g.metrics_start = time.perf_counter()
+
+
+def _template_started(app: Flask, template: Template, context: dict) -> None:
+    """
+    Note template render's start time, on the before_render_template signal.
+
+    :param app: Flask
+    :param template: Template
+    :param context: dict
+    :return: None
+    """
+    g.setdefault('metrics_template_starts', []).append(time.perf_counter())
+
+
+def _template_rendered(app: Flask, template: Template, context: dict) -> None:
+    """
+    Record template render's duration, on the template_rendered signal.
+
+    :param app: Flask
+    :param template: Template
+    :param context: dict
+    :return: None
+    """
+    if starts := g.get('metrics_template_starts'):
+        app.config['METRICS'].observe_stage('template', time.perf_counter() - starts.pop())
+
+
+def record_request(response: Response) -> Response:
+    """
+    Record request's duration, and add a Server-Timing header of its stages.
+
+    Registered as an after_request function, first, so runs after the
+    others and timing includes them, eg compression.
+
+    :param response: Response
+    :return: Response
+    """
+    if (start := g.get('metrics_start')) is None:
+        return response
+    seconds = time.perf_counter() - start
+    current_app.config['METRICS'].observe_request(request.endpoint or 'unmatched', request.method,
+                                                  response.status_code, seconds)
+    if current_app.config['SERVER_TIMING_ENABLED']:
+        timings = [f'{stage};dur={stage_seconds * 1000:.2f}'
+                   for stage, stage_seconds in g.get('metrics_spans', {}).items()]
+        response.headers['Server-Timing'] = ', '.join([*timings, f'total;dur={seconds * 1000:.2f}'])
+    return response
+
+
+def metrics_endpoint() -> Response:
+    """
+    This process's metrics, for Prometheus to scrape with header
+    `Authorization: Bearer <METRICS_TOKEN>`.
+
+    :return: Response
+    """
+    require_bearer_token(current_app.config['METRICS_TOKEN'])
+    return Response(current_app.config['METRICS'].prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def init_app(app: Flask) -> None:
+    """
+    Record request and stage timings, if METRICS_ENABLED, serving them at
+    /metrics if METRICS_TOKEN is set.
+
+    Call first of the after_request registering init_app functions, and
+    after the DATABASE is created, to time its connections.
+
+    :param app: Flask
+    :return: None
+    """
+    app.config['METRICS'] = Metrics() if app.config['METRICS_ENABLED'] else None
+    if app.config['METRICS'] is None:
+        return
+    app.config['DATABASE'].timer = app.config['METRICS'].observe_stage
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+    if app.config['METRICS_TOKEN']:
+        app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
@@ -0,0 +1,607 @@
+""" ContactDatabase schema migrations, versioned with PRAGMA user_version. """
+import sqlite3
+import time
+
+from typing import Callable, Sequence
+
+import click
+
+from flask import current_app
+from flask.cli import with_appcontext
+
+# Rows copied per transaction when rebuilding a table online.
+REBUILD_BATCH_SIZE: int = 1000
+
+
+class MigrationError(sqlite3.DatabaseError):
+    """Migration could not be applied, the database is left at the previous version."""
+
+
+class Migration:
+    """
+    Schema change from version - 1 to version, applied in one transaction
+    with the user_version update, so it is applied completely or not at all.
+    """
+
+    def __init__(self, version: int, description: str,
+                 apply: Callable[[sqlite3.Connection, int], None]):
+        """
+        :param version: int - user_version once applied.
+        :param description: str
+        :param apply: Callable taking (connection, message_max_length),
+                      executing the migration's statements.
+        """
+        self.version: int = version
+        self.description: str = description
+        self._apply: Callable[[sqlite3.Connection, int], None] = apply
+
+    def run(self, connection: sqlite3.Connection, message_max_length: int,
+            batch_size: int, pause: float) -> bool:
+        """
+        Apply migration, unless another process applied it first.
+
+        :param connection: sqlite3.Connection - not in a transaction.
+        :param message_max_length: int
+        :param batch_size: int - unused, see TableRebuild.
+        :param pause: float - unused, see TableRebuild.
+        :return: bool True if applied by this call.
+        """
+        # Take the write lock before checking the version, so concurrent workers serialise.
+        connection.execute("""BEGIN IMMEDIATE;""")
+        try:
+            if schema_version(connection) >= self.version:
+                connection.rollback()
+                return False
+            self._apply(connection, message_max_length)
+            connection.execute(f"""PRAGMA user_version={self.version};""")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        return True
+
+
+class TableRebuild(Migration):
+    """
+    Rebuild a table with a new definition, eg to change its constraints,
+    which SQLite's ALTER TABLE cannot do, without holding the write lock
+    for the whole copy.
+
+    Rows are copied into a shadow table in batches of batch_size, each its
+    own short transaction, while triggers on the table mirror concurrent
+    writes into the shadow table. A final transaction swaps the shadow
+    table in, creates its indexes, and records the new version.
+    An interrupted rebuild restarts from the beginning when run again;
+    one that fails drops the shadow table and triggers, so writes to the
+    table are unaffected.
+    """
+
+    def __init__(self, version: int, description: str, table: str,
+                 columns: Sequence[str], definition: str, indexes: Sequence[str] = ()):
+        """
+        :param version: int
+        :param description: str
+        :param table: str - table name, and shadow table prefix.
+        :param columns: Sequence of str columns copied, first is the INTEGER
+                        PRIMARY KEY.
+        :param definition: str CREATE TABLE statement, with {table} for the
+                           table name.
+        :param indexes: Sequence of str CREATE INDEX statements for the
+                        rebuilt table.
+        """
+        super().__init__(version, description, apply=lambda connection, message_max_length: None)
+        self.table: str = table
+        self.shadow_table: str = f'{table}_rebuild'
+        self.columns: tuple[str, ...] = tuple(columns)
+        self.definition: str = definition
+        self.indexes: tuple[str, ...] = tuple(indexes)
+
+    def run(self, connection: sqlite3.Connection, message_max_length: int,
+            batch_size: int, pause: float) -> bool:
+        """
+        Rebuild table, unless another process rebuilt it first.
+
+        :param connection: sqlite3.Connection - not in a transaction.
+        :param message_max_length: int
+        :param batch_size: int rows copied per transaction.
+        :param pause: float seconds between batches, letting other writers in.
+        :return: bool True if rebuilt by this call.
+        """
+        try:
+            if not self._start(connection):
+                return False
+            last_id = self._copy_batch(connection, 0, batch_size)
+            while last_id is not None:
+                time.sleep(pause)
+                last_id = self._copy_batch(connection, last_id, batch_size)
+            return self._swap(connection)
+        except BaseException:
+            connection.rollback()
+            self._abandon(connection)
+            raise
+
+    def _start(self, connection: sqlite3.Connection) -> bool:
+        """
+        Create shadow table, and triggers mirroring writes into it.
+
+        :param connection: sqlite3.Connection
+        :return: bool False if already rebuilt.
+        """
+        columns = ', '.join(self.columns)
+        new_values = ', '.join(f'NEW.{column}' for column in self.columns)
+        connection.execute("""BEGIN IMMEDIATE;""")
+        if schema_version(connection) >= self.version:
+            connection.rollback()
+            return False
+        connection.execute(self.definition.format(table=f'IF NOT EXISTS {self.shadow_table}'))
+        for event in ('INSERT', 'UPDATE'):
+            connection.execute(
+                f"""CREATE TRIGGER IF NOT EXISTS {self.shadow_table}_{event.lower()}
+                    AFTER {event} ON {self.table}
+                    BEGIN
+                        INSERT OR REPLACE INTO {self.shadow_table}({columns})
+                        VALUES({new_values});
+                    END;
+                    """)
+        connection.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {self.shadow_table}_delete
+                AFTER DELETE ON {self.table}
+                BEGIN
+                    DELETE FROM {self.shadow_table} WHERE {self.columns[0]}=OLD.{self.columns[0]};
+                END;
+                """)
+        connection.commit()
+        return True
+
+    def _copy_batch(self, connection: sqlite3.Connection, after_id: int, batch_size: int) -> int | None:
+        """
+        Copy the next batch of rows into the shadow table.
+
+        Rows already written by the triggers are newer, so are kept.
+
+        :param connection: sqlite3.Connection
+        :param after_id: int - copy rows with a greater primary key.
+        :param batch_size: int
+        :return: int last primary key copied, or None if no rows remained.
+        """
+        key, columns = self.columns[0], ', '.join(self.columns)
+        connection.execute("""BEGIN IMMEDIATE;""")
+        if schema_version(connection) >= self.version:  # Swapped in by another process.
+            connection.rollback()
+            return None
+        last_id = connection.execute(
+            f"""SELECT max({key}) FROM (SELECT {key}
+                                        FROM {self.table}
+                                        WHERE {key} > ?
+                                        ORDER BY {key}
+                                        LIMIT ?);
+                """, (after_id, batch_size)).fetchone()[0]
+        if last_id is not None:
+            # Not INSERT OR IGNORE, which would skip rows failing the new CHECKs too.
+            connection.execute(
+                f"""INSERT INTO {self.shadow_table}({columns})
+                    SELECT {columns}
+                    FROM {self.table}
+                    WHERE {key} > ? AND {key} <= ?
+                      AND {key} NOT IN (SELECT {key}
+                                        FROM {self.shadow_table}
+                                        WHERE {key} > ? AND {key} <= ?);
+                    """, (after_id, last_id, after_id, last_id))
+        connection.commit()
+        return last_id
+
+    def _swap(self, connection: sqlite3.Connection) -> bool:
+        """
+        Replace table with the shadow table, and record the new version.
+
+        Foreign keys are disabled on the connection while the table is
+        dropped, as rows referencing it are kept, and checked before
+        committing. Legacy ALTER TABLE behaviour skips checking views and
+        triggers naming the table while it is dropped; the table's own
+        triggers, other than the rebuild's, are recreated.
+
+        :param connection: sqlite3.Connection
+        :return: bool False if swapped in by another process.
+        """
+        connection.execute("""PRAGMA foreign_keys=OFF;""")
+        connection.execute("""PRAGMA legacy_alter_table=ON;""")
+        try:
+            connection.execute("""BEGIN IMMEDIATE;""")
+            if schema_version(connection) >= self.version:
+                connection.rollback()
+                return False
+            # Keep AUTOINCREMENT's high water mark, so ids of deleted rows aren't reused.
+            connection.execute(
+                """UPDATE sqlite_sequence
+                   SET seq=(SELECT seq FROM sqlite_sequence WHERE name=?)
+                   WHERE name=?;
+                   """, (self.table, self.shadow_table))
+            triggers = connection.execute(
+                """SELECT sql
+                   FROM sqlite_master
+                   WHERE type='trigger' AND tbl_name=? AND name NOT LIKE ?;
+                   """, (self.table, f'{self.shadow_table}%')).fetchall()
+            connection.execute(f"""DROP TABLE {self.table};""")
+            connection.execute(f"""ALTER TABLE {self.shadow_table} RENAME TO {self.table};""")
+            for statement, in triggers:
+                connection.execute(statement)
+            for index in self.indexes:
+                connection.execute(index)
+            if violations := connection.execute("""PRAGMA foreign_key_check;""").fetchall():
+                raise MigrationError(f'Rebuilding {self.table} breaks foreign keys: {violations}')
+            connection.execute(f"""PRAGMA user_version={self.version};""")
+            connection.commit()
+        finally:
+            connection.rollback()  # No-op once committed.
+            connection.execute("""PRAGMA legacy_alter_table=OFF;""")
+            connection.execute("""PRAGMA foreign_keys=ON;""")
+        return True
+
+    def _abandon(self, connection: sqlite3.Connection) -> None:
+        """
+        Drop shadow table and its triggers.
+
+        :param connection: sqlite3.Connection
+        :return: None
+        """
+        if schema_version(connection) >= self.version:  # Nothing left to drop.
+            return
+        for event in ('insert', 'update', 'delete'):
+            connection.execute(f"""DROP TRIGGER IF EXISTS {self.shadow_table}_{event};""")
+        connection.execute(f"""DROP TABLE IF EXISTS {self.shadow_table};""")
+        connection.commit()
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    """
+    Database's schema version, 0 if new.
+
+    :param connection: sqlite3.Connection
+    :return: int
+    """
+    return connection.execute("""PRAGMA user_version;""").fetchone()[0]
+
+
+def add_missing_columns(connection: sqlite3.Connection, table: str, columns: dict[str, str]) -> bool:
+    """
+    Add columns missing from a table created by an earlier version.
+
+    :param connection: sqlite3.Connection
+    :param table: str - table name, not user input.
+    :param columns: dict of column name: column definition
+    :return: bool True if any columns were added.
+    """
+    existing = {row[1] for row in connection.execute(f"""PRAGMA table_info({table});""")}
+    missing = {name: definition for name, definition in columns.items() if name not in existing}
+    for name, definition in missing.items():
+        connection.execute(f"""ALTER TABLE {table} ADD COLUMN {name} {definition};""")
+    return bool(missing)
+
+
+def _create_tables(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 1: create tables, or complete those created before versioning.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS person(
+                 -- primary key must be INTEGER not INT, NOT NULL is implicit.
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 name TEXT NOT NULL CHECK(typeof("name") = 'text' AND
+                                          length("name") <= 255
+                                          ),
+                 email TEXT UNIQUE NOT NULL CHECK(typeof("name") = 'text' AND
+                                                  length("name") <= 255
+                                                  ),
+                 alternate_names TEXT CHECK(typeof("name") = 'text' AND
+                                            length("name") <= 510
+                                            )
+                 );
+                 """)
+    connection.execute(
+        f"""CREATE TABLE IF NOT EXISTS message(
+                 -- primary key must be INTEGER not INT, NOT NULL is implicit.
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 person_id INTEGER NOT NULL,
+                 contents TEXT NOT NULL CHECK(typeof("contents") = 'text' AND
+                                              length("contents") <= {message_max_length}
+                                              ),
+                 email_sent BOOLEAN NOT NULL CHECK(email_sent IN (0,1)) DEFAULT 0, -- Default False,
+                 sms_sent BOOLEAN NOT NULL CHECK(sms_sent IN (0,1)) DEFAULT 0,     -- Stored as 1,0.
+                 FOREIGN KEY (person_id) REFERENCES person(id)
+                 );
+                 """)
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS outbox(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 message_id INTEGER NOT NULL,
+                 channel TEXT NOT NULL CHECK(channel IN ('email', 'sms')),
+                 created_at REAL NOT NULL,
+                 claimed_at REAL,
+                 FOREIGN KEY (message_id) REFERENCES message(id)
+                 );
+                 """)
+    # Emails that failed before retries were recorded are not retried, they may be
+    # years old. Resend them with: flask retry-unsent-emails
+    add_missing_columns(connection, 'message', {
+        'email_attempts': 'INTEGER NOT NULL DEFAULT 0',
+        'email_last_error': 'TEXT',
+        'email_next_attempt_at': 'REAL',
+    })
+    # Partial index: only unsent messages are scanned for retries, so
+    # the index stays small however many sent messages accumulate.
+    connection.execute(
+        """CREATE INDEX IF NOT EXISTS message_email_retry_idx
+           ON message(email_next_attempt_at)
+           WHERE email_sent=0;
+           """)
+
+
+def _create_person_alias(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 3: move person.alternate_names into person_alias rows.
+
+    The primary key is the unique index on (person_id, name), so adding an
+    alias is an indexed INSERT OR IGNORE, and a person's aliases one range scan.
+    Names were joined with ', ', so names containing it are split.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS person_alias(
+                 person_id INTEGER NOT NULL,
+                 name TEXT NOT NULL CHECK(typeof(name) = 'text' AND
+                                          length(name) <= 255
+                                          ),
+                 PRIMARY KEY (person_id, name),
+                 FOREIGN KEY (person_id) REFERENCES person(id)
+                 ) WITHOUT ROWID;
+                 """)
+    people = connection.execute(
+        """SELECT id, name, alternate_names
+           FROM person
+           WHERE alternate_names IS NOT NULL;
+           """)
+    connection.executemany(
+        """INSERT OR IGNORE INTO person_alias(person_id, name)
+           VALUES(?,?);
+           """, ((person_id, alias.strip())
+                 for person_id, name, alternate_names in people
+                 for alias in alternate_names.split(', ')
+                 if alias.strip() and alias.strip() != name))
+
+
+def _create_inbox_indexes(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 5: indexes for paging through messages newest first, by filter.
+
+    Index entries end with the rowid, ie message.id, so each index is
+    ordered by id within its key, and a page is a seek and a short scan.
+    Partial indexes only hold unsent messages, so stay small.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    connection.execute(
+        """CREATE INDEX IF NOT EXISTS message_person_idx
+           ON message(person_id);
+           """)
+    for flag in ('email_sent', 'sms_sent'):
+        connection.execute(
+            f"""CREATE INDEX IF NOT EXISTS message_{flag}_unsent_idx
+                ON message(id)
+                WHERE {flag}=0;
+                """)
+
+
+def fts5_available(connection: sqlite3.Connection) -> bool:
+    """
+    Whether SQLite was compiled with the FTS5 full-text search extension.
+
+    :param connection: sqlite3.Connection
+    :return: bool
+    """
+    return ('ENABLE_FTS5',) in connection.execute("""PRAGMA compile_options;""").fetchall()
+
+
+def _create_message_search(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 6: full-text index of messages' contents, and senders' name and email.
+
+    An FTS5 external content table, indexing rows of the message_search_source
+    view rather than storing another copy of each message. Triggers keep the
+    index in step with message and person; an external content index
+    removes a row by being given the values it indexed.
+    Existing messages are indexed in this migration's transaction.
+    Skipped if SQLite lacks FTS5, ContactDatabase.search_messages then uses LIKE.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    if not fts5_available(connection):
+        return
+    connection.execute(
+        """CREATE VIEW IF NOT EXISTS message_search_source AS
+           SELECT message.id, message.contents, person.name, person.email
+           FROM message
+           JOIN person ON person.id = message.person_id;
+           """)
+    connection.execute(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+               contents, name, email,
+               content='message_search_source', content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2'
+               );
+               """)
+    index_message = """INSERT INTO message_search(rowid, contents, name, email)
+                       SELECT NEW.id, NEW.contents, person.name, person.email
+                       FROM person
+                       WHERE person.id = NEW.person_id;"""
+    unindex_message = """INSERT INTO message_search(message_search, rowid, contents, name, email)
+                         SELECT 'delete', OLD.id, OLD.contents, person.name, person.email
+                         FROM person
+                         WHERE person.id = OLD.person_id;"""
+    for name, event, statements in (
+            ('message_search_insert', 'AFTER INSERT ON message', [index_message]),
+            ('message_search_delete', 'AFTER DELETE ON message', [unindex_message]),
+            # Not on every update, eg email_sent/sms_sent.
+            ('message_search_update', 'AFTER UPDATE OF contents, person_id ON message',
+             [unindex_message, index_message]),
+    ):
+        connection.execute(f"""CREATE TRIGGER IF NOT EXISTS {name} {event}
+                               BEGIN
+                                   {' '.join(statements)}
+                               END;""")
+    # Only when changed, store_person's upsert "updates" name to itself.
+    connection.execute(
+        """CREATE TRIGGER IF NOT EXISTS message_search_person_update
+           AFTER UPDATE OF name, email ON person
+           WHEN OLD.name IS NOT NEW.name OR OLD.email IS NOT NEW.email
+           BEGIN
+               INSERT INTO message_search(message_search, rowid, contents, name, email)
+               SELECT 'delete', message.id, message.contents, OLD.name, OLD.email
+               FROM message
+               WHERE message.person_id = OLD.id;
+               INSERT INTO message_search(rowid, contents, name, email)
+               SELECT message.id, message.contents, NEW.name, NEW.email
+               FROM message
+               WHERE message.person_id = NEW.id;
+           END;
+           """)
+    connection.execute("""INSERT INTO message_search(message_search) VALUES('rebuild');""")
+
+
+def _create_rate_limit(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 7: token buckets of the contact form's rate limits, shared by workers.
+
+    full_at is when a bucket will have refilled, after which it behaves
+    as a new bucket and its row is deleted, found by its index.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    connection.execute(
+        """CREATE TABLE IF NOT EXISTS rate_limit(
+               key TEXT PRIMARY KEY,
+               tokens REAL NOT NULL,
+               updated_at REAL NOT NULL,
+               full_at REAL NOT NULL
+               ) WITHOUT ROWID;
+               """)
+    connection.execute(
+        """CREATE INDEX IF NOT EXISTS rate_limit_full_at_idx
+           ON rate_limit(full_at);
+           """)
+
+
+def _add_message_fingerprint(connection: sqlite3.Connection, message_max_length: int) -> None:
+    """
+    Version 8: record when messages are received, and their content fingerprint.
+
+    Indexed by (fingerprint, received_at), so a recent duplicate is found
+    by one index seek. Earlier messages have neither, so are not indexed.
+
+    :param connection: sqlite3.Connection
+    :param message_max_length: int
+    :return: None
+    """
+    add_missing_columns(connection, 'message', {
+        'fingerprint': 'BLOB',
+        'received_at': 'REAL',
+    })
+    connection.execute(
+        """CREATE INDEX IF NOT EXISTS message_fingerprint_idx
+           ON message(fingerprint, received_at)
+           WHERE fingerprint IS NOT NULL;
+           """)
+
+
+# In version order, each applied to databases at an earlier version.
+MIGRATIONS: list[Migration] = [
+    Migration(1, 'Create person, message and outbox tables.', _create_tables),
+    TableRebuild(
+        2, "Check person's email and alternate_names, rather than name repeatedly.",
+        table='person',
+        columns=('id', 'name', 'email', 'alternate_names'),
+        # alternate_names grows with each new name submitted, so its length is unchecked.
+        definition="""CREATE TABLE {table}(
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          name TEXT NOT NULL CHECK(typeof(name) = 'text' AND
+                                                   length(name) <= 255
+                                                   ),
+                          email TEXT UNIQUE NOT NULL CHECK(typeof(email) = 'text' AND
+                                                           length(email) <= 255
+                                                           ),
+                          alternate_names TEXT CHECK(alternate_names IS NULL OR
+                                                     typeof(alternate_names) = 'text'
+                                                     )
+                          );
+                          """),
+    Migration(3, 'Store alternate names as person_alias rows.', _create_person_alias),
+    TableRebuild(
+        4, 'Drop person.alternate_names, replaced by person_alias.',
+        table='person',
+        columns=('id', 'name', 'email'),
+        definition="""CREATE TABLE {table}(
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          name TEXT NOT NULL CHECK(typeof(name) = 'text' AND
+                                                   length(name) <= 255
+                                                   ),
+                          email TEXT UNIQUE NOT NULL CHECK(typeof(email) = 'text' AND
+                                                           length(email) <= 255
+                                                           )
+                          );
+                          """),
+    Migration(5, 'Index messages by person, and unsent messages.', _create_inbox_indexes),
+    Migration(6, 'Full-text index of messages and their senders.', _create_message_search),
+    Migration(7, "Store contact form rate limits' token buckets.", _create_rate_limit),
+    Migration(8, 'Add message received_at and content fingerprint.', _add_message_fingerprint),
+]
+
+# Version of a database with all MIGRATIONS applied.
+SCHEMA_VERSION: int = MIGRATIONS[-1].version
+
+
+def migrate(connection: sqlite3.Connection, message_max_length: int,
+            batch_size: int = REBUILD_BATCH_SIZE, pause: float = 0,
+            migrations: Sequence[Migration] = MIGRATIONS) -> list[int]:
+    """
+    Apply migrations newer than the database's user_version, in order.
+
+    Reads only the database header when already current. Databases at a
+    newer version, migrated by a newer release, are left unchanged.
+
+    :param connection: sqlite3.Connection - not in a transaction.
+    :param message_max_length: int
+    :param batch_size: int rows copied per transaction by table rebuilds.
+    :param pause: float seconds between table rebuild batches.
+    :param migrations: Sequence of Migration, in version order.
+    :return: list of int versions applied.
+    """
+    current = schema_version(connection)
+    applied = []
+    for migration in migrations:
+        if migration.version > current and migration.run(connection, message_max_length, batch_size, pause):
+            applied.append(migration.version)
+    return applied
+
+
+@click.command('migrate-db')
+@click.option('--batch-size', type=int, default=REBUILD_BATCH_SIZE, show_default=True,
+              help='Rows copied per transaction when rebuilding a table.')
+@click.option('--pause', type=float, default=0, show_default=True,
+              help='Seconds between batches, letting other workers write.')
+@with_appcontext
+def migrate_database_command(batch_size: int, pause: float) -> None:
+    """Migrate the contact database to the current schema, while workers serve it."""
+    applied = current_app.config['DATABASE'].migrate(batch_size=batch_size, pause=pause)
+    click.echo(f'Applied schema versions {applied}.' if applied else 'Schema already current.')
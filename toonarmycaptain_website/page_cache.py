@@ -0,0 +1,103 @@
+""" In-process cache of rendered static-content pages. """
+import functools
+import hashlib
+import threading
+
+from typing import Callable, Hashable
+
+from flask import (current_app as app,
+                   g,
+                   Response,
+                   request,
+                   )
+
+# Config values pages' content depends on, eg via context processors.
+# Included in cache keys, so changing them renders fresh pages.
+PAGE_CACHE_CONFIG_KEYS: tuple[str, ...] = ('BLOG_URL',)
+
+
+class CachedPage:
+    """Rendered page body, and its strong ETag."""
+
+    def __init__(self, body: bytes):
+        """
+        :param body: bytes
+        """
+        self.body: bytes = body
+        self.etag: str = hashlib.sha256(body).hexdigest()[:32]
+
+
+class PageCache:
+    """
+    Rendered pages, keyed by endpoint and the config they depend on.
+
+    Pages live for the life of the process, so a deploy/restart renders
+    fresh pages, as does a change to any of PAGE_CACHE_CONFIG_KEYS.
+    Thread-safe.
+    """
+
+    def __init__(self, max_age: int):
+        """
+        :param max_age: int - seconds browsers may use a page without revalidating.
+        """
+        self.max_age: int = max_age
+        self._pages: dict[Hashable, CachedPage] = {}
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> CachedPage:
+        """
+        Return cached page, rendering and caching it if not cached.
+
+        :param key: Hashable
+        :param render: Callable returning rendered page.
+        :return: CachedPage
+        """
+        if (page := self._pages.get(key)) is None:
+            # Render outside the lock; concurrent first renders are identical.
+            page = CachedPage(render().encode())
+            with self._lock:
+                page = self._pages.setdefault(key, page)
+        return page
+
+    def clear(self) -> None:
+        """
+        Invalidate all cached pages.
+
+        :return: None
+        """
+        with self._lock:
+            self._pages.clear()
+
+
+def cached_page(view: Callable[..., str]) -> Callable[..., Response]:
+    """
+    Serve view's rendered page from the app's PAGE_CACHE.
+
+    View must render the same page for every request to its endpoint.
+    Responses carry a strong ETag, answering matching If-None-Match
+    requests with 304 Not Modified, and a Cache-Control max-age. The
+    request is marked with g.cached_page, as the only pages compressed
+    on the fly, see compression.compress_response.
+
+    :param view: Callable returning rendered page.
+    :return: Callable returning Response.
+    """
+    @functools.wraps(view)
+    def cached_view(*args, **kwargs) -> Response:
+        cache: PageCache | None = app.config['PAGE_CACHE']
+        if cache is None:  # Caching disabled.
+            page = CachedPage(view(*args, **kwargs).encode())
+        else:
+            key = (request.endpoint, *(app.config[config_key] for config_key in PAGE_CACHE_CONFIG_KEYS))
+            page = cache.get_or_render(key, functools.partial(view, *args, **kwargs))
+
+        response = Response(page.body, mimetype='text/html')
+        response.set_etag(page.etag)
+        if cache is not None:
+            response.cache_control.public = True
+            response.cache_control.max_age = cache.max_age
+        response.make_conditional(request)  # Updates response in place.
+        g.cached_page = True
+        return response
+
+    return cached_view
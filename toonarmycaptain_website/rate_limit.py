@@ -0,0 +1,205 @@
+""" Token bucket rate limiting of contact form submissions. """
+import functools
+import hashlib
+import hmac
+import math
+import threading
+import time
+
+from typing import Callable
+
+from flask import (current_app,
+                   Flask,
+                   request,
+                   Response,
+                   )
+
+from .database import ContactDatabase
+from .token_bucket import refill_tokens, wait_for_token
+
+# Limit name: (capacity ie burst size, tokens added per second > 0).
+Limits = dict[str, tuple[float, float]]
+
+# Buckets held by a TokenBucketLimiter before it first forgets full ones.
+FORGET_FULL_MIN_BUCKETS: int = 1000
+
+
+class TokenBucketLimiter:
+    """
+    Token buckets, one per limit and key, held in this process.
+
+    A request takes a token from each of its keys' buckets, eg the
+    client's IP address and the email submitted. Buckets hold up to
+    capacity tokens, so allow bursts, and refill at a steady rate.
+    Buckets that have refilled are forgotten as buckets accumulate.
+
+    Thread-safe. Each worker process keeps its own buckets, see
+    SQLiteTokenBucketLimiter to share them.
+    """
+
+    def __init__(self, limits: Limits, clock: Callable[[], float] = time.monotonic):
+        """
+        :param limits: dict of {limit name: (capacity, tokens per second)}
+        :param clock: Callable returning seconds.
+        """
+        self.limits: Limits = limits
+        self.clock: Callable[[], float] = clock
+        # (limit, key): (tokens, updated_at)
+        self._buckets: dict[tuple[str, str], tuple[float, float]] = {}
+        # Size at which full buckets are next forgotten, doubling with the
+        # buckets kept, so forgetting costs amortised O(1) per acquire.
+        self._forget_at: int = FORGET_FULL_MIN_BUCKETS
+        self._lock = threading.Lock()
+
+    def acquire(self, keys: dict[str, str]) -> float:
+        """
+        Take a token from each key's bucket, if all have one.
+
+        :param keys: dict of {limit name: key}, eg {'ip': '192.0.2.1'}
+        :return: float 0 if allowed, else seconds until it would be.
+        """
+        now = self.clock()
+        with self._lock:
+            if len(self._buckets) >= self._forget_at:
+                self._forget_full(now)
+                self._forget_at = max(FORGET_FULL_MIN_BUCKETS, 2 * len(self._buckets))
+            tokens = {(limit, key): (refill_tokens(*self._buckets[limit, key], now, *self.limits[limit])
+                                     if (limit, key) in self._buckets else self.limits[limit][0])
+                      for limit, key in keys.items()}
+            retry_after = max((wait_for_token(available, *self.limits[limit])
+                               for (limit, _), available in tokens.items()), default=0)
+            if not retry_after:
+                for bucket, available in tokens.items():
+                    self._buckets[bucket] = (available - 1, now)
+            return retry_after
+
+    def _forget_full(self, now: float) -> None:
+        """
+        Drop buckets refilled to capacity, which behave as new buckets.
+
+        Caller must hold self._lock.
+
+        :param now: float
+        :return: None
+        """
+        full = [(limit, key) for (limit, key), (tokens, updated_at) in self._buckets.items()
+                if refill_tokens(tokens, updated_at, now, *self.limits[limit]) >= self.limits[limit][0]]
+        for bucket in full:
+            del self._buckets[bucket]
+
+
+class SQLiteTokenBucketLimiter:
+    """
+    Token buckets held in the contact database, shared by worker processes.
+
+    Each acquire is one short write transaction, see
+    ContactDatabase.take_tokens.
+    """
+
+    def __init__(self, database: ContactDatabase, limits: Limits, clock: Callable[[], float] = time.time):
+        """
+        :param database: ContactDatabase
+        :param limits: dict of {limit name: (capacity, tokens per second)}
+        :param clock: Callable returning seconds, the same across processes.
+        """
+        self.database: ContactDatabase = database
+        self.limits: Limits = limits
+        self.clock: Callable[[], float] = clock
+
+    def acquire(self, keys: dict[str, str]) -> float:
+        """
+        Take a token from each key's bucket, if all have one.
+
+        :param keys: dict of {limit name: key}, eg {'ip': '192.0.2.1'}
+        :return: float 0 if allowed, else seconds until it would be.
+        """
+        return self.database.take_tokens({f'{limit}:{key}': self.limits[limit] for limit, key in keys.items()},
+                                         now=self.clock())
+
+
+def too_many_requests(retry_after: float) -> Response:
+    """
+    429 response, with Retry-After in whole seconds.
+
+    :param retry_after: float seconds
+    :return: Response
+    """
+    seconds = max(1, math.ceil(retry_after))
+    return Response(f'Too many submissions, please try again in {seconds} seconds.', 429,
+                    {'Retry-After': str(seconds)}, mimetype='text/plain')
+
+
+def pseudonym(value: str, secret_key: str | bytes) -> str:
+    """
+    Short keyed hash of value, eg a client IP, to log in its place.
+
+    Repeat offenders can be told apart in the log, without it holding
+    their IP addresses or emails. Keyed, so the small space of IPv4
+    addresses can't be hashed to reverse it.
+
+    :param value: str
+    :param secret_key: str or bytes, eg the app's SECRET_KEY.
+    :return: str of 12 hex digits.
+    """
+    key = secret_key.encode() if isinstance(secret_key, str) else secret_key
+    return hmac.new(key, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def rate_limited(view: Callable) -> Callable:
+    """
+    Decorator limiting a view's POSTs by client IP and submitted email.
+
+    Checked before the view runs, so rejected submissions cost no form
+    validation or database writes. The email is read as submitted,
+    before validation, lower-cased.
+
+    :param view: Callable
+    :return: Callable
+    """
+    @functools.wraps(view)
+    def wrapped(*args, **kwargs):
+        limiter = current_app.config['CONTACT_RATE_LIMITER']
+        if limiter is None or request.method != 'POST':
+            return view(*args, **kwargs)
+        keys = {'ip': request.remote_addr or 'unknown'}
+        if email := request.form.get('email', '').strip().lower():
+            keys['email'] = email
+        if retry_after := limiter.acquire(keys):
+            secret_key = current_app.config['SECRET_KEY']
+            current_app.logger.info('Contact submission rate limited: %s',
+                                    ' '.join(f'{limit}={pseudonym(key, secret_key)}' for limit, key in keys.items()))
+            return too_many_requests(retry_after)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def init_app(app: Flask) -> None:
+    """
+    Create CONTACT_RATE_LIMITER, if CONTACT_RATE_LIMIT_ENABLED.
+
+    Call after the DATABASE is created.
+
+    :param app: Flask
+    :return: None
+    """
+    limits = {}
+    for limit in ('ip', 'email'):
+        burst = app.config[f'CONTACT_RATE_LIMIT_{limit.upper()}_BURST']
+        per_hour = app.config[f'CONTACT_RATE_LIMIT_{limit.upper()}_PER_HOUR']
+        if app.config['CONTACT_RATE_LIMIT_ENABLED'] and (burst < 1 or per_hour <= 0):
+            # A bucket that never holds, or never regains, a whole token; disable the limit instead.
+            raise ValueError(f'CONTACT_RATE_LIMIT_{limit.upper()}_BURST must be >= 1 and '
+                             f'CONTACT_RATE_LIMIT_{limit.upper()}_PER_HOUR > 0, '
+                             f'got {burst!r} and {per_hour!r}.')
+        limits[limit] = (burst, per_hour / 3600)
+    limiter: TokenBucketLimiter | SQLiteTokenBucketLimiter | None = None
+    if not app.config['CONTACT_RATE_LIMIT_ENABLED']:
+        limiter = None
+    elif app.config['CONTACT_RATE_LIMIT_BACKEND'] == 'memory':
+        limiter = TokenBucketLimiter(limits)
+    elif app.config['CONTACT_RATE_LIMIT_BACKEND'] == 'sqlite':
+        limiter = SQLiteTokenBucketLimiter(app.config['DATABASE'], limits)
+    else:
+        raise ValueError(f"Unknown CONTACT_RATE_LIMIT_BACKEND {app.config['CONTACT_RATE_LIMIT_BACKEND']!r}, "
+                         f"expected 'memory' or 'sqlite'.")
+    app.config['CONTACT_RATE_LIMITER'] = limiter
@@ -0,0 +1,90 @@
+""" Content-hashed static file URLs, cached by browsers indefinitely. """
+import hashlib
+
+from pathlib import Path
+
+from flask import (current_app,
+                   Flask,
+                   request,
+                   Response,
+                   )
+
+# Hex digits of a file's sha256 used as its fingerprint.
+FINGERPRINT_LENGTH: int = 12
+
+# Suffixes of siblings written by `flask compress-static`.
+PRECOMPRESSED_SUFFIXES: set[str] = {'.br', '.gz'}
+
+
+def build_manifest(static_folder: Path) -> dict[str, str]:
+    """
+    Fingerprint each static file by its content.
+
+    Precompressed siblings are skipped, they are served under the
+    original file's URL.
+
+    :param static_folder: Path
+    :return: dict of {filename relative to static_folder: fingerprint}
+    """
+    return {path.relative_to(static_folder).as_posix():
+                hashlib.sha256(path.read_bytes()).hexdigest()[:FINGERPRINT_LENGTH]
+            for path in sorted(static_folder.rglob('*'))
+            if path.is_file() and path.suffix not in PRECOMPRESSED_SUFFIXES}
+
+
+def fingerprint_static_url(endpoint: str, values: dict) -> None:
+    """
+    Add file's fingerprint to url_for('static', filename=...) URLs, as ?v=.
+
+    Registered as a url_defaults function.
+
+    :param endpoint: str
+    :param values: dict of URL values, updated in place.
+    :return: None
+    """
+    if endpoint != 'static' or 'v' in values:
+        return
+    if fingerprint := current_app.config['STATIC_MANIFEST'].get(values.get('filename')):
+        values['v'] = fingerprint
+
+
+def immutable_cache_headers(response: Response) -> Response:
+    """
+    Let browsers cache static files requested by current fingerprinted URL
+    indefinitely, without revalidating.
+
+    A changed file gets a new URL, so is fetched afresh. Requests with a
+    stale or no fingerprint are cached as normal.
+
+    Registered as an after_request function.
+
+    :param response: Response
+    :return: Response
+    """
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    fingerprint = request.args.get('v')
+    filename = (request.view_args or {}).get('filename')
+    if fingerprint and fingerprint == current_app.config['STATIC_MANIFEST'].get(filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['STATIC_IMMUTABLE_MAX_AGE']
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """
+    Fingerprint static file URLs, if STATIC_FINGERPRINT_ENABLED.
+
+    The manifest is built once, at startup, so restart the app after
+    changing static files.
+
+    :param app: Flask
+    :return: None
+    """
+    if not app.config['STATIC_FINGERPRINT_ENABLED']:
+        return
+    app.config['STATIC_MANIFEST'] = build_manifest(Path(app.static_folder or ''))
+    app.url_defaults(fingerprint_static_url)
+    app.after_request(immutable_cache_headers)
@@ -0,0 +1,40 @@
+""" Token bucket arithmetic, shared by rate limiters holding buckets in memory or the contact database. """
+
+
+def refill_tokens(tokens: float, updated_at: float, now: float, capacity: float, rate: float) -> float:
+    """
+    Tokens in a bucket now, topped up at rate since updated_at.
+
+    :param tokens: float in bucket at updated_at.
+    :param updated_at: float seconds
+    :param now: float seconds
+    :param capacity: float
+    :param rate: float tokens per second.
+    :return: float
+    """
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def wait_for_token(tokens: float, capacity: float, rate: float) -> float:
+    """
+    Seconds until a bucket holding tokens has a whole token.
+
+    :param tokens: float
+    :param capacity: float
+    :param rate: float tokens per second, > 0.
+    :return: float, 0 if it has one now.
+    """
+    return max(0.0, (1 - tokens) / rate)
+
+
+def full_at(tokens: float, now: float, capacity: float, rate: float) -> float:
+    """
+    When a bucket holding tokens now refills to capacity.
+
+    :param tokens: float
+    :param now: float seconds
+    :param capacity: float
+    :param rate: float tokens per second, > 0.
+    :return: float seconds
+    """
+    return now + (capacity - tokens) / rate
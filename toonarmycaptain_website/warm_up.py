@@ -0,0 +1,58 @@
+""" Warm up a worker before it accepts traffic. """
+import importlib
+import time
+
+from flask import Flask
+
+from .export import exportable_paths
+
+
+def warm_up_modules(app: Flask) -> list[str]:
+    """
+    Modules imported lazily, on first use, that warm_up imports up front.
+
+    :param app: Flask
+    :return: list of str module names.
+    """
+    modules = ['toonarmycaptain_website.contact.form']  # Imported by contact route.
+    if app.config['NOTIFICATION_WORKER'] == 'thread':
+        # ezgmail and the Google API client, imported by this process's dispatcher thread.
+        modules.append('toonarmycaptain_website.contact.email_notification')
+    return modules
+
+
+def warm_up(app: Flask) -> dict[str, float]:
+    """
+    Import lazily imported modules, compile all templates and render all
+    static GET pages, so a new worker's first requests are served from
+    warm caches.
+
+    Compiled templates are loaded from the bytecode cache where already
+    compiled, eg by another worker. Rendering fills PAGE_CACHE, and the
+    per-page critical CSS and Link header caches. Pages that error are
+    skipped, they would error when requested too.
+
+    :param app: Flask
+    :return: dict of {step: seconds taken}
+    """
+    timings = {}
+    start = time.perf_counter()
+    with app.app_context():  # contact.form reads config on import.
+        for module in warm_up_modules(app):
+            importlib.import_module(module)
+    timings['import modules'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for template_name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(template_name)
+    timings['compile templates'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client = app.test_client()
+    for path in exportable_paths(app):
+        try:
+            client.get(path).close()
+        except Exception:  # Eg adam_todo's missing template.
+            app.logger.debug('Warm up request to %s failed.', path, exc_info=True)
+    timings['render pages'] = time.perf_counter() - start
+    return timings